@@ -1,9 +1,26 @@
 import os
 import json
+import sys
 from dotenv import load_dotenv
 
-from google.cloud import speech
-from google import genai
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry
+from common.cascade import get_cascade
+from common.concurrency import run_in_thread
+from common.file_uploads import audio_parts
+from common.gemini_call import (
+    agenerate_json,
+    generate_json,
+)
+from common.pronunciation_score import judge
+from common.schemas import get_schema
+from common.word_slices import (
+    plan_slices,
+    recognize_words,
+    slice_parts,
+    with_transcript,
+)
 
 load_dotenv()
 CONFIDENCE_THRESHOLD = 0.9
@@ -11,39 +28,21 @@ CONFIDENCE_THRESHOLD = 0.9
 
 def transcribe_with_sst(audio_path: str) -> tuple[str | None, float]:
     try:
-        client = speech.SpeechClient()
-        with open(audio_path, "rb") as audio_file:
-            content = audio_file.read()
-
-        audio = speech.RecognitionAudio(content=content)
-        config = speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=24000,
-            language_code="en-US",
-            enable_automatic_punctuation=True,
-            enable_word_confidence=True,
-        )
-
-        response = client.recognize(config=config, audio=audio)
-
-        if not response or not response.results:
-            return None, 0.0
-
-        result = response.results[0].alternatives[0]
-        return result.transcript, result.confidence
+        # Kết quả kèm thời điểm và độ tin cậy từng từ được cache lại để bước
+        # phân tích Gemini chỉ gửi các đoạn nghe chưa rõ (plan_slices).
+        result = recognize_words(audio_path)
+        return result["transcript"] or None, result["confidence"]
 
     except Exception as e:
         print(f"Lỗi STT: {e}")
         return None, 0.0
 
 
-def analyze_with_gemini(audio_path: str, target_word: str, user_level: str) -> dict:
-    try:
-        client = genai.Client()
-        with open(audio_path, "rb") as f:
-            audio_file_data = f.read()
-
-        prompt_text = f"""
+@telemetry.timed("build_contents", feature="12")
+def _build_contents(
+    audio_path: str, target_word: str, user_level: str, plan: dict | None
+) -> list:
+    prompt_text = f"""
             Bạn là một chuyên gia huấn luyện phát âm tiếng Anh giọng Mỹ (American English) cho người Việt. Nhiệm vụ của bạn là lắng nghe đoạn âm thanh do người học cung cấp và đưa ra nhận xét chi tiết, hữu ích.
 
             **Bối cảnh:**
@@ -70,42 +69,66 @@ def analyze_with_gemini(audio_path: str, target_word: str, user_level: str) -> d
             }}
         """
 
-        response = client.models.generate_content(
-            model="gemini-1.5-flash",
-            contents=[
-                {
-                    "role": "user",
-                    "parts": [
-                        {"text": prompt_text},
-                        {
-                            "inline_data": {
-                                "mime_type": "audio/wav",
-                                "data": audio_file_data,
-                            }
-                        },
-                    ],
-                }
+    return [
+        {
+            "role": "user",
+            "parts": [
+                {"text": prompt_text},
+                *(slice_parts(plan) if plan else audio_parts(audio_path)),
             ],
-        )
+        }
+    ]
 
-        if not response.text:
-            return {"error": "Gemini không trả về kết quả."}
 
-        cleaned_response = (
-            response.text.strip().replace("```json", "").replace("```", "").strip()
+def analyze_with_gemini(audio_path: str, target_word: str, user_level: str) -> dict:
+    try:
+        plan = plan_slices(audio_path, target_word)
+        result = generate_json(
+            model="gemini-1.5-flash",
+            contents=_build_contents(audio_path, target_word, user_level, plan),
+            schema=get_schema("12"),
         )
-        return json.loads(cleaned_response)
+        return with_transcript(result, plan)
 
     except Exception as e:
         print(f"Lỗi Gemini: {e}")
         return {"error": "Không thể phân tích phát âm bằng Gemini."}
 
 
-def get_pronunciation_feedback(audio_path: str, target_word: str, user_level: str):
-    transcript, confidence = transcribe_with_sst(audio_path)
+async def analyze_with_gemini_async(
+    audio_path: str, target_word: str, user_level: str
+) -> dict:
+    """
+    Phiên bản async của analyze_with_gemini().
+    """
+    try:
+        plan = await run_in_thread(plan_slices, audio_path, target_word)
+        result = await agenerate_json(
+            model="gemini-1.5-flash",
+            contents=await run_in_thread(
+                _build_contents, audio_path, target_word, user_level, plan
+            ),
+            schema=get_schema("12"),
+        )
+        return with_transcript(result, plan)
+
+    except Exception as e:
+        print(f"Lỗi Gemini: {e}")
+        return {"error": "Không thể phân tích phát âm bằng Gemini."}
+
 
+def _quick_feedback(
+    transcript: str | None, confidence: float, target_word: str
+) -> tuple[dict, float]:
+    """
+    Kết luận nhanh từ kết quả STT kèm độ tin cậy của kết luận đó; cascade chuyển
+    sang phân tích chi tiết với Gemini khi độ tin cậy < CONFIDENCE_THRESHOLD.
+    """
     if transcript is None:
-        return {"feedback_type": "error", "message": "Không thể nhận dạng giọng nói."}
+        return {
+            "feedback_type": "error",
+            "message": "Không thể nhận dạng giọng nói.",
+        }, 1.0
 
     normalized_transcript = transcript.lower().strip().replace(".", "")
     normalized_target_word = target_word.lower().strip()
@@ -114,21 +137,82 @@ def get_pronunciation_feedback(audio_path: str, target_word: str, user_level: st
         return {
             "feedback_type": "simple_mistake",
             "message": f"Phát âm chưa đúng. Hệ thống nghe được '{transcript}'.",
-        }
+        }, 1.0
 
-    if confidence >= CONFIDENCE_THRESHOLD:
-        return {"feedback_type": "simple_correct", "message": "Phát âm rất tốt!"}
+    return {
+        "feedback_type": "simple_correct",
+        "message": "Phát âm rất tốt!",
+    }, confidence
+
+
+def _local_feedback(audio_path: str, target_word: str) -> dict | None:
+    """
+    Kết luận ngay từ điểm chấm cục bộ (so với audio mẫu TTS) khi điểm nằm ngoài
+    vùng mơ hồ; None thì chuyển sang STT/Gemini.
+    """
+    result = judge(audio_path, target_word)
+    if result is None:
+        return None
+    verdict, score = result
+    if verdict == "correct":
+        return {
+            "feedback_type": "simple_correct",
+            "message": "Phát âm rất tốt!",
+            "local_score": round(score, 3),
+        }
+    if verdict == "incorrect":
+        return {
+            "feedback_type": "simple_mistake",
+            "message": f"Phát âm chưa giống cách đọc chuẩn của từ '{target_word}'.",
+            "local_score": round(score, 3),
+        }
+    return None
 
-    print(
-        f"Confidence thấp ({confidence}), chuyển sang phân tích chi tiết với Gemini..."
-    )
 
+async def _detailed_async(audio_path: str, target_word: str, user_level: str):
     return {
         "feedback_type": "detailed_analysis",
-        "data": analyze_with_gemini(audio_path, target_word, user_level),
+        "data": await analyze_with_gemini_async(audio_path, target_word, user_level),
     }
 
 
+def get_pronunciation_feedback(audio_path: str, target_word: str, user_level: str):
+    local = _local_feedback(audio_path, target_word)
+    if local is not None:
+        return local
+    # Chạy Gemini song song với STT ngay từ đầu khi tỉ lệ chuyển sang Gemini gần
+    # đây cao: tắt mặc định, bật bằng CASCADE_SPECULATE_12 (ví dụ 0.5). Khi chạy
+    # dự phòng, Gemini đi qua client async để huỷ được nếu STT đủ tin cậy.
+    return get_cascade("12", CONFIDENCE_THRESHOLD).run(
+        lambda: _quick_feedback(*transcribe_with_sst(audio_path), target_word),
+        lambda: {
+            "feedback_type": "detailed_analysis",
+            "data": analyze_with_gemini(audio_path, target_word, user_level),
+        },
+        aexpensive=lambda: _detailed_async(audio_path, target_word, user_level),
+    )
+
+
+async def get_pronunciation_feedback_async(
+    audio_path: str, target_word: str, user_level: str
+):
+    """
+    Phiên bản async của get_pronunciation_feedback(); chấm cục bộ và STT chạy
+    trong thread pool.
+    """
+    local = await run_in_thread(_local_feedback, audio_path, target_word)
+    if local is not None:
+        return local
+
+    async def quick():
+        transcript, confidence = await run_in_thread(transcribe_with_sst, audio_path)
+        return _quick_feedback(transcript, confidence, target_word)
+
+    return await get_cascade("12", CONFIDENCE_THRESHOLD).arun(
+        quick, lambda: _detailed_async(audio_path, target_word, user_level)
+    )
+
+
 if __name__ == "__main__":
     AUDIO_FILE_PATH = "pronunciation.wav"
     TARGET_WORD = "pronunciation"
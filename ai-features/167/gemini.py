@@ -1,22 +1,30 @@
 import os
 import json
+import sys
 from dotenv import load_dotenv
-from google import genai
 from google.cloud import texttospeech
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry
+from common.cloud_clients import get_tts_client, limit
+from common.concurrency import run_in_thread
+from common.gemini_call import (
+    agenerate_json,
+    generate_json,
+)
+from common.response_cache import default_cache
+from common.schemas import get_schema
+from common.singleflight import get_flight
+
 load_dotenv()
 
 
-def translate_vocabulary_with_context(
+@telemetry.timed("build_contents", feature="167")
+def _build_contents(
     selected_word: str, context_sentence: str, target_level: str
-) -> dict:
-    """
-    Sử dụng Gemini để dịch từ vựng theo ngữ cảnh với đầy đủ thông tin phát âm và ví dụ.
-    """
-    try:
-        client = genai.Client()
-
-        prompt_text = f"""
+) -> list:
+    prompt_text = f"""
             Bạn là một chuyên gia ngôn ngữ học và giảng dạy tiếng Anh, chuyên về việc giải thích từ vựng theo ngữ cảnh cho người học Việt Nam.
 
             **Bối cảnh:**
@@ -78,18 +86,43 @@ def translate_vocabulary_with_context(
             }}
         """
 
-        response = client.models.generate_content(
+    return [{"role": "user", "parts": [{"text": prompt_text}]}]
+
+
+def translate_vocabulary_with_context(
+    selected_word: str, context_sentence: str, target_level: str
+) -> dict:
+    """
+    Sử dụng Gemini để dịch từ vựng theo ngữ cảnh với đầy đủ thông tin phát âm và ví dụ.
+    """
+    try:
+        return generate_json(
             model="gemini-2.5-flash",
-            contents=[{"role": "user", "parts": [{"text": prompt_text}]}],
+            contents=_build_contents(selected_word, context_sentence, target_level),
+            schema=get_schema("167"),
+            cache=default_cache(),
+            coalesce=True,
         )
 
-        if not response.text:
-            return {"error": "Gemini không trả về kết quả."}
+    except Exception as e:
+        print(f"Lỗi Gemini: {e}")
+        return {"error": "Không thể dịch từ vựng bằng Gemini."}
+
 
-        cleaned_response = (
-            response.text.strip().replace("```json", "").replace("```", "").strip()
+async def translate_vocabulary_with_context_async(
+    selected_word: str, context_sentence: str, target_level: str
+) -> dict:
+    """
+    Phiên bản async của translate_vocabulary_with_context().
+    """
+    try:
+        return await agenerate_json(
+            model="gemini-2.5-flash",
+            contents=_build_contents(selected_word, context_sentence, target_level),
+            schema=get_schema("167"),
+            cache=default_cache(),
+            coalesce=True,
         )
-        return json.loads(cleaned_response)
 
     except Exception as e:
         print(f"Lỗi Gemini: {e}")
@@ -99,9 +132,15 @@ def translate_vocabulary_with_context(
 def create_pronunciation_audio(text: str, output_file: str) -> str | None:
     """
     Sử dụng Google Cloud Text-to-Speech để tạo file phát âm.
+    Nhiều lời gọi đồng thời với cùng text và output_file chỉ tổng hợp một lần.
     """
+    key = f"{text}\n{os.path.abspath(output_file)}"
+    return get_flight("tts").do(key, _synthesize_pronunciation_audio, text, output_file)
+
+
+def _synthesize_pronunciation_audio(text: str, output_file: str) -> str | None:
     try:
-        client = texttospeech.TextToSpeechClient()
+        client = get_tts_client()
         synthesis_input = texttospeech.SynthesisInput(text=text)
 
         voice = texttospeech.VoiceSelectionParams(
@@ -115,9 +154,13 @@ def create_pronunciation_audio(text: str, output_file: str) -> str | None:
             speaking_rate=0.9,  # Chậm hơn một chút để dễ nghe
         )
 
-        response = client.synthesize_speech(
-            input=synthesis_input, voice=voice, audio_config=audio_config
-        )
+        with telemetry.span(
+            "tts.synthesize_speech", "google-cloud-tts", characters=len(text)
+        ) as span, limit("tts"):
+            response = client.synthesize_speech(
+                input=synthesis_input, voice=voice, audio_config=audio_config
+            )
+            span.set(response_bytes=len(response.audio_content))
 
         with open(output_file, "wb") as out:
             out.write(response.audio_content)
@@ -129,6 +172,13 @@ def create_pronunciation_audio(text: str, output_file: str) -> str | None:
         return None
 
 
+async def create_pronunciation_audio_async(text: str, output_file: str) -> str | None:
+    """
+    Phiên bản async của create_pronunciation_audio(); TTS chạy trong thread pool.
+    """
+    return await run_in_thread(create_pronunciation_audio, text, output_file)
+
+
 def process_vocabulary_translation(
     selected_word: str,
     context_sentence: str,
@@ -162,6 +212,35 @@ def process_vocabulary_translation(
     return translation_result
 
 
+async def process_vocabulary_translation_async(
+    selected_word: str,
+    context_sentence: str,
+    target_level: str,
+    create_audio: bool = True,
+) -> dict:
+    """
+    Phiên bản async của process_vocabulary_translation().
+    """
+    translation_result = await translate_vocabulary_with_context_async(
+        selected_word=selected_word,
+        context_sentence=context_sentence,
+        target_level=target_level,
+    )
+
+    if "error" in translation_result:
+        return translation_result
+
+    if create_audio and "audio_text" in translation_result:
+        audio_filename = f"pronunciation_{selected_word.lower().replace(' ', '_')}.wav"
+        audio_file = await create_pronunciation_audio_async(
+            translation_result["audio_text"], audio_filename
+        )
+        if audio_file:
+            translation_result["pronunciation_audio"] = audio_file
+
+    return translation_result
+
+
 if __name__ == "__main__":
     # Ví dụ demo
     SELECTED_WORD = "score"
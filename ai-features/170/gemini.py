@@ -1,236 +1,292 @@
 import os
 import json
+import sys
 from dotenv import load_dotenv
-from google import genai
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry
+from common.context_cache import system_config
+from common.gemini_call import (
+    agenerate_json,
+    generate_json,
+)
+from common.response_cache import default_cache
+from common.schemas import get_schema
 
 load_dotenv()
 
+ANALYSIS_INSTRUCTION = """
+Bạn là một chuyên gia ngữ pháp tiếng Anh và giảng dạy ESL, chuyên về việc phân tích cấu trúc ngữ pháp cho người học Việt Nam.
+
+**Yêu cầu:**
+1. Phân tích và xác định TẤT CẢ các cấu trúc ngữ pháp có trong câu được chọn.
+2. Với mỗi cấu trúc, giải thích nghĩa và chức năng trong ngữ cảnh của đoạn văn.
+3. Cung cấp công thức/pattern của từng cấu trúc.
+4. Đưa ra 3 ví dụ mẫu cho mỗi cấu trúc với cùng pattern.
+5. Giải thích khi nào và tại sao sử dụng cấu trúc đó.
+6. Cung cấp toàn bộ kết quả dưới dạng một đối tượng JSON duy nhất. **Không thêm bất kỳ văn bản giải thích nào bên ngoài đối tượng JSON này.**
+
+**Cấu trúc JSON đầu ra bắt buộc:**
+{
+  "selected_sentence": "<Câu được chọn>",
+  "paragraph_context": "<Đoạn văn ngữ cảnh>",
+  "level": "<Trình độ người học>",
+  "sentence_analysis": {
+    "sentence_type": "<Loại câu: Simple/Compound/Complex/Compound-Complex>",
+    "main_tense": "<Thì chính của câu>",
+    "sentence_function": "<Chức năng: Statement/Question/Command/Exclamation>"
+  },
+  "grammar_structures": [
+    {
+      "structure_id": 1,
+      "structure_name": "<Tên cấu trúc ngữ pháp>",
+      "pattern": "<Công thức/Pattern của cấu trúc>",
+      "highlighted_part": "<Phần trong câu gốc thể hiện cấu trúc này>",
+      "contextual_meaning": {
+        "vietnamese": "<Ý nghĩa của cấu trúc trong ngữ cảnh này>",
+        "function": "<Chức năng của cấu trúc trong câu>"
+      },
+      "detailed_explanation": {
+        "usage_rules": "<Quy tắc sử dụng cấu trúc này>",
+        "when_to_use": "<Khi nào sử dụng cấu trúc này>",
+        "common_situations": "<Các tình huống thường dùng>",
+        "grammar_notes": "<Ghi chú ngữ pháp đặc biệt>"
+      },
+      "examples": [
+        {
+          "sentence": "<Ví dụ thứ nhất sử dụng cùng cấu trúc>",
+          "translation": "<Bản dịch tiếng Việt>",
+          "explanation": "<Giải thích cách cấu trúc hoạt động trong ví dụ này>"
+        },
+        {
+          "sentence": "<Ví dụ thứ hai sử dụng cùng cấu trúc>",
+          "translation": "<Bản dịch tiếng Việt>",
+          "explanation": "<Giải thích cách cấu trúc hoạt động trong ví dụ này>"
+        },
+        {
+          "sentence": "<Ví dụ thứ ba sử dụng cùng cấu trúc>",
+          "translation": "<Bản dịch tiếng Việt>",
+          "explanation": "<Giải thích cách cấu trúc hoạt động trong ví dụ này>"
+        }
+      ],
+      "common_mistakes": [
+        {
+          "mistake": "<Lỗi thường gặp khi sử dụng cấu trúc này>",
+          "correction": "<Cách sửa lỗi>",
+          "explanation": "<Giải thích tại sao bị lỗi>"
+        }
+      ],
+      "related_structures": [
+        "<Cấu trúc ngữ pháp liên quan thứ nhất>",
+        "<Cấu trúc ngữ pháp liên quan thứ hai>"
+      ]
+    }
+  ],
+  "contextual_analysis": {
+    "paragraph_theme": "<Chủ đề chính của đoạn văn>",
+    "sentence_role": "<Vai trò của câu này trong đoạn văn>",
+    "discourse_markers": "<Các từ nối/liên kết có trong câu>",
+    "register": "<Văn phong: formal/informal/academic/conversational>"
+  },
+  "learning_suggestions": [
+    "<Gợi ý học tập thứ nhất cho cấu trúc này>",
+    "<Gợi ý học tập thứ hai cho cấu trúc này>",
+    "<Gợi ý học tập thứ ba cho cấu trúc này>"
+  ]
+}
+
+**Lưu ý quan trọng:**
+- Phân tích TẤT CẢ cấu trúc ngữ pháp trong câu, từ cơ bản đến phức tạp.
+- Giải thích phù hợp với trình độ của người học.
+- Tập trung vào cách cấu trúc hoạt động trong ngữ cảnh cụ thể.
+- Ví dụ phải đa dạng và thực tế.
+"""
 
-def analyze_grammar_structures(
-    selected_sentence: str, paragraph_context: str, target_level: str
-) -> dict:
-    """
-    Sử dụng Gemini để phân tích các cấu trúc ngữ pháp có trong câu được chọn.
-    """
-    try:
-        client = genai.Client()
 
-        prompt_text = f"""
-            Bạn là một chuyên gia ngữ pháp tiếng Anh và giảng dạy ESL, chuyên về việc phân tích cấu trúc ngữ pháp cho người học Việt Nam.
+DETAILS_INSTRUCTION = """
+Bạn là một chuyên gia ngữ pháp tiếng Anh, chuyên về việc giải thích cấu trúc ngữ pháp chi tiết cho người học Việt Nam.
+
+**Cấu trúc JSON đầu ra bắt buộc:**
+{
+  "structure_name": "<Tên cấu trúc ngữ pháp>",
+  "level": "<Trình độ người học>",
+  "comprehensive_info": {
+    "definition": "<Định nghĩa cấu trúc bằng tiếng Việt>",
+    "pattern": "<Công thức/Pattern chính xác>",
+    "variations": ["<Biến thể 1>", "<Biến thể 2>", "<Biến thể 3>"],
+    "formation_rules": "<Quy tắc tạo thành cấu trúc>"
+  },
+  "usage_contexts": {
+    "when_to_use": "<Khi nào sử dụng cấu trúc này>",
+    "common_situations": [
+      "<Tình huống sử dụng 1>",
+      "<Tình huống sử dụng 2>", 
+      "<Tình huống sử dụng 3>"
+    ],
+    "register": "<Văn phong thích hợp: formal/informal/both>",
+    "frequency": "<Mức độ phổ biến: very common/common/less common>"
+  },
+  "detailed_examples": [
+    {
+      "category": "<Loại ví dụ: Basic/Intermediate/Advanced>",
+      "sentence": "<Câu ví dụ>",
+      "translation": "<Bản dịch tiếng Việt>",
+      "breakdown": "<Phân tích từng phần của cấu trúc>",
+      "context": "<Ngữ cảnh sử dụng ví dụ này>"
+    },
+    {
+      "category": "<Loại ví dụ: Basic/Intermediate/Advanced>",
+      "sentence": "<Câu ví dụ>",
+      "translation": "<Bản dịch tiếng Việt>",
+      "breakdown": "<Phân tích từng phần của cấu trúc>",
+      "context": "<Ngữ cảnh sử dụng ví dụ này>"
+    },
+    {
+      "category": "<Loại ví dụ: Basic/Intermediate/Advanced>",
+      "sentence": "<Câu ví dụ>",
+      "translation": "<Bản dịch tiếng Việt>",
+      "breakdown": "<Phân tích từng phần của cấu trúc>",
+      "context": "<Ngữ cảnh sử dụng ví dụ này>"  
+    }
+  ],
+  "comparison_with_similar": [
+    {
+      "similar_structure": "<Cấu trúc tương tự>",
+      "difference": "<Sự khác biệt chính>",
+      "example_comparison": "<Ví dụ so sánh>"
+    }
+  ],
+  "common_errors": [
+    {
+      "error_type": "<Loại lỗi>",
+      "wrong_example": "<Ví dụ sai>",
+      "correct_example": "<Ví dụ đúng>",
+      "explanation": "<Giải thích lỗi>",
+      "prevention_tip": "<Mẹo tránh lỗi>"
+    }
+  ],
+  "practice_exercises": [
+    {
+      "exercise_type": "<Loại bài tập: Fill in blanks/Transform/Choose correct>",
+      "question": "<Câu hỏi bài tập>",
+      "answer": "<Đáp án>",
+      "explanation": "<Giải thích đáp án>"
+    },
+    {
+      "exercise_type": "<Loại bài tập>",
+      "question": "<Câu hỏi bài tập>",
+      "answer": "<Đáp án>",
+      "explanation": "<Giải thích đáp án>"
+    }
+  ],
+  "learning_progression": {
+    "prerequisite_knowledge": ["<Kiến thức cần có trước>"],
+    "next_level_structures": ["<Cấu trúc nâng cao tiếp theo>"],
+    "practice_recommendations": "<Gợi ý luyện tập>"
+  }
+}
+"""
+
 
+@telemetry.timed("build_contents", feature="170")
+def _build_analysis_contents(
+    selected_sentence: str, paragraph_context: str, target_level: str
+) -> list:
+    prompt_text = f"""
             **Bối cảnh:**
             - Câu được chọn: "{selected_sentence}"
             - Đoạn văn ngữ cảnh: "{paragraph_context}"
             - Trình độ người học: "{target_level}"
-
-            **Yêu cầu:**
-            1. Phân tích và xác định TẤT CẢ các cấu trúc ngữ pháp có trong câu "{selected_sentence}".
-            2. Với mỗi cấu trúc, giải thích nghĩa và chức năng trong ngữ cảnh của đoạn văn.
-            3. Cung cấp công thức/pattern của từng cấu trúc.
-            4. Đưa ra 3 ví dụ mẫu cho mỗi cấu trúc với cùng pattern.
-            5. Giải thích khi nào và tại sao sử dụng cấu trúc đó.
-            6. Cung cấp toàn bộ kết quả dưới dạng một đối tượng JSON duy nhất. **Không thêm bất kỳ văn bản giải thích nào bên ngoài đối tượng JSON này.**
-
-            **Cấu trúc JSON đầu ra bắt buộc:**
-            {{
-              "selected_sentence": "{selected_sentence}",
-              "paragraph_context": "{paragraph_context}",
-              "level": "{target_level}",
-              "sentence_analysis": {{
-                "sentence_type": "<Loại câu: Simple/Compound/Complex/Compound-Complex>",
-                "main_tense": "<Thì chính của câu>",
-                "sentence_function": "<Chức năng: Statement/Question/Command/Exclamation>"
-              }},
-              "grammar_structures": [
-                {{
-                  "structure_id": 1,
-                  "structure_name": "<Tên cấu trúc ngữ pháp>",
-                  "pattern": "<Công thức/Pattern của cấu trúc>",
-                  "highlighted_part": "<Phần trong câu gốc thể hiện cấu trúc này>",
-                  "contextual_meaning": {{
-                    "vietnamese": "<Ý nghĩa của cấu trúc trong ngữ cảnh này>",
-                    "function": "<Chức năng của cấu trúc trong câu>"
-                  }},
-                  "detailed_explanation": {{
-                    "usage_rules": "<Quy tắc sử dụng cấu trúc này>",
-                    "when_to_use": "<Khi nào sử dụng cấu trúc này>",
-                    "common_situations": "<Các tình huống thường dùng>",
-                    "grammar_notes": "<Ghi chú ngữ pháp đặc biệt>"
-                  }},
-                  "examples": [
-                    {{
-                      "sentence": "<Ví dụ thứ nhất sử dụng cùng cấu trúc>",
-                      "translation": "<Bản dịch tiếng Việt>",
-                      "explanation": "<Giải thích cách cấu trúc hoạt động trong ví dụ này>"
-                    }},
-                    {{
-                      "sentence": "<Ví dụ thứ hai sử dụng cùng cấu trúc>",
-                      "translation": "<Bản dịch tiếng Việt>",
-                      "explanation": "<Giải thích cách cấu trúc hoạt động trong ví dụ này>"
-                    }},
-                    {{
-                      "sentence": "<Ví dụ thứ ba sử dụng cùng cấu trúc>",
-                      "translation": "<Bản dịch tiếng Việt>",
-                      "explanation": "<Giải thích cách cấu trúc hoạt động trong ví dụ này>"
-                    }}
-                  ],
-                  "common_mistakes": [
-                    {{
-                      "mistake": "<Lỗi thường gặp khi sử dụng cấu trúc này>",
-                      "correction": "<Cách sửa lỗi>",
-                      "explanation": "<Giải thích tại sao bị lỗi>"
-                    }}
-                  ],
-                  "related_structures": [
-                    "<Cấu trúc ngữ pháp liên quan thứ nhất>",
-                    "<Cấu trúc ngữ pháp liên quan thứ hai>"
-                  ]
-                }}
-              ],
-              "contextual_analysis": {{
-                "paragraph_theme": "<Chủ đề chính của đoạn văn>",
-                "sentence_role": "<Vai trò của câu này trong đoạn văn>",
-                "discourse_markers": "<Các từ nối/liên kết có trong câu>",
-                "register": "<Văn phong: formal/informal/academic/conversational>"
-              }},
-              "learning_suggestions": [
-                "<Gợi ý học tập thứ nhất cho cấu trúc này>",
-                "<Gợi ý học tập thứ hai cho cấu trúc này>",
-                "<Gợi ý học tập thứ ba cho cấu trúc này>"
-              ]
-            }}
-
-            **Lưu ý quan trọng:**
-            - Phân tích TẤT CẢ cấu trúc ngữ pháp trong câu, từ cơ bản đến phức tạp.
-            - Giải thích phù hợp với trình độ "{target_level}".
-            - Tập trung vào cách cấu trúc hoạt động trong ngữ cảnh cụ thể.
-            - Ví dụ phải đa dạng và thực tế.
         """
 
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[{"role": "user", "parts": [{"text": prompt_text}]}],
-        )
+    return [{"role": "user", "parts": [{"text": prompt_text}]}]
 
-        if not response.text:
-            return {"error": "Gemini không trả về kết quả."}
 
-        cleaned_response = (
-            response.text.strip().replace("```json", "").replace("```", "").strip()
+def analyze_grammar_structures(
+    selected_sentence: str, paragraph_context: str, target_level: str
+) -> dict:
+    """
+    Sử dụng Gemini để phân tích các cấu trúc ngữ pháp có trong câu được chọn.
+    """
+    try:
+        return generate_json(
+            model="gemini-2.5-flash",
+            contents=_build_analysis_contents(
+                selected_sentence, paragraph_context, target_level
+            ),
+            schema=get_schema("170.analysis"),
+            config=system_config("170.analysis", ANALYSIS_INSTRUCTION),
         )
-        return json.loads(cleaned_response)
 
     except Exception as e:
         print(f"Lỗi Gemini: {e}")
         return {"error": "Không thể phân tích cấu trúc ngữ pháp bằng Gemini."}
 
 
-def get_structure_details(structure_name: str, target_level: str) -> dict:
+async def analyze_grammar_structures_async(
+    selected_sentence: str, paragraph_context: str, target_level: str
+) -> dict:
     """
-    Lấy thông tin chi tiết về một cấu trúc ngữ pháp cụ thể.
+    Phiên bản async của analyze_grammar_structures().
     """
     try:
-        client = genai.Client()
+        return await agenerate_json(
+            model="gemini-2.5-flash",
+            contents=_build_analysis_contents(
+                selected_sentence, paragraph_context, target_level
+            ),
+            schema=get_schema("170.analysis"),
+            config=system_config("170.analysis", ANALYSIS_INSTRUCTION),
+        )
+
+    except Exception as e:
+        print(f"Lỗi Gemini: {e}")
+        return {"error": "Không thể phân tích cấu trúc ngữ pháp bằng Gemini."}
 
-        prompt_text = f"""
-            Bạn là một chuyên gia ngữ pháp tiếng Anh, chuyên về việc giải thích cấu trúc ngữ pháp chi tiết cho người học Việt Nam.
 
+@telemetry.timed("build_contents", feature="170")
+def _build_details_contents(structure_name: str, target_level: str) -> list:
+    prompt_text = f"""
             **Yêu cầu:**
             Cung cấp thông tin đầy đủ về cấu trúc ngữ pháp "{structure_name}" phù hợp với trình độ "{target_level}".
-
-            **Cấu trúc JSON đầu ra bắt buộc:**
-            {{
-              "structure_name": "{structure_name}",
-              "level": "{target_level}",
-              "comprehensive_info": {{
-                "definition": "<Định nghĩa cấu trúc bằng tiếng Việt>",
-                "pattern": "<Công thức/Pattern chính xác>",
-                "variations": ["<Biến thể 1>", "<Biến thể 2>", "<Biến thể 3>"],
-                "formation_rules": "<Quy tắc tạo thành cấu trúc>"
-              }},
-              "usage_contexts": {{
-                "when_to_use": "<Khi nào sử dụng cấu trúc này>",
-                "common_situations": [
-                  "<Tình huống sử dụng 1>",
-                  "<Tình huống sử dụng 2>", 
-                  "<Tình huống sử dụng 3>"
-                ],
-                "register": "<Văn phong thích hợp: formal/informal/both>",
-                "frequency": "<Mức độ phổ biến: very common/common/less common>"
-              }},
-              "detailed_examples": [
-                {{
-                  "category": "<Loại ví dụ: Basic/Intermediate/Advanced>",
-                  "sentence": "<Câu ví dụ>",
-                  "translation": "<Bản dịch tiếng Việt>",
-                  "breakdown": "<Phân tích từng phần của cấu trúc>",
-                  "context": "<Ngữ cảnh sử dụng ví dụ này>"
-                }},
-                {{
-                  "category": "<Loại ví dụ: Basic/Intermediate/Advanced>",
-                  "sentence": "<Câu ví dụ>",
-                  "translation": "<Bản dịch tiếng Việt>",
-                  "breakdown": "<Phân tích từng phần của cấu trúc>",
-                  "context": "<Ngữ cảnh sử dụng ví dụ này>"
-                }},
-                {{
-                  "category": "<Loại ví dụ: Basic/Intermediate/Advanced>",
-                  "sentence": "<Câu ví dụ>",
-                  "translation": "<Bản dịch tiếng Việt>",
-                  "breakdown": "<Phân tích từng phần của cấu trúc>",
-                  "context": "<Ngữ cảnh sử dụng ví dụ này>"  
-                }}
-              ],
-              "comparison_with_similar": [
-                {{
-                  "similar_structure": "<Cấu trúc tương tự>",
-                  "difference": "<Sự khác biệt chính>",
-                  "example_comparison": "<Ví dụ so sánh>"
-                }}
-              ],
-              "common_errors": [
-                {{
-                  "error_type": "<Loại lỗi>",
-                  "wrong_example": "<Ví dụ sai>",
-                  "correct_example": "<Ví dụ đúng>",
-                  "explanation": "<Giải thích lỗi>",
-                  "prevention_tip": "<Mẹo tránh lỗi>"
-                }}
-              ],
-              "practice_exercises": [
-                {{
-                  "exercise_type": "<Loại bài tập: Fill in blanks/Transform/Choose correct>",
-                  "question": "<Câu hỏi bài tập>",
-                  "answer": "<Đáp án>",
-                  "explanation": "<Giải thích đáp án>"
-                }},
-                {{
-                  "exercise_type": "<Loại bài tập>",
-                  "question": "<Câu hỏi bài tập>",
-                  "answer": "<Đáp án>",
-                  "explanation": "<Giải thích đáp án>"
-                }}
-              ],
-              "learning_progression": {{
-                "prerequisite_knowledge": ["<Kiến thức cần có trước>"],
-                "next_level_structures": ["<Cấu trúc nâng cao tiếp theo>"],
-                "practice_recommendations": "<Gợi ý luyện tập>"
-              }}
-            }}
         """
 
-        response = client.models.generate_content(
+    return [{"role": "user", "parts": [{"text": prompt_text}]}]
+
+
+def get_structure_details(structure_name: str, target_level: str) -> dict:
+    """
+    Lấy thông tin chi tiết về một cấu trúc ngữ pháp cụ thể.
+    """
+    try:
+        return generate_json(
             model="gemini-2.5-flash",
-            contents=[{"role": "user", "parts": [{"text": prompt_text}]}],
+            contents=_build_details_contents(structure_name, target_level),
+            schema=get_schema("170.details"),
+            config=system_config("170.details", DETAILS_INSTRUCTION),
+            cache=default_cache(),
+            coalesce=True,
         )
 
-        if not response.text:
-            return {"error": "Gemini không trả về kết quả."}
+    except Exception as e:
+        print(f"Lỗi Gemini: {e}")
+        return {"error": "Không thể lấy thông tin chi tiết cấu trúc ngữ pháp."}
+
 
-        cleaned_response = (
-            response.text.strip().replace("```json", "").replace("```", "").strip()
+async def get_structure_details_async(structure_name: str, target_level: str) -> dict:
+    """
+    Phiên bản async của get_structure_details().
+    """
+    try:
+        return await agenerate_json(
+            model="gemini-2.5-flash",
+            contents=_build_details_contents(structure_name, target_level),
+            schema=get_schema("170.details"),
+            config=system_config("170.details", DETAILS_INSTRUCTION),
+            cache=default_cache(),
+            coalesce=True,
         )
-        return json.loads(cleaned_response)
 
     except Exception as e:
         print(f"Lỗi Gemini: {e}")
@@ -263,6 +319,27 @@ def process_grammar_analysis(
     return analysis_result
 
 
+async def process_grammar_analysis_async(
+    selected_sentence: str, paragraph_context: str, target_level: str
+) -> dict:
+    """
+    Phiên bản async của process_grammar_analysis().
+    """
+    analysis_result = await analyze_grammar_structures_async(
+        selected_sentence=selected_sentence,
+        paragraph_context=paragraph_context,
+        target_level=target_level,
+    )
+
+    if "error" in analysis_result:
+        return analysis_result
+
+    if "grammar_structures" in analysis_result:
+        analysis_result["structures_count"] = len(analysis_result["grammar_structures"])
+
+    return analysis_result
+
+
 if __name__ == "__main__":
     # Ví dụ demo
     SELECTED_SENTENCE = "If I had studied harder, I would have passed the exam easily."
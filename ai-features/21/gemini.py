@@ -1,22 +1,27 @@
+import os
 import json
+import sys
 from dotenv import load_dotenv
-from google import genai
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry
+from common.gemini_call import (
+    agenerate_json,
+    generate_json,
+)
+from common.schemas import get_schema
 
 load_dotenv()
 
 
-def generate_grammar_exercise(
+@telemetry.timed("build_contents", feature="21")
+def _build_contents(
     grammar_structures: list, num_questions: int, target_level: str, exercise_type: str
-) -> dict:
-    """
-    Sử dụng Gemini để tạo bài tập ngữ pháp theo yêu cầu.
-    """
-    try:
-        grammar_str = ", ".join(f'"{g}"' for g in grammar_structures)
-
-        client = genai.Client()
+) -> list:
+    grammar_str = ", ".join(f'"{g}"' for g in grammar_structures)
 
-        prompt_text = f"""
+    prompt_text = f"""
             Bạn là một chuyên gia tạo nội dung học liệu tiếng Anh, chuyên thiết kế bài tập ngữ pháp cho người học Việt Nam.
 
             **Bối cảnh:**
@@ -48,18 +53,43 @@ def generate_grammar_exercise(
             }}
         """
 
-        response = client.models.generate_content(
+    return [{"role": "user", "parts": [{"text": prompt_text}]}]
+
+
+def generate_grammar_exercise(
+    grammar_structures: list, num_questions: int, target_level: str, exercise_type: str
+) -> dict:
+    """
+    Sử dụng Gemini để tạo bài tập ngữ pháp theo yêu cầu.
+    """
+    try:
+        return generate_json(
             model="gemini-2.5-flash",
-            contents=[{"role": "user", "parts": [{"text": prompt_text}]}],
+            contents=_build_contents(
+                grammar_structures, num_questions, target_level, exercise_type
+            ),
+            schema=get_schema("21"),
         )
 
-        if not response.text:
-            return {"error": "Gemini không trả về kết quả."}
+    except Exception as e:
+        print(f"Lỗi Gemini: {e}")
+        return {"error": "Không thể tạo bài tập bằng Gemini."}
+
 
-        cleaned_response = (
-            response.text.strip().replace("```json", "").replace("```", "").strip()
+async def generate_grammar_exercise_async(
+    grammar_structures: list, num_questions: int, target_level: str, exercise_type: str
+) -> dict:
+    """
+    Phiên bản async của generate_grammar_exercise().
+    """
+    try:
+        return await agenerate_json(
+            model="gemini-2.5-flash",
+            contents=_build_contents(
+                grammar_structures, num_questions, target_level, exercise_type
+            ),
+            schema=get_schema("21"),
         )
-        return json.loads(cleaned_response)
 
     except Exception as e:
         print(f"Lỗi Gemini: {e}")
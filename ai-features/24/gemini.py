@@ -1,23 +1,36 @@
 import os
 import json
+import re
+import sys
+from difflib import SequenceMatcher
 from dotenv import load_dotenv
-from google import genai
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry
+from common.audio import DEFAULT_SAMPLE_RATE
+from common.cascade import ESCALATION_MODEL, cheap_model, get_cascade, score_confidence
+from common.concurrency import run_in_thread
+from common.file_uploads import audio_parts
+from common.gemini_call import (
+    agenerate_json,
+    generate_json,
+)
+from common.schemas import get_schema
+from common.streaming_stt import astream_transcribe, stream_transcribe
 
 load_dotenv()
 
+# Ngưỡng phân loại điểm phát âm (cần luyện thêm / khá / tốt): điểm cách ngưỡng
+# dưới 5 điểm được phân tích lại bằng model mạnh.
+SCORE_CUT_POINTS = (50, 80)
+SCORE_MARGIN = 10
+CASCADE_THRESHOLD = 0.5
 
-def analyze_sentence_pronunciation(
-    audio_path: str, target_sentence: str, user_level: str
-) -> dict:
-    """
-    Sử dụng Gemini để phân tích phát âm cho cả một câu hoặc đoạn văn.
-    """
-    try:
-        client = genai.Client()
-        with open(audio_path, "rb") as f:
-            audio_file_data = f.read()
 
-        prompt_text = f"""
+@telemetry.timed("build_contents", feature="24")
+def _build_contents(audio_path: str, target_sentence: str, user_level: str) -> list:
+    prompt_text = f"""
             Bạn là một chuyên gia huấn luyện phát âm tiếng Anh giọng Mỹ (American English) cho người Việt. Nhiệm vụ của bạn là lắng nghe đoạn âm thanh người học đọc một câu/đoạn văn và đưa ra nhận xét toàn diện.
 
             **Bối cảnh:**
@@ -53,37 +66,175 @@ def analyze_sentence_pronunciation(
             - Phản hồi cần tích cực, dễ hiểu cho người có trình độ "{user_level}".
         """
 
-        response = client.models.generate_content(
-            model="gemini-1.5-flash",
-            contents=[
-                {
-                    "role": "user",
-                    "parts": [
-                        {"text": prompt_text},
-                        {
-                            "inline_data": {
-                                "mime_type": "audio/wav",
-                                "data": audio_file_data,
-                            }
-                        },
-                    ],
-                }
-            ],
+    # Luôn gửi cả bản ghi (không cắt đoạn theo common.word_slices): điểm tổng,
+    # transcript và nhận xét ngữ điệu tính trên cả câu, và cascade dựa vào
+    # overall_score để quyết định chuyển tầng.
+    return [
+        {
+            "role": "user",
+            "parts": [{"text": prompt_text}, *audio_parts(audio_path)],
+        }
+    ]
+
+
+def _analyze(
+    model: str, audio_path: str, target_sentence: str, user_level: str
+) -> dict:
+    try:
+        return generate_json(
+            model=model,
+            contents=_build_contents(audio_path, target_sentence, user_level),
+            schema=get_schema("24"),
         )
 
-        if not response.text:
-            return {"error": "Gemini không trả về kết quả."}
+    except Exception as e:
+        print(f"Lỗi Gemini: {e}")
+        return {"error": "Không thể phân tích phát âm bằng Gemini."}
+
 
-        cleaned_response = (
-            response.text.strip().replace("```json", "").replace("```", "").strip()
+async def _aanalyze(
+    model: str, audio_path: str, target_sentence: str, user_level: str
+) -> dict:
+    try:
+        return await agenerate_json(
+            model=model,
+            contents=await run_in_thread(
+                _build_contents, audio_path, target_sentence, user_level
+            ),
+            schema=get_schema("24"),
         )
-        return json.loads(cleaned_response)
 
     except Exception as e:
         print(f"Lỗi Gemini: {e}")
         return {"error": "Không thể phân tích phát âm bằng Gemini."}
 
 
+def _confidence(result: dict) -> tuple[dict, float]:
+    return score_confidence(result, "overall_score", SCORE_CUT_POINTS, SCORE_MARGIN)
+
+
+def analyze_sentence_pronunciation(
+    audio_path: str, target_sentence: str, user_level: str
+) -> dict:
+    """
+    Sử dụng Gemini để phân tích phát âm cho cả một câu hoặc đoạn văn.
+    Phân tích bằng model nhỏ trước, chỉ chuyển lên gemini-2.5-flash khi điểm
+    nằm sát ngưỡng phân loại.
+    """
+    args = (audio_path, target_sentence, user_level)
+    return get_cascade("24", CASCADE_THRESHOLD).run(
+        lambda: _confidence(_analyze(cheap_model(), *args)),
+        lambda: _analyze(ESCALATION_MODEL, *args),
+    )
+
+
+async def analyze_sentence_pronunciation_async(
+    audio_path: str, target_sentence: str, user_level: str
+) -> dict:
+    """
+    Phiên bản async của analyze_sentence_pronunciation().
+    """
+    args = (audio_path, target_sentence, user_level)
+
+    async def cheap():
+        return _confidence(await _aanalyze(cheap_model(), *args))
+
+    return await get_cascade("24", CASCADE_THRESHOLD).arun(
+        cheap, lambda: _aanalyze(ESCALATION_MODEL, *args)
+    )
+
+
+def _words(text: str) -> list[str]:
+    return re.findall(r"[A-Za-z0-9']+", text)
+
+
+def follow_reading(transcript: str, target_sentence: str) -> dict:
+    """
+    So khớp phần đã nghe được với câu mẫu. Mỗi từ của câu mẫu có trạng thái
+    "correct", "mismatch" (nghe thành từ khác), "skipped" (bị bỏ qua) hoặc
+    "pending" (chưa đọc tới); progress là tỉ lệ câu mẫu đã đọc qua.
+    """
+    target = _words(target_sentence)
+    heard = _words(transcript)
+    matcher = SequenceMatcher(
+        a=[word.lower() for word in target],
+        b=[word.lower() for word in heard],
+        autojunk=False,
+    )
+    words = [{"word": word, "status": "pending", "heard": None} for word in target]
+    reached = 0
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for offset in range(i2 - i1):
+                words[i1 + offset].update(status="correct", heard=heard[j1 + offset])
+            reached = i2
+        elif tag == "replace":
+            # Ghép từng cặp; từ mẫu dư ra giữ "pending", từ nghe dư ra gộp vào
+            # từ mẫu cuối cùng của cặp.
+            count = min(i2 - i1, j2 - j1)
+            for offset in range(count):
+                spoken = heard[j1 + offset : j1 + offset + 1]
+                if offset == count - 1:
+                    spoken = heard[j1 + offset : j2]
+                words[i1 + offset].update(status="mismatch", heard=" ".join(spoken))
+            reached = i1 + count
+    # Từ bị bỏ qua chỉ tính khi người học đã đọc tới đoạn phía sau nó.
+    for word in words[:reached]:
+        if word["status"] == "pending":
+            word["status"] = "skipped"
+    return {
+        "words": words,
+        "progress": round(reached / len(target), 3) if target else 1.0,
+    }
+
+
+def _live_feedback(event: dict, state: dict, target_sentence: str) -> dict:
+    transcript = f"{state['final']} {event['transcript']}".strip()
+    if event["is_final"]:
+        state["final"] = transcript
+        state["timings"] += event["words"]
+    return {
+        "is_final": event["is_final"],
+        "transcript": transcript,
+        **follow_reading(transcript, target_sentence),
+        "word_timings": list(state["timings"]),
+    }
+
+
+def analyze_sentence_pronunciation_live(
+    audio_chunks, target_sentence: str, sample_rate: int = DEFAULT_SAMPLE_RATE
+):
+    """
+    Phản hồi trong lúc người học còn đang đọc: audio_chunks là các đoạn
+    LINEAR16 mono vừa thu (ví dụ từ websocket của trang index.html), mỗi kết
+    quả STT (tạm hoặc chốt) yield một dict gồm transcript đã nghe, trạng thái
+    từng từ của câu mẫu (follow_reading), progress và word_timings (thời điểm
+    các từ đã chốt). Đọc xong có thể gọi analyze_sentence_pronunciation() với
+    bản ghi đầy đủ để có nhận xét chi tiết.
+    """
+    state = {"final": "", "timings": []}
+    for event in stream_transcribe(audio_chunks, sample_rate):
+        if "error" in event:
+            yield event
+            return
+        yield _live_feedback(event, state, target_sentence)
+
+
+async def analyze_sentence_pronunciation_live_async(
+    audio_chunks, target_sentence: str, sample_rate: int = DEFAULT_SAMPLE_RATE
+):
+    """
+    Phiên bản async của analyze_sentence_pronunciation_live(); audio_chunks là
+    async iterator.
+    """
+    state = {"final": "", "timings": []}
+    async for event in astream_transcribe(audio_chunks, sample_rate):
+        if "error" in event:
+            yield event
+            return
+        yield _live_feedback(event, state, target_sentence)
+
+
 if __name__ == "__main__":
     TARGET_SENTENCE = "My name is Nguyen Van Tai. I am a software developer. I love programming. I also love music. I love to travel and explore new places. I enjoy reading books and watching movies in my free time. I am passionate about learning new technology and improving my skills. I believe in continuous growth and self-improvement. I am excited about the future and the opportunity it holds."
     AUDIO_FILE_PATH = "sentence_pronunciation.wav"
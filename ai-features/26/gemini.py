@@ -1,21 +1,25 @@
 import os
 import json
+import sys
 from dotenv import load_dotenv
-from google import genai
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry
+from common.gemini_call import (
+    agenerate_json,
+    generate_json,
+)
+from common.schemas import get_schema
 
 load_dotenv()
 
 
-def generate_pronunciation_exercise(
+@telemetry.timed("build_contents", feature="26")
+def _build_contents(
     pronunciation_focus: str, exercise_type: str, num_sentences: int, target_level: str
-) -> dict:
-    """
-    Sử dụng Gemini để tạo bài tập phát âm theo một chủ điểm cụ thể.
-    """
-    try:
-        client = genai.Client()
-
-        prompt_text = f"""
+) -> list:
+    prompt_text = f"""
             Bạn là một chuyên gia ngữ âm và huấn luyện viên phát âm tiếng Anh, chuyên thiết kế bài tập thực hành cho người học Việt Nam.
 
             **Bối cảnh:**
@@ -47,18 +51,43 @@ def generate_pronunciation_exercise(
             }}
         """
 
-        response = client.models.generate_content(
+    return [{"role": "user", "parts": [{"text": prompt_text}]}]
+
+
+def generate_pronunciation_exercise(
+    pronunciation_focus: str, exercise_type: str, num_sentences: int, target_level: str
+) -> dict:
+    """
+    Sử dụng Gemini để tạo bài tập phát âm theo một chủ điểm cụ thể.
+    """
+    try:
+        return generate_json(
             model="gemini-2.5-flash",
-            contents=[{"role": "user", "parts": [{"text": prompt_text}]}],
+            contents=_build_contents(
+                pronunciation_focus, exercise_type, num_sentences, target_level
+            ),
+            schema=get_schema("26"),
         )
 
-        if not response.text:
-            return {"error": "Gemini không trả về kết quả."}
+    except Exception as e:
+        print(f"Lỗi Gemini: {e}")
+        return {"error": "Không thể tạo bài tập bằng Gemini."}
+
 
-        cleaned_response = (
-            response.text.strip().replace("```json", "").replace("```", "").strip()
+async def generate_pronunciation_exercise_async(
+    pronunciation_focus: str, exercise_type: str, num_sentences: int, target_level: str
+) -> dict:
+    """
+    Phiên bản async của generate_pronunciation_exercise().
+    """
+    try:
+        return await agenerate_json(
+            model="gemini-2.5-flash",
+            contents=_build_contents(
+                pronunciation_focus, exercise_type, num_sentences, target_level
+            ),
+            schema=get_schema("26"),
         )
-        return json.loads(cleaned_response)
 
     except Exception as e:
         print(f"Lỗi Gemini: {e}")
@@ -1,21 +1,27 @@
 import os
 import json
+import sys
 from dotenv import load_dotenv
 
-from google import genai
 from google.cloud import texttospeech
 
-load_dotenv()
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
+from common import telemetry
+from common.cloud_clients import get_tts_client, limit
+from common.concurrency import run_in_thread
+from common.gemini_call import (
+    agenerate_json,
+    generate_json,
+)
+from common.schemas import get_schema
 
-def generate_listening_content(topic: str, num_blanks: int, target_level: str) -> dict:
-    """
-    Sử dụng Gemini để tạo nội dung cho bài tập nghe.
-    """
-    try:
-        client = genai.Client()
+load_dotenv()
 
-        prompt_text = f"""
+
+@telemetry.timed("build_contents", feature="30")
+def _build_contents(topic: str, num_blanks: int, target_level: str) -> list:
+    prompt_text = f"""
             Bạn là một chuyên gia tạo học liệu tiếng Anh, chuyên thiết kế các bài tập nghe cho người học Việt Nam.
 
             **Bối cảnh:**
@@ -39,18 +45,37 @@ def generate_listening_content(topic: str, num_blanks: int, target_level: str) -
             }}
         """
 
-        response = client.models.generate_content(
+    return [{"role": "user", "parts": [{"text": prompt_text}]}]
+
+
+def generate_listening_content(topic: str, num_blanks: int, target_level: str) -> dict:
+    """
+    Sử dụng Gemini để tạo nội dung cho bài tập nghe.
+    """
+    try:
+        return generate_json(
             model="gemini-2.5-flash",
-            contents=[{"role": "user", "parts": [{"text": prompt_text}]}],
+            contents=_build_contents(topic, num_blanks, target_level),
+            schema=get_schema("30"),
         )
 
-        if not response.text:
-            return {"error": "Gemini không trả về kết quả."}
+    except Exception as e:
+        print(f"Lỗi Gemini: {e}")
+        return {"error": "Không thể tạo nội dung bài nghe."}
 
-        cleaned_response = (
-            response.text.strip().replace("```json", "").replace("```", "").strip()
+
+async def generate_listening_content_async(
+    topic: str, num_blanks: int, target_level: str
+) -> dict:
+    """
+    Phiên bản async của generate_listening_content().
+    """
+    try:
+        return await agenerate_json(
+            model="gemini-2.5-flash",
+            contents=_build_contents(topic, num_blanks, target_level),
+            schema=get_schema("30"),
         )
-        return json.loads(cleaned_response)
 
     except Exception as e:
         print(f"Lỗi Gemini: {e}")
@@ -62,7 +87,7 @@ def create_audio_from_text(text: str, output_file: str) -> str | None:
     Sử dụng Google Cloud Text-to-Speech để tạo file audio.
     """
     try:
-        client = texttospeech.TextToSpeechClient()
+        client = get_tts_client()
         synthesis_input = texttospeech.SynthesisInput(text=text)
         voice = texttospeech.VoiceSelectionParams(
             language_code="en-US", name="en-US-Wavenet-A"
@@ -71,9 +96,13 @@ def create_audio_from_text(text: str, output_file: str) -> str | None:
             audio_encoding=texttospeech.AudioEncoding.LINEAR16
         )
 
-        response = client.synthesize_speech(
-            input=synthesis_input, voice=voice, audio_config=audio_config
-        )
+        with telemetry.span(
+            "tts.synthesize_speech", "google-cloud-tts", characters=len(text)
+        ) as span, limit("tts"):
+            response = client.synthesize_speech(
+                input=synthesis_input, voice=voice, audio_config=audio_config
+            )
+            span.set(response_bytes=len(response.audio_content))
 
         with open(output_file, "wb") as out:
             out.write(response.audio_content)
@@ -84,6 +113,13 @@ def create_audio_from_text(text: str, output_file: str) -> str | None:
         return None
 
 
+async def create_audio_from_text_async(text: str, output_file: str) -> str | None:
+    """
+    Phiên bản async của create_audio_from_text(); TTS chạy trong thread pool.
+    """
+    return await run_in_thread(create_audio_from_text, text, output_file)
+
+
 if __name__ == "__main__":
     TOPIC = "A weekend picnic"
     NUM_BLANKS = 4
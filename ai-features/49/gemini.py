@@ -1,23 +1,83 @@
 import os
 import json
+import sys
 from dotenv import load_dotenv
-from google import genai
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry
+from common.batch import run_bulk
+from common.cascade import ESCALATION_MODEL, cheap_model, get_cascade, score_confidence
+from common.context_cache import system_config
+from common.gemini_call import (
+    agenerate_json,
+    agenerate_json_stream,
+    generate_json,
+    generate_json_stream,
+)
+from common.schemas import get_schema
 
 load_dotenv()
 
+# Ngưỡng quy đổi bậc VSTEP (B1, B2, C1): điểm cách ngưỡng dưới 0.75
+# (SCORE_MARGIN × CASCADE_THRESHOLD) được chấm lại bằng model mạnh.
+SCORE_CUT_POINTS = (4.0, 6.0, 8.5)
+SCORE_MARGIN = 1.0
+CASCADE_THRESHOLD = 0.75
 
-def evaluate_vstep_writing(
-    task_type: str, exam_prompt: str, user_submission: str
-) -> dict:
-    """
-    Sử dụng Gemini để chấm điểm và nhận xét bài thi VSTEP Writing.
-    """
-    try:
-        client = genai.Client()
+SYSTEM_INSTRUCTION = """
+Bạn là một giám khảo chấm thi VSTEP Writing giàu kinh nghiệm. Nhiệm vụ của bạn là phân tích, chấm điểm và đưa ra nhận xét chi tiết cho bài viết của thí sinh một cách khách quan và mang tính xây dựng.
+
+**Yêu cầu:**
+1.  Đọc kỹ đề bài và bài viết của thí sinh.
+2.  Chấm điểm bài viết dựa trên 4 tiêu chí chính của VSTEP Writing. Với mỗi tiêu chí, hãy cho điểm trên thang 10 và đưa ra nhận xét cụ thể.
+    - **Task Fulfillment (Mức độ hoàn thành yêu cầu):** Bài viết có trả lời đủ các ý của đề bài không? Độ dài có đạt yêu cầu? Văn phong (formal/informal) có phù hợp không? Các ý chính có được phát triển không?
+    - **Organization (Tổ chức bài viết):** Bố cục có rõ ràng (Mở-Thân-Kết) không? Việc chia đoạn có logic không? Các từ nối được sử dụng có đa dạng và hiệu quả không?
+    - **Vocabulary (Từ vựng):** Phạm vi từ vựng có rộng không? Có sử dụng từ đúng ngữ cảnh, collocations không? Có lỗi chính tả không?
+    - **Grammar (Ngữ pháp):** Cấu trúc câu có đa dạng (đơn, ghép, phức) không? Có các lỗi ngữ pháp về thì, S-V agreement, mạo từ, giới từ không? Dấu câu có chính xác không?
+3.  Tính điểm tổng kết cho bài viết này (thang điểm 10, làm tròn 0.5).
+4.  Cung cấp một phiên bản bài viết đã được sửa lỗi và gợi ý cách diễn đạt tốt hơn.
+5.  Cung cấp toàn bộ kết quả dưới dạng một đối tượng JSON duy nhất. **Tuyệt đối không thêm bất kỳ văn bản giải thích nào bên ngoài đối tượng JSON này.**
 
-        prompt_text = f"""
-        Bạn là một giám khảo chấm thi VSTEP Writing giàu kinh nghiệm. Nhiệm vụ của bạn là phân tích, chấm điểm và đưa ra nhận xét chi tiết cho bài viết của thí sinh một cách khách quan và mang tính xây dựng.
+**Lưu ý về JSON:**
+- Các trường "score" phải là số (float), ví dụ: 7.5
+- Các trường văn bản phải là chuỗi (string), bọc trong dấu ngoặc kép.
+- JSON phải hợp lệ tuyệt đối.
 
+**Cấu trúc JSON đầu ra bắt buộc:**
+{
+  "overall_score": 7.5,
+  "summary_feedback_vi": "Một đoạn nhận xét chung ngắn gọn bằng tiếng Việt",
+  "criteria_breakdown": {
+    "task_fulfillment": {
+      "score": 8.0,
+      "strengths": "Những điểm làm tốt của tiêu chí này, bằng tiếng Việt",
+      "weaknesses": "Những điểm cần cải thiện của tiêu chí này, bằng tiếng Việt"
+    },
+    "organization": {
+      "score": 7.0,
+      "strengths": "Những điểm làm tốt của tiêu chí này, bằng tiếng Việt",
+      "weaknesses": "Những điểm cần cải thiện của tiêu chí này, bằng tiếng Việt"
+    },
+    "vocabulary": {
+      "score": 7.5,
+      "strengths": "Những điểm làm tốt của tiêu chí này, bằng tiếng Việt",
+      "weaknesses": "Những điểm cần cải thiện của tiêu chí này, bằng tiếng Việt"
+    },
+    "grammar": {
+      "score": 6.5,
+      "strengths": "Những điểm làm tốt của tiêu chí này, bằng tiếng Việt",
+      "weaknesses": "Những điểm cần cải thiện của tiêu chí này, bằng tiếng Việt"
+    }
+  },
+  "corrected_text": "Toàn bộ bài viết của người dùng nhưng đã được sửa lỗi và tối ưu hóa. Đánh dấu các thay đổi nếu có thể."
+}
+"""
+
+
+@telemetry.timed("build_contents", feature="49")
+def _build_contents(task_type: str, exam_prompt: str, user_submission: str) -> list:
+    prompt_text = f"""
         **Bối cảnh:**
         - Loại bài thi: "{task_type}"
         - Đề bài gốc: "{exam_prompt}"
@@ -25,73 +85,147 @@ def evaluate_vstep_writing(
         ---
         {user_submission}
         ---
-
-        **Yêu cầu:**
-        1.  Đọc kỹ đề bài và bài viết của thí sinh.
-        2.  Chấm điểm bài viết dựa trên 4 tiêu chí chính của VSTEP Writing. Với mỗi tiêu chí, hãy cho điểm trên thang 10 và đưa ra nhận xét cụ thể.
-            - **Task Fulfillment (Mức độ hoàn thành yêu cầu):** Bài viết có trả lời đủ các ý của đề bài không? Độ dài có đạt yêu cầu? Văn phong (formal/informal) có phù hợp không? Các ý chính có được phát triển không?
-            - **Organization (Tổ chức bài viết):** Bố cục có rõ ràng (Mở-Thân-Kết) không? Việc chia đoạn có logic không? Các từ nối được sử dụng có đa dạng và hiệu quả không?
-            - **Vocabulary (Từ vựng):** Phạm vi từ vựng có rộng không? Có sử dụng từ đúng ngữ cảnh, collocations không? Có lỗi chính tả không?
-            - **Grammar (Ngữ pháp):** Cấu trúc câu có đa dạng (đơn, ghép, phức) không? Có các lỗi ngữ pháp về thì, S-V agreement, mạo từ, giới từ không? Dấu câu có chính xác không?
-        3.  Tính điểm tổng kết cho bài viết này (thang điểm 10, làm tròn 0.5).
-        4.  Cung cấp một phiên bản bài viết đã được sửa lỗi và gợi ý cách diễn đạt tốt hơn.
-        5.  Cung cấp toàn bộ kết quả dưới dạng một đối tượng JSON duy nhất. **Tuyệt đối không thêm bất kỳ văn bản giải thích nào bên ngoài đối tượng JSON này.**
-
-        **Lưu ý về JSON:**
-        - Các trường "score" phải là số (float), ví dụ: 7.5
-        - Các trường văn bản phải là chuỗi (string), bọc trong dấu ngoặc kép.
-        - JSON phải hợp lệ tuyệt đối.
-
-        **Cấu trúc JSON đầu ra bắt buộc:**
-        {{
-          "overall_score": 7.5,
-          "summary_feedback_vi": "Một đoạn nhận xét chung ngắn gọn bằng tiếng Việt",
-          "criteria_breakdown": {{
-            "task_fulfillment": {{
-              "score": 8.0,
-              "strengths": "Những điểm làm tốt của tiêu chí này, bằng tiếng Việt",
-              "weaknesses": "Những điểm cần cải thiện của tiêu chí này, bằng tiếng Việt"
-            }},
-            "organization": {{
-              "score": 7.0,
-              "strengths": "Những điểm làm tốt của tiêu chí này, bằng tiếng Việt",
-              "weaknesses": "Những điểm cần cải thiện của tiêu chí này, bằng tiếng Việt"
-            }},
-            "vocabulary": {{
-              "score": 7.5,
-              "strengths": "Những điểm làm tốt của tiêu chí này, bằng tiếng Việt",
-              "weaknesses": "Những điểm cần cải thiện của tiêu chí này, bằng tiếng Việt"
-            }},
-            "grammar": {{
-              "score": 6.5,
-              "strengths": "Những điểm làm tốt của tiêu chí này, bằng tiếng Việt",
-              "weaknesses": "Những điểm cần cải thiện của tiêu chí này, bằng tiếng Việt"
-            }}
-          }},
-          "corrected_text": "Toàn bộ bài viết của người dùng nhưng đã được sửa lỗi và tối ưu hóa. Đánh dấu các thay đổi nếu có thể."
-        }}
         """
 
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[{"role": "user", "parts": [{"text": prompt_text}]}],
+    return [{"role": "user", "parts": [{"text": prompt_text}]}]
+
+
+def _evaluate(
+    model: str, task_type: str, exam_prompt: str, user_submission: str
+) -> dict:
+    try:
+        return generate_json(
+            model=model,
+            contents=_build_contents(task_type, exam_prompt, user_submission),
+            schema=get_schema("49"),
+            config=system_config("49", SYSTEM_INSTRUCTION),
             # Cân nhắc thêm safety_settings nếu gặp vấn đề bị chặn
             # safety_settings={'HARASSMENT': 'block_none', 'HATE_SPEECH': 'block_none', 'SEXUAL': 'block_none', 'DANGEROUS': 'block_none'}
         )
 
-        if not response.text:
-            return {"error": "Gemini không trả về kết quả."}
+    except Exception as e:
+        print(f"Lỗi Gemini: {e}")
+        return {"error": "Không thể đánh giá bài viết bằng Gemini."}
+
 
-        cleaned_response = (
-            response.text.strip().replace("```json", "").replace("```", "").strip()
+async def _aevaluate(
+    model: str, task_type: str, exam_prompt: str, user_submission: str
+) -> dict:
+    try:
+        return await agenerate_json(
+            model=model,
+            contents=_build_contents(task_type, exam_prompt, user_submission),
+            schema=get_schema("49"),
+            config=system_config("49", SYSTEM_INSTRUCTION),
         )
-        return json.loads(cleaned_response)
 
     except Exception as e:
         print(f"Lỗi Gemini: {e}")
         return {"error": "Không thể đánh giá bài viết bằng Gemini."}
 
 
+def _confidence(result: dict) -> tuple[dict, float]:
+    return score_confidence(result, "overall_score", SCORE_CUT_POINTS, SCORE_MARGIN)
+
+
+def evaluate_vstep_writing(
+    task_type: str, exam_prompt: str, user_submission: str
+) -> dict:
+    """
+    Sử dụng Gemini để chấm điểm và nhận xét bài thi VSTEP Writing.
+    Chấm bằng model nhỏ trước, chỉ chấm lại bằng gemini-2.5-flash khi điểm
+    nằm sát ngưỡng quy đổi bậc.
+    """
+    return get_cascade("49", CASCADE_THRESHOLD).run(
+        lambda: _confidence(
+            _evaluate(cheap_model(), task_type, exam_prompt, user_submission)
+        ),
+        lambda: _evaluate(ESCALATION_MODEL, task_type, exam_prompt, user_submission),
+    )
+
+
+async def evaluate_vstep_writing_async(
+    task_type: str, exam_prompt: str, user_submission: str
+) -> dict:
+    """
+    Phiên bản async của evaluate_vstep_writing().
+    """
+
+    async def cheap():
+        return _confidence(
+            await _aevaluate(cheap_model(), task_type, exam_prompt, user_submission)
+        )
+
+    return await get_cascade("49", CASCADE_THRESHOLD).arun(
+        cheap,
+        lambda: _aevaluate(ESCALATION_MODEL, task_type, exam_prompt, user_submission),
+    )
+
+
+def evaluate_vstep_writing_stream(
+    task_type: str, exam_prompt: str, user_submission: str
+):
+    """
+    Chế độ stream của evaluate_vstep_writing(): yield (path, value) cho từng
+    trường ngay khi Gemini sinh xong, ví dụ "overall_score" hoặc
+    "criteria_breakdown.grammar", thay vì chờ toàn bộ kết quả.
+    """
+    try:
+        yield from generate_json_stream(
+            model="gemini-2.5-flash",
+            contents=_build_contents(task_type, exam_prompt, user_submission),
+            schema=get_schema("49"),
+            config=system_config("49", SYSTEM_INSTRUCTION),
+        )
+
+    except Exception as e:
+        print(f"Lỗi Gemini: {e}")
+        yield "error", "Không thể đánh giá bài viết bằng Gemini."
+
+
+async def evaluate_vstep_writing_stream_async(
+    task_type: str, exam_prompt: str, user_submission: str
+):
+    """
+    Phiên bản async của evaluate_vstep_writing_stream().
+    """
+    try:
+        async for field in agenerate_json_stream(
+            model="gemini-2.5-flash",
+            contents=_build_contents(task_type, exam_prompt, user_submission),
+            schema=get_schema("49"),
+            config=system_config("49", SYSTEM_INSTRUCTION),
+        ):
+            yield field
+
+    except Exception as e:
+        print(f"Lỗi Gemini: {e}")
+        yield "error", "Không thể đánh giá bài viết bằng Gemini."
+
+
+def evaluate_vstep_writing_batch(
+    input_path: str, output_path: str, backend=None
+) -> dict:
+    """
+    Chấm hàng loạt bài VSTEP Writing qua Gemini Batch API (dùng cho cuối kỳ).
+    Mỗi dòng input JSONL: {"id", "task_type", "exam_prompt", "user_submission"}.
+    Mỗi dòng output JSONL: {"id", ...kết quả như evaluate_vstep_writing()}.
+    """
+    return run_bulk(
+        model="gemini-2.5-flash",
+        input_path=input_path,
+        output_path=output_path,
+        build_contents=lambda submission: _build_contents(
+            submission["task_type"],
+            submission["exam_prompt"],
+            submission["user_submission"],
+        ),
+        schema=get_schema("49"),
+        system_instruction=SYSTEM_INSTRUCTION,
+        backend=backend,
+    )
+
+
 if __name__ == "__main__":
     TASK_TYPE = "Bài 2 (Viết luận)"
 
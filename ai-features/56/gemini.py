@@ -1,21 +1,33 @@
 import os
 import json
+import sys
 from dotenv import load_dotenv
-from google import genai
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry
+from common.batch import run_bulk
+from common.cascade import ESCALATION_MODEL, cheap_model, get_cascade, score_confidence
+from common.concurrency import run_in_thread
+from common.file_uploads import audio_parts
+from common.gemini_call import (
+    agenerate_json,
+    generate_json,
+)
+from common.schemas import get_schema
 
 load_dotenv()
 
+# Ngưỡng quy đổi bậc VSTEP (B1, B2, C1): điểm cách ngưỡng dưới 0.75
+# (SCORE_MARGIN × CASCADE_THRESHOLD) được chấm lại bằng model mạnh.
+SCORE_CUT_POINTS = (4.0, 6.0, 8.5)
+SCORE_MARGIN = 1.0
+CASCADE_THRESHOLD = 0.75
 
-def evaluate_vstep_speaking(audio_path: str, exam_part: str, exam_prompt: str) -> dict:
-    """
-    Sử dụng Gemini để chấm điểm và nhận xét bài thi VSTEP Speaking.
-    """
-    try:
-        client = genai.Client()
-        with open(audio_path, "rb") as f:
-            audio_file_data = f.read()
 
-        prompt_text = f"""
+@telemetry.timed("build_contents", feature="56")
+def _build_contents(audio_path: str, exam_part: str, exam_prompt: str) -> list:
+    prompt_text = f"""
             Bạn là một giám khảo chấm thi VSTEP Speaking có nhiều năm kinh nghiệm, với khả năng nghe và phân tích ngôn ngữ cực kỳ chính xác.
 
             **Bối cảnh:**
@@ -55,37 +67,105 @@ def evaluate_vstep_speaking(audio_path: str, exam_part: str, exam_prompt: str) -
             }}
         """
 
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[
-                {
-                    "role": "user",
-                    "parts": [
-                        {"text": prompt_text},
-                        {
-                            "inline_data": {
-                                "mime_type": "audio/wav",
-                                "data": audio_file_data,
-                            }
-                        },
-                    ],
-                }
+    return [
+        {
+            "role": "user",
+            "parts": [
+                {"text": prompt_text},
+                *audio_parts(audio_path),
             ],
+        }
+    ]
+
+
+def _evaluate(model: str, audio_path: str, exam_part: str, exam_prompt: str) -> dict:
+    try:
+        return generate_json(
+            model=model,
+            contents=_build_contents(audio_path, exam_part, exam_prompt),
+            schema=get_schema("56"),
         )
 
-        if not response.text:
-            return {"error": "Gemini không trả về kết quả."}
+    except Exception as e:
+        print(f"Lỗi Gemini: {e}")
+        return {"error": "Không thể đánh giá bài nói bằng Gemini."}
+
 
-        cleaned_response = (
-            response.text.strip().replace("```json", "").replace("```", "").strip()
+async def _aevaluate(
+    model: str, audio_path: str, exam_part: str, exam_prompt: str
+) -> dict:
+    try:
+        return await agenerate_json(
+            model=model,
+            contents=await run_in_thread(
+                _build_contents, audio_path, exam_part, exam_prompt
+            ),
+            schema=get_schema("56"),
         )
-        return json.loads(cleaned_response)
 
     except Exception as e:
         print(f"Lỗi Gemini: {e}")
         return {"error": "Không thể đánh giá bài nói bằng Gemini."}
 
 
+def _confidence(result: dict) -> tuple[dict, float]:
+    return score_confidence(result, "overall_score", SCORE_CUT_POINTS, SCORE_MARGIN)
+
+
+def evaluate_vstep_speaking(audio_path: str, exam_part: str, exam_prompt: str) -> dict:
+    """
+    Sử dụng Gemini để chấm điểm và nhận xét bài thi VSTEP Speaking.
+    Chấm bằng model nhỏ trước, chỉ chấm lại bằng gemini-2.5-flash khi điểm
+    nằm sát ngưỡng quy đổi bậc.
+    """
+    return get_cascade("56", CASCADE_THRESHOLD).run(
+        lambda: _confidence(
+            _evaluate(cheap_model(), audio_path, exam_part, exam_prompt)
+        ),
+        lambda: _evaluate(ESCALATION_MODEL, audio_path, exam_part, exam_prompt),
+    )
+
+
+async def evaluate_vstep_speaking_async(
+    audio_path: str, exam_part: str, exam_prompt: str
+) -> dict:
+    """
+    Phiên bản async của evaluate_vstep_speaking().
+    """
+
+    async def cheap():
+        return _confidence(
+            await _aevaluate(cheap_model(), audio_path, exam_part, exam_prompt)
+        )
+
+    return await get_cascade("56", CASCADE_THRESHOLD).arun(
+        cheap,
+        lambda: _aevaluate(ESCALATION_MODEL, audio_path, exam_part, exam_prompt),
+    )
+
+
+def evaluate_vstep_speaking_batch(
+    input_path: str, output_path: str, backend=None
+) -> dict:
+    """
+    Chấm hàng loạt bài VSTEP Speaking qua Gemini Batch API (dùng cho cuối kỳ).
+    Mỗi dòng input JSONL: {"id", "audio_path", "exam_part", "exam_prompt"}.
+    Mỗi dòng output JSONL: {"id", ...kết quả như evaluate_vstep_speaking()}.
+    """
+    return run_bulk(
+        model="gemini-2.5-flash",
+        input_path=input_path,
+        output_path=output_path,
+        build_contents=lambda submission: _build_contents(
+            submission["audio_path"],
+            submission["exam_part"],
+            submission["exam_prompt"],
+        ),
+        schema=get_schema("56"),
+        backend=backend,
+    )
+
+
 if __name__ == "__main__":
     EXAM_PART = "Phần 3: Phát triển chủ đề"
     EXAM_PROMPT = "Topic: The importance of learning a second language."
@@ -1,16 +1,204 @@
 import os
 import json
+import sys
 from dotenv import load_dotenv
-from google import genai
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry
+from common.cascade import ESCALATION_MODEL, cheap_model, get_cascade, score_confidence
+from common.concurrency import run_in_thread
+from common.context_cache import system_config
+from common.file_uploads import audio_parts
+from common.gemini_call import (
+    agenerate_json,
+    agenerate_json_stream,
+    generate_json,
+    generate_json_stream,
+)
+from common.schemas import get_schema
 
 load_dotenv()
 
+# Điểm tổng kết (0-5) nằm giữa hai mức tiêu chí dễ bị xếp lệch trình độ;
+# kết quả cách các ngưỡng này không quá 0.25 được chấm lại.
+SCORE_CUT_POINTS = (2.5, 3.5, 4.5)
+SCORE_MARGIN = 0.5
+CASCADE_THRESHOLD = 0.6
+
+SYSTEM_INSTRUCTION = """
+Bạn là một giám khảo chấm thi Cambridge YLE Flyers Speaking có nhiều năm kinh nghiệm, được chứng nhận bởi Cambridge Assessment English. Bạn có khả năng đánh giá chính xác trình độ tiếng Anh của trẻ em theo tiêu chuẩn quốc tế.
+
+**TIÊU CHÍ CHẤM ĐIỂM CAMBRIDGE FLYERS SPEAKING:**
+
+**1. Grammar & Vocabulary (25%):**
+- Sử dụng đúng các cấu trúc ngữ pháp cơ bản (Present Simple, Past Simple, Present Continuous, Future Simple)
+- Từ vựng phù hợp với chủ đề và độ tuổi (khoảng 600-700 từ)
+- Khả năng diễn đạt ý tưởng với ngôn ngữ đơn giản nhưng chính xác
+
+**2. Pronunciation (25%):**
+- Phát âm rõ ràng, dễ hiểu cho người nghe
+- Trọng âm từ và câu cơ bản đúng
+- Ngữ điệu tự nhiên phù hợp với ngữ cảnh
+
+**3. Discourse Management (25%):**  
+- Khả năng tổ chức ý tưởng logic, mạch lạc
+- Sử dụng từ nối đơn giản (and, but, because, then, first, next...)
+- Duy trì chủ đề và phát triển ý tưởng phù hợp với yêu cầu đề bài
+
+**4. Interactive Communication (25%):**
+- Khả năng giao tiếp tự nhiên, không quá cứng nhắc
+- Phản ứng phù hợp với câu hỏi/tình huống
+- Sự tự tin và sẵn sàng trong giao tiếp
+
+**YÊU CẦU ĐÁNH GIÁ:**
+1. Nghe kỹ file ghi âm đính kèm và transcribe chính xác những gì học sinh nói.
+2. Đánh giá theo 4 tiêu chí trên, cho điểm mỗi tiêu chí từ 0-5 (theo thang điểm Cambridge):
+   - 0: Không đạt
+   - 1: Yếu  
+   - 2: Khá yếu
+   - 3: Trung bình
+   - 4: Khá tốt
+   - 5: Xuất sắc (mức A2+ cho trẻ em)
+3. Tính điểm tổng kết (trung bình 4 điểm tiêu chí).
+4. Đưa ra nhận xét chi tiết, khuyến khích và gợi ý cải thiện phù hợp với độ tuổi.
+5. Xác định những lỗi cụ thể và đưa ra lời khuyên thực tế.
+
+**LƯUY Ý ĐẶC BIỆT:**
+- Đánh giá phù hợp với trình độ A2 cho trẻ em (không quá khắt khe)
+- Nhận xét phải tích cực, khuyến khích tinh thần học tập
+- Gợi ý cải thiện phải cụ thể và dễ thực hiện cho trẻ em
+- Sử dụng ngôn ngữ đơn giản, dễ hiểu
+
+**CẤU TRÚC JSON ĐẦU RA BẮT BUỘC:**
+{
+  "overall_score": <điểm tổng kết, ví dụ: 3.5>,
+  "level_assessment": "<đánh giá trình độ: 'Pre-A1', 'A1', 'A2' hoặc 'Above A2'>",
+  "full_transcript": "<bản phiên âm đầy đủ bài nói của học sinh>",
+  "criteria_scores": {
+    "grammar_vocabulary": {
+      "score": <điểm 0-5>,
+      "strengths": "<những điểm làm tốt, bằng tiếng Việt>",
+      "areas_for_improvement": "<những điểm cần cải thiện, bằng tiếng Việt>"
+    },
+    "pronunciation": {
+      "score": <điểm 0-5>,
+      "strengths": "<những điểm làm tốt, bằng tiếng Việt>", 
+      "areas_for_improvement": "<những điểm cần cải thiện, bằng tiếng Việt>"
+    },
+    "discourse_management": {
+      "score": <điểm 0-5>,
+      "strengths": "<những điểm làm tốt, bằng tiếng Việt>",
+      "areas_for_improvement": "<những điểm cần cải thiện, bằng tiếng Việt>"
+    },
+    "interactive_communication": {
+      "score": <điểm 0-5>,
+      "strengths": "<những điểm làm tốt, bằng tiếng Việt>",
+      "areas_for_improvement": "<những điểm cần cải thiện, bằng tiếng Việt>"
+    }
+  },
+  "detailed_feedback": {
+    "positive_highlights": [
+      "<điểm tích cực thứ nhất, bằng tiếng Việt>",
+      "<điểm tích cực thứ hai, bằng tiếng Việt>"
+    ],
+    "specific_errors": [
+      {
+        "error_quote": "<trích dẫn lỗi từ transcript>",
+        "error_type": "<loại lỗi: Grammar/Vocabulary/Pronunciation>", 
+        "correction": "<cách sửa đúng>",
+        "explanation": "<giải thích ngắn gọn bằng tiếng Việt>"
+      }
+    ],
+    "improvement_suggestions": [
+      "<gợi ý cải thiện thứ nhất, cụ thể và dễ thực hiện>",
+      "<gợi ý cải thiện thứ hai, cụ thể và dễ thực hiện>"
+    ]
+  },
+  "next_steps": "<khuyến nghị về bước học tiếp theo phù hợp với trình độ hiện tại>"
+}
+"""
+
+
+@telemetry.timed("build_contents", feature="90")
+def _build_contents(
+    audio_path: str, exam_part: str, exam_prompt: str, additional_context: str = ""
+) -> list:
+    prompt_text = f"""
+            **BỐI CẢNH BÀI THI:**
+            - Kỳ thi: Cambridge Young Learners English (YLE) - Flyers Level
+            - Phần thi: "{exam_part}"
+            - Đề bài/Yêu cầu: "{exam_prompt}"
+            {f"- Thông tin bổ sung: {additional_context}" if additional_context else ""}
+            - Độ tuổi học sinh: 9-12 tuổi (trình độ tương đương A2 theo CEFR)
+        """
+
+    return [
+        {
+            "role": "user",
+            "parts": [
+                {"text": prompt_text},
+                *audio_parts(audio_path),
+            ],
+        }
+    ]
+
+
+def _evaluate(
+    model: str,
+    audio_path: str,
+    exam_part: str,
+    exam_prompt: str,
+    additional_context: str = "",
+) -> dict:
+    try:
+        return generate_json(
+            model=model,
+            contents=_build_contents(
+                audio_path, exam_part, exam_prompt, additional_context
+            ),
+            schema=get_schema("90"),
+            config=system_config("90", SYSTEM_INSTRUCTION),
+        )
+
+    except Exception as e:
+        print(f"Lỗi Gemini: {e}")
+        return {"error": f"Không thể đánh giá bài nói bằng Gemini: {str(e)}"}
+
+
+async def _aevaluate(
+    model: str,
+    audio_path: str,
+    exam_part: str,
+    exam_prompt: str,
+    additional_context: str = "",
+) -> dict:
+    try:
+        return await agenerate_json(
+            model=model,
+            contents=await run_in_thread(
+                _build_contents, audio_path, exam_part, exam_prompt, additional_context
+            ),
+            schema=get_schema("90"),
+            config=system_config("90", SYSTEM_INSTRUCTION),
+        )
+
+    except Exception as e:
+        print(f"Lỗi Gemini: {e}")
+        return {"error": f"Không thể đánh giá bài nói bằng Gemini: {str(e)}"}
+
+
+def _confidence(result: dict) -> tuple[dict, float]:
+    return score_confidence(result, "overall_score", SCORE_CUT_POINTS, SCORE_MARGIN)
+
 
 def evaluate_flyers_speaking(
     audio_path: str, exam_part: str, exam_prompt: str, additional_context: str = ""
 ) -> dict:
     """
     Sử dụng Gemini để đánh giá chi tiết bài thi Cambridge Flyers Speaking.
+    Chấm bằng model nhỏ trước, chỉ chấm lại bằng gemini-2.5-flash khi điểm
+    nằm sát ngưỡng phân loại.
 
     Args:
         audio_path: Đường dẫn đến file âm thanh bài nói của học sinh
@@ -21,141 +209,72 @@ def evaluate_flyers_speaking(
     Returns:
         dict: Kết quả đánh giá chi tiết theo tiêu chí Cambridge YLE
     """
-    try:
-        client = genai.Client()
+    args = (audio_path, exam_part, exam_prompt, additional_context)
+    return get_cascade("90", CASCADE_THRESHOLD).run(
+        lambda: _confidence(_evaluate(cheap_model(), *args)),
+        lambda: _evaluate(ESCALATION_MODEL, *args),
+    )
 
-        with open(audio_path, "rb") as f:
-            audio_file_data = f.read()
 
-        prompt_text = f"""
-            Bạn là một giám khảo chấm thi Cambridge YLE Flyers Speaking có nhiều năm kinh nghiệm, được chứng nhận bởi Cambridge Assessment English. Bạn có khả năng đánh giá chính xác trình độ tiếng Anh của trẻ em theo tiêu chuẩn quốc tế.
+async def evaluate_flyers_speaking_async(
+    audio_path: str, exam_part: str, exam_prompt: str, additional_context: str = ""
+) -> dict:
+    """
+    Phiên bản async của evaluate_flyers_speaking().
+    """
+    args = (audio_path, exam_part, exam_prompt, additional_context)
 
-            **BỐI CẢNH BÀI THI:**
-            - Kỳ thi: Cambridge Young Learners English (YLE) - Flyers Level
-            - Phần thi: "{exam_part}"
-            - Đề bài/Yêu cầu: "{exam_prompt}"
-            {f"- Thông tin bổ sung: {additional_context}" if additional_context else ""}
-            - Độ tuổi học sinh: 9-12 tuổi (trình độ tương đương A2 theo CEFR)
+    async def cheap():
+        return _confidence(await _aevaluate(cheap_model(), *args))
+
+    return await get_cascade("90", CASCADE_THRESHOLD).arun(
+        cheap, lambda: _aevaluate(ESCALATION_MODEL, *args)
+    )
 
-            **TIÊU CHÍ CHẤM ĐIỂM CAMBRIDGE FLYERS SPEAKING:**
-            
-            **1. Grammar & Vocabulary (25%):**
-            - Sử dụng đúng các cấu trúc ngữ pháp cơ bản (Present Simple, Past Simple, Present Continuous, Future Simple)
-            - Từ vựng phù hợp với chủ đề và độ tuổi (khoảng 600-700 từ)
-            - Khả năng diễn đạt ý tưởng với ngôn ngữ đơn giản nhưng chính xác
-
-            **2. Pronunciation (25%):**
-            - Phát âm rõ ràng, dễ hiểu cho người nghe
-            - Trọng âm từ và câu cơ bản đúng
-            - Ngữ điệu tự nhiên phù hợp với ngữ cảnh
-            
-            **3. Discourse Management (25%):**  
-            - Khả năng tổ chức ý tưởng logic, mạch lạc
-            - Sử dụng từ nối đơn giản (and, but, because, then, first, next...)
-            - Duy trì chủ đề và phát triển ý tưởng phù hợp với yêu cầu đề bài
-
-            **4. Interactive Communication (25%):**
-            - Khả năng giao tiếp tự nhiên, không quá cứng nhắc
-            - Phản ứng phù hợp với câu hỏi/tình huống
-            - Sự tự tin và sẵn sàng trong giao tiếp
-
-            **YÊU CẦU ĐÁNH GIÁ:**
-            1. Nghe kỹ file ghi âm đính kèm và transcribe chính xác những gì học sinh nói.
-            2. Đánh giá theo 4 tiêu chí trên, cho điểm mỗi tiêu chí từ 0-5 (theo thang điểm Cambridge):
-               - 0: Không đạt
-               - 1: Yếu  
-               - 2: Khá yếu
-               - 3: Trung bình
-               - 4: Khá tốt
-               - 5: Xuất sắc (mức A2+ cho trẻ em)
-            3. Tính điểm tổng kết (trung bình 4 điểm tiêu chí).
-            4. Đưa ra nhận xét chi tiết, khuyến khích và gợi ý cải thiện phù hợp với độ tuổi.
-            5. Xác định những lỗi cụ thể và đưa ra lời khuyên thực tế.
-
-            **LƯUY Ý ĐẶC BIỆT:**
-            - Đánh giá phù hợp với trình độ A2 cho trẻ em (không quá khắt khe)
-            - Nhận xét phải tích cực, khuyến khích tinh thần học tập
-            - Gợi ý cải thiện phải cụ thể và dễ thực hiện cho trẻ em
-            - Sử dụng ngôn ngữ đơn giản, dễ hiểu
-
-            **CẤU TRÚC JSON ĐẦU RA BẮT BUỘC:**
-            {{
-              "overall_score": <điểm tổng kết, ví dụ: 3.5>,
-              "level_assessment": "<đánh giá trình độ: 'Pre-A1', 'A1', 'A2' hoặc 'Above A2'>",
-              "full_transcript": "<bản phiên âm đầy đủ bài nói của học sinh>",
-              "criteria_scores": {{
-                "grammar_vocabulary": {{
-                  "score": <điểm 0-5>,
-                  "strengths": "<những điểm làm tốt, bằng tiếng Việt>",
-                  "areas_for_improvement": "<những điểm cần cải thiện, bằng tiếng Việt>"
-                }},
-                "pronunciation": {{
-                  "score": <điểm 0-5>,
-                  "strengths": "<những điểm làm tốt, bằng tiếng Việt>", 
-                  "areas_for_improvement": "<những điểm cần cải thiện, bằng tiếng Việt>"
-                }},
-                "discourse_management": {{
-                  "score": <điểm 0-5>,
-                  "strengths": "<những điểm làm tốt, bằng tiếng Việt>",
-                  "areas_for_improvement": "<những điểm cần cải thiện, bằng tiếng Việt>"
-                }},
-                "interactive_communication": {{
-                  "score": <điểm 0-5>,
-                  "strengths": "<những điểm làm tốt, bằng tiếng Việt>",
-                  "areas_for_improvement": "<những điểm cần cải thiện, bằng tiếng Việt>"
-                }}
-              }},
-              "detailed_feedback": {{
-                "positive_highlights": [
-                  "<điểm tích cực thứ nhất, bằng tiếng Việt>",
-                  "<điểm tích cực thứ hai, bằng tiếng Việt>"
-                ],
-                "specific_errors": [
-                  {{
-                    "error_quote": "<trích dẫn lỗi từ transcript>",
-                    "error_type": "<loại lỗi: Grammar/Vocabulary/Pronunciation>", 
-                    "correction": "<cách sửa đúng>",
-                    "explanation": "<giải thích ngắn gọn bằng tiếng Việt>"
-                  }}
-                ],
-                "improvement_suggestions": [
-                  "<gợi ý cải thiện thứ nhất, cụ thể và dễ thực hiện>",
-                  "<gợi ý cải thiện thứ hai, cụ thể và dễ thực hiện>"
-                ]
-              }},
-              "next_steps": "<khuyến nghị về bước học tiếp theo phù hợp với trình độ hiện tại>"
-            }}
-        """
 
-        response = client.models.generate_content(
+def evaluate_flyers_speaking_stream(
+    audio_path: str, exam_part: str, exam_prompt: str, additional_context: str = ""
+):
+    """
+    Chế độ stream của evaluate_flyers_speaking(): yield (path, value) cho từng
+    trường ngay khi Gemini sinh xong, ví dụ "overall_score" hoặc
+    "criteria_scores.pronunciation", thay vì chờ toàn bộ kết quả.
+    """
+    try:
+        yield from generate_json_stream(
             model="gemini-2.5-flash",
-            contents=[
-                {
-                    "role": "user",
-                    "parts": [
-                        {"text": prompt_text},
-                        {
-                            "inline_data": {
-                                "mime_type": "audio/wav",
-                                "data": audio_file_data,
-                            }
-                        },
-                    ],
-                }
-            ],
+            contents=_build_contents(
+                audio_path, exam_part, exam_prompt, additional_context
+            ),
+            schema=get_schema("90"),
+            config=system_config("90", SYSTEM_INSTRUCTION),
         )
 
-        if not response.text:
-            return {"error": "Gemini không trả về kết quả."}
+    except Exception as e:
+        print(f"Lỗi Gemini: {e}")
+        yield "error", f"Không thể đánh giá bài nói bằng Gemini: {str(e)}"
 
-        cleaned_response = (
-            response.text.strip().replace("```json", "").replace("```", "").strip()
-        )
-        return json.loads(cleaned_response)
+
+async def evaluate_flyers_speaking_stream_async(
+    audio_path: str, exam_part: str, exam_prompt: str, additional_context: str = ""
+):
+    """
+    Phiên bản async của evaluate_flyers_speaking_stream().
+    """
+    try:
+        async for field in agenerate_json_stream(
+            model="gemini-2.5-flash",
+            contents=await run_in_thread(
+                _build_contents, audio_path, exam_part, exam_prompt, additional_context
+            ),
+            schema=get_schema("90"),
+            config=system_config("90", SYSTEM_INSTRUCTION),
+        ):
+            yield field
 
     except Exception as e:
         print(f"Lỗi Gemini: {e}")
-        return {"error": f"Không thể đánh giá bài nói bằng Gemini: {str(e)}"}
+        yield "error", f"Không thể đánh giá bài nói bằng Gemini: {str(e)}"
 
 
 def create_sample_evaluation_report(evaluation_result: dict) -> str:
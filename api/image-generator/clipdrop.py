@@ -1,16 +1,25 @@
-import requests
 import uuid
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry, traffic
+
 # Load environment variables
 load_dotenv()
 
-r = requests.post(
-    "https://clipdrop-api.co/text-to-image/v1",
-    files={"prompt": (None, "shot of vaporwave fashion dog in miami", "text/plain")},
-    headers={"x-api-key": os.getenv("CLIPDROP_API_KEY")},
-)
+with telemetry.span("images.generate", "clipdrop", "text-to-image/v1") as span:
+    r = traffic.requests_session("clipdrop").post(
+        "https://clipdrop-api.co/text-to-image/v1",
+        files={
+            "prompt": (None, "shot of vaporwave fashion dog in miami", "text/plain")
+        },
+        headers={"x-api-key": os.getenv("CLIPDROP_API_KEY")},
+    )
+    if r.ok:
+        span.set(images=1, response_bytes=len(r.content))
 if r.ok:
     # r.content contains the bytes of the returned image
     unique_id = uuid.uuid4().hex
@@ -1,9 +1,13 @@
-import requests
 import base64
 import uuid
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry, traffic
+
 # Load environment variables
 load_dotenv()
 
@@ -31,9 +35,13 @@ headers = {
     "Content-Type": "application/json",
 }
 
-response = requests.post(url, json=payload, headers=headers)
-
-response_data = response.json()
+with telemetry.span("images.generate", "freepik", "classic-fast") as span:
+    response = traffic.requests_session("freepik").post(url, json=payload, headers=headers)
+    response_data = response.json()
+    span.set(
+        images=len(response_data.get("data", [])),
+        response_bytes=len(response.content),
+    )
 
 for idx, image_data in enumerate(response_data["data"], start=1):
     image_base64 = image_data["base64"]
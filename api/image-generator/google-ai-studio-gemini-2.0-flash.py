@@ -1,26 +1,34 @@
-from google import genai
 from google.genai import types
 from PIL import Image
 from io import BytesIO
 import uuid
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry
+from common.gemini_client import get_client
+
 # Load environment variables
 load_dotenv()
 
-client = genai.Client(api_key=os.getenv("GOOGLE_AI_STUDIO_API_KEY"))
+client = get_client(api_key=os.getenv("GOOGLE_AI_STUDIO_API_KEY"))
 
 contents = (
     "A surreal scene of a floating island with a giant tree in the center, "
     "waterfalls cascading off the edges, and a vibrant sunset sky, digital art."
 )
 
-response = client.models.generate_content(
-    model="gemini-2.0-flash-preview-image-generation",
-    contents=contents,
-    config=types.GenerateContentConfig(response_modalities=["TEXT", "IMAGE"]),
-)
+MODEL = "gemini-2.0-flash-preview-image-generation"
+with telemetry.span("gemini.generate_content", "gemini", MODEL) as span:
+    response = client.models.generate_content(
+        model=MODEL,
+        contents=contents,
+        config=types.GenerateContentConfig(response_modalities=["TEXT", "IMAGE"]),
+    )
+    span.record_usage(response.usage_metadata)
 
 for part in response.candidates[0].content.parts:
     if part.text is not None:
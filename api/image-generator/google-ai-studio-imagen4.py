@@ -1,23 +1,32 @@
-from google import genai
 from google.genai import types
 from PIL import Image
 from io import BytesIO
 import uuid
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry
+from common.gemini_client import get_client
+
 # Load environment variables
 load_dotenv()
 
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+client = get_client(api_key=os.getenv("GEMINI_API_KEY"))
 
-response = client.models.generate_images(
-    model="imagen-4.0-generate-preview-06-06",
-    prompt="Candid portrait photo of a young woman with visibly flushed, red cheeks. She is covering her face with both hands but peeking through her fingers with wide, awkward eyes, conveying a strong sense of embarrassment. The background is a softly blurred, warm-toned classroom. Soft, natural window light illuminates her face, highlighting the blush. Hyper-realistic, high detail, shallow depth of field. --ar 3:4",
-    config=types.GenerateImagesConfig(
-        number_of_images=1,
-    ),
-)
+with telemetry.span(
+    "images.generate", "imagen", "imagen-4.0-generate-preview-06-06"
+) as span:
+    response = client.models.generate_images(
+        model="imagen-4.0-generate-preview-06-06",
+        prompt="Candid portrait photo of a young woman with visibly flushed, red cheeks. She is covering her face with both hands but peeking through her fingers with wide, awkward eyes, conveying a strong sense of embarrassment. The background is a softly blurred, warm-toned classroom. Soft, natural window light illuminates her face, highlighting the blush. Hyper-realistic, high detail, shallow depth of field. --ar 3:4",
+        config=types.GenerateImagesConfig(
+            number_of_images=1,
+        ),
+    )
+    span.set(images=len(response.generated_images or []))
 for generated_image in response.generated_images:
     image_bytes = generated_image.image.image_bytes
     unique_id = uuid.uuid4().hex
@@ -1,6 +1,11 @@
 from vertexai.preview.vision_models import ImageGenerationModel
 import vertexai
 import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry
 
 path_to_service_account = r"C:\Users\vanta\Downloads\videocreatorbackend-872809953a56.json"
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = path_to_service_account
@@ -9,15 +14,19 @@ vertexai.init(project="videocreatorbackend", location="us-central1")
 
 generation_model = ImageGenerationModel.from_pretrained("imagen-4.0-generate-preview-06-06")
 
-images = generation_model.generate_images(
-    prompt="A picture to illustrate the vocabulary 'of'",
-    number_of_images=1,
-    aspect_ratio="1:1",
-    negative_prompt="",
-    person_generation="allow_all",
-    safety_filter_level="block_few",
-    add_watermark=True,
-)
+with telemetry.span(
+    "images.generate", "imagen", "imagen-4.0-generate-preview-06-06"
+) as span:
+    images = generation_model.generate_images(
+        prompt="A picture to illustrate the vocabulary 'of'",
+        number_of_images=1,
+        aspect_ratio="1:1",
+        negative_prompt="",
+        person_generation="allow_all",
+        safety_filter_level="block_few",
+        add_watermark=True,
+    )
+    span.set(images=len(images.images))
 
 # Save images
 import uuid
@@ -2,19 +2,28 @@ from together import Together
 import base64
 import uuid
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry
+
 # Load environment variables
 load_dotenv()
 
 client = Together(api_key=os.getenv("TOGETHER_AI_API_KEY"))
-response = client.images.generate(
-    prompt="A realistic photo of a cat wearing a spacesuit, floating in space with Earth in the background, high resolution.",
-    model="black-forest-labs/FLUX.1-schnell-Free",
-    steps=4,
-    n=2,
-    response_format="base64",
-)
+with telemetry.span(
+    "images.generate", "together", "black-forest-labs/FLUX.1-schnell-Free"
+) as span:
+    response = client.images.generate(
+        prompt="A realistic photo of a cat wearing a spacesuit, floating in space with Earth in the background, high resolution.",
+        model="black-forest-labs/FLUX.1-schnell-Free",
+        steps=4,
+        n=2,
+        response_format="base64",
+    )
+    span.set(images=len(response.data))
 
 response_data = response.data
 
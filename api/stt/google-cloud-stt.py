@@ -1,31 +1,66 @@
+import os
+import sys
+
 from google.cloud import speech
 from dotenv import load_dotenv
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry
+from common.audio import prepare_file, recognition_config
+from common.cloud_clients import get_speech_client, limit
+from common.long_stt import SYNC_MAX_SECONDS, transcribe_long
+from common.streaming_stt import file_chunks, stream_transcribe
+
 load_dotenv()
 
 
 def transcribe_audio(path):
-    client = speech.SpeechClient()
+    client = get_speech_client()
 
-    with open(path, "rb") as audio_file:
-        content = audio_file.read()
+    prepared = prepare_file(path)
+    if prepared.duration > SYNC_MAX_SECONDS:
+        # Bản ghi dài hơn giới hạn của recognize đồng bộ: chia đoạn, chạy song song.
+        result = transcribe_long(path)
+        print(f"Chunks: {result['chunks']}, duration: {result['duration']}s")
+        print("Transcript:", result["transcript"])
+        return
 
-    audio = speech.RecognitionAudio(content=content)
+    audio = speech.RecognitionAudio(content=prepared.data)
 
-    config = speech.RecognitionConfig(
-        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-        sample_rate_hertz=24000,
+    config = recognition_config(
+        prepared,
         language_code="en-US",
         enable_automatic_punctuation=True,
     )
 
-    response = client.recognize(config=config, audio=audio)
+    with telemetry.span(
+        "speech.recognize",
+        "google-cloud-speech",
+        request_bytes=len(prepared.data),
+        audio_seconds=prepared.duration,
+    ), limit("speech"):
+        response = client.recognize(config=config, audio=audio)
 
     for result in response.results:
         print("Result:", result)
         print("Transcript:", result.alternatives[0].transcript)
 
 
+def transcribe_audio_stream(path):
+    # Phát lại file như đang thu trực tiếp: in bản tạm và bản chốt kèm thời điểm từng từ.
+    for event in stream_transcribe(file_chunks(path)):
+        if "error" in event:
+            print(event["error"])
+            return
+        if not event["is_final"]:
+            print("Interim:", event["transcript"])
+            continue
+        print("Final:", event["transcript"], f"(confidence {event['confidence']:.2f})")
+        for word in event["words"]:
+            print(f"  {word['start']:6.2f}s - {word['end']:6.2f}s  {word['word']}")
+
+
 if __name__ == "__main__":
     transcribe_audio("google_tts_output_vi.wav")
 
@@ -1,9 +1,17 @@
+import os
+import sys
+
 from google.cloud import texttospeech
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from common import telemetry
+from common.cloud_clients import get_tts_client, limit
+
 
 def text_to_speech(text, output_file, key_path):
-    # Khởi tạo client từ API key JSON
-    client = texttospeech.TextToSpeechClient.from_service_account_file(key_path)
+    # Lấy client dùng chung (channel gRPC được giữ lại giữa các lần gọi)
+    client = get_tts_client(credentials_file=key_path)
 
     # Nội dung text tiếng Anh
     synthesis_input = texttospeech.SynthesisInput(text=text)
@@ -21,9 +29,13 @@ def text_to_speech(text, output_file, key_path):
     )
 
     # Gọi API sinh giọng nói
-    response = client.synthesize_speech(
-        input=synthesis_input, voice=voice, audio_config=audio_config
-    )
+    with telemetry.span(
+        "tts.synthesize_speech", "google-cloud-tts", characters=len(text)
+    ) as span, limit("tts"):
+        response = client.synthesize_speech(
+            input=synthesis_input, voice=voice, audio_config=audio_config
+        )
+        span.set(response_bytes=len(response.audio_content))
 
     # Ghi ra file
     with open(output_file, "wb") as out:
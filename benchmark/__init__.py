@@ -0,0 +1,5 @@
+"""
+Benchmark throughput/độ trễ của các pipeline ai-features trên server giả lập
+Gemini và Cloud Speech/TTS (benchmark.server), không tốn quota thật.
+Chạy: python -m benchmark.run --help
+"""
@@ -0,0 +1,292 @@
+"""
+Chạy benchmark các feature trên server giả lập và xuất kết quả dạng JSON.
+
+    python -m benchmark.run --features 12,49,90 --concurrency 1,8,32 \\
+        --requests 100 --output results.json --baseline baseline.json
+
+Mỗi feature chạy lần lượt từng mức đồng thời; kết quả gồm throughput, p50/p95/p99
+và peak RSS của tiến trình client. --baseline so sánh với lần chạy trước và
+thoát với mã 1 khi throughput giảm hoặc p95 tăng quá --max-regression.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmark import server as stub
+from benchmark.scenarios import ROOT, SCENARIOS, is_error, make_call
+
+RSS_SAMPLE_SECONDS = 0.02
+
+
+def _percentile(samples: list[float], percentile: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _current_rss_bytes() -> int | None:
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class RssSampler:
+    """
+    Lấy mẫu RSS định kỳ để đo peak của từng lượt chạy. Không có /proc (macOS)
+    thì dùng ru_maxrss, là peak của cả tiến trình từ lúc khởi động.
+    """
+
+    def __init__(self):
+        self.peak = _current_rss_bytes() or 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            self.peak = max(self.peak, _current_rss_bytes() or 0)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        if not self.peak:
+            # ru_maxrss tính bằng KB trên Linux, byte trên macOS.
+            scale = 1 if sys.platform == "darwin" else 1024
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        return False
+
+
+async def _run_level(call, concurrency: int, requests: int, offset: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                failed = is_error(await call(offset + i))
+            except Exception as e:
+                print(f"Lỗi benchmark: {e}", file=sys.stderr)
+                failed = True
+            if failed:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "p50_ms": ms(_percentile(latencies, 50)),
+        "p95_ms": ms(_percentile(latencies, 95)),
+        "p99_ms": ms(_percentile(latencies, 99)),
+        "peak_rss_mb": round(rss.peak / 2**20, 2),
+    }
+
+
+async def run_feature(
+    feature: str,
+    audio_path: str,
+    concurrency_levels: list[int],
+    requests: int,
+    warmup: int,
+) -> list[dict]:
+    call = make_call(feature, audio_path)
+    # Warm-up: mở kết nối, tạo context cache... không tính vào kết quả.
+    await asyncio.gather(*(call(-1 - i) for i in range(warmup)))
+    results = []
+    offset = 0
+    for concurrency in concurrency_levels:
+        result = await _run_level(call, concurrency, requests, offset)
+        offset += requests
+        results.append({"feature": feature, **result})
+        print(
+            f"[{feature}] c={concurrency}: {result['throughput_rps']} req/s, "
+            f"p95={result['p95_ms']} ms, errors={result['errors']}",
+            file=sys.stderr,
+        )
+    return results
+
+
+async def _run_all(features: list[str], audio_path: str, args) -> list[dict]:
+    # Một event loop cho mọi feature: client async của Gemini gắn với loop tạo ra nó.
+    results = []
+    for feature in features:
+        results += await run_feature(
+            feature, audio_path, args.concurrency, args.requests, args.warmup
+        )
+    return results
+
+
+def start_stub(args: argparse.Namespace) -> tuple[subprocess.Popen, dict]:
+    """
+    Chạy server giả lập ở tiến trình riêng để CPU/RSS của server không lẫn vào
+    số liệu của client.
+    """
+    command = [sys.executable, "-m", "benchmark.server", "--http-port", "0"]
+    command += ["--grpc-port", "0"]
+    for name in (
+        "gemini_latency",
+        "speech_latency",
+        "tts_latency",
+        "string_bytes",
+        "score",
+        "transcript",
+        "stt_confidence",
+        "tts_seconds_per_char",
+        "error_rate",
+    ):
+        command += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    endpoints = json.loads(process.stdout.readline())
+    return process, endpoints
+
+
+def configure_environment(endpoints: dict, keep_limits: bool) -> None:
+    os.environ.update(endpoints)
+    # Không bao giờ gửi API key thật tới server giả lập.
+    os.environ["GEMINI_API_KEY"] = "benchmark"
+    os.environ["GOOGLE_API_KEY"] = "benchmark"
+    # Chỉ cache/gộp request trong bộ nhớ để lần chạy này không ảnh hưởng lần sau.
+    os.environ["AI_CACHE_DIR"] = ""
+    os.environ["AI_SINGLEFLIGHT_DIR"] = ""
+    if not keep_limits:
+        os.environ["GEMINI_RPM_LIMIT"] = "1000000000"
+        os.environ["GEMINI_TPM_LIMIT"] = "1000000000000"
+
+
+def compare(results: list[dict], baseline: dict, max_regression: float) -> list[str]:
+    """
+    Danh sách mô tả các kết quả kém hơn baseline quá max_regression (tỉ lệ).
+    """
+    previous = {
+        (item["feature"], item["concurrency"]): item for item in baseline["results"]
+    }
+    regressions = []
+    for item in results:
+        base = previous.get((item["feature"], item["concurrency"]))
+        if base is None:
+            continue
+        label = f"[{item['feature']}] c={item['concurrency']}"
+        if item["throughput_rps"] < base["throughput_rps"] * (1 - max_regression):
+            regressions.append(
+                f"{label}: throughput {item['throughput_rps']} < {base['throughput_rps']}"
+            )
+        if base["p95_ms"] and item["p95_ms"] is not None:
+            if item["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+                regressions.append(f"{label}: p95 {item['p95_ms']} > {base['p95_ms']}")
+        if item["errors"] > base["errors"]:
+            regressions.append(f"{label}: errors {item['errors']} > {base['errors']}")
+    return regressions
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--features", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--audio-seconds", type=float, default=5.0)
+    parser.add_argument("--output", help="ghi JSON ra file thay vì stdout")
+    parser.add_argument("--baseline", help="file JSON kết quả lần chạy trước")
+    parser.add_argument("--max-regression", type=float, default=0.1)
+    parser.add_argument(
+        "--keep-limits",
+        action="store_true",
+        help="giữ rate limit Gemini như production (mặc định bỏ giới hạn)",
+    )
+    stub.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    features = [item for item in args.features.split(",") if item]
+    unknown = [item for item in features if item not in SCENARIOS]
+    if unknown:
+        parser.error(f"Feature không có kịch bản benchmark: {', '.join(unknown)}")
+
+    process, endpoints = start_stub(args)
+    configure_environment(endpoints, args.keep_limits)
+    try:
+        with tempfile.TemporaryDirectory(prefix="ai-benchmark-") as workdir:
+            audio_path = os.path.join(workdir, "input.wav")
+            with open(audio_path, "wb") as f:
+                f.write(stub.wav_bytes(args.audio_seconds))
+            # Feature 167 ghi file phát âm vào thư mục hiện tại.
+            cwd = os.getcwd()
+            os.chdir(workdir)
+            try:
+                results = asyncio.run(_run_all(features, audio_path, args))
+            finally:
+                os.chdir(cwd)
+    finally:
+        process.terminate()
+        process.wait()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "requests_per_level": args.requests,
+            "audio_seconds": args.audio_seconds,
+            "gemini_latency": args.gemini_latency,
+            "speech_latency": args.speech_latency,
+            "tts_latency": args.tts_latency,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
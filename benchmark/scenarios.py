@@ -0,0 +1,145 @@
+"""
+Kịch bản benchmark cho từng feature: hàm async được gọi và input của request thứ i.
+Input được gắn số thứ tự để mỗi request là một request mới (không trúng
+response cache / single-flight), giống tải thật từ nhiều người dùng.
+"""
+
+import importlib.util
+import os
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+FEATURES_DIR = os.path.join(ROOT, "ai-features")
+
+# feature: (file trong ai-features/<feature>/, hàm async, hàm tạo kwargs(i, audio_path))
+SCENARIOS = {
+    "12": (
+        "ggcloud_tts+gemini.py",
+        "get_pronunciation_feedback_async",
+        lambda i, audio: {
+            "audio_path": audio,
+            "target_word": "hello",
+            "user_level": f"VSTEP B1 #{i}",
+        },
+    ),
+    "21": (
+        "gemini.py",
+        "generate_grammar_exercise_async",
+        lambda i, audio: {
+            "grammar_structures": ["Thì Hiện tại Hoàn thành", f"Thì Quá khứ Đơn #{i}"],
+            "num_questions": 5,
+            "target_level": "VSTEP B1",
+            "exercise_type": "Trắc nghiệm",
+        },
+    ),
+    "24": (
+        "gemini.py",
+        "analyze_sentence_pronunciation_async",
+        lambda i, audio: {
+            "audio_path": audio,
+            "target_sentence": f"I love to travel and explore new places. #{i}",
+            "user_level": "VSTEP B1",
+        },
+    ),
+    "26": (
+        "gemini.py",
+        "generate_pronunciation_exercise_async",
+        lambda i, audio: {
+            "pronunciation_focus": f"Phân biệt âm /ʃ/ và /s/ #{i}",
+            "exercise_type": "đoạn văn",
+            "num_sentences": 2,
+            "target_level": "FLYERS",
+        },
+    ),
+    "30": (
+        "gemini.py",
+        "generate_listening_content_async",
+        lambda i, audio: {
+            "topic": f"A weekend picnic #{i}",
+            "num_blanks": 4,
+            "target_level": "FLYERS",
+        },
+    ),
+    "49": (
+        "gemini.py",
+        "evaluate_vstep_writing_async",
+        lambda i, audio: {
+            "task_type": "Bài 2 (Viết luận)",
+            "exam_prompt": "Online learning is becoming more and more popular.",
+            "user_submission": f"In recent year, online learning become common. #{i}",
+        },
+    ),
+    "56": (
+        "gemini.py",
+        "evaluate_vstep_speaking_async",
+        lambda i, audio: {
+            "audio_path": audio,
+            "exam_part": "Phần 3: Phát triển chủ đề",
+            "exam_prompt": f"Topic: Learning a second language. #{i}",
+        },
+    ),
+    "90": (
+        "gemini.py",
+        "evaluate_flyers_speaking_async",
+        lambda i, audio: {
+            "audio_path": audio,
+            "exam_part": "Part 2 - Story Telling",
+            "exam_prompt": f"Tell me the story of Emma at the zoo. #{i}",
+        },
+    ),
+    "167": (
+        "gemini.py",
+        "process_vocabulary_translation_async",
+        lambda i, audio: {
+            "selected_word": f"score{i}",
+            "context_sentence": "The student received a high score on the exam.",
+            "target_level": "VSTEP B1",
+        },
+    ),
+    "170": (
+        "gemini.py",
+        "process_grammar_analysis_async",
+        lambda i, audio: {
+            "selected_sentence": f"If I had studied harder, I would have passed. #{i}",
+            "paragraph_context": "Education is very important for everyone's future.",
+            "target_level": "VSTEP B2",
+        },
+    ),
+}
+
+
+def load_feature(feature: str):
+    """
+    Import module của feature theo đường dẫn (thư mục ai-features/<số> không
+    phải package Python).
+    """
+    filename, _, _ = SCENARIOS[feature]
+    path = os.path.join(FEATURES_DIR, feature, filename)
+    spec = importlib.util.spec_from_file_location(f"ai_feature_{feature}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_call(feature: str, audio_path: str):
+    """
+    Trả về coroutine function call(i) chạy request thứ i của feature.
+    """
+    _, function_name, make_kwargs = SCENARIOS[feature]
+    function = getattr(load_feature(feature), function_name)
+
+    async def call(i: int):
+        return await function(**make_kwargs(i, audio_path))
+
+    return call
+
+
+def is_error(result) -> bool:
+    """
+    Các feature trả về {"error": ...} thay vì raise; feature 12 bọc kết quả
+    Gemini trong "data".
+    """
+    if not isinstance(result, dict):
+        return result is None
+    if "error" in result or result.get("feedback_type") == "error":
+        return True
+    return isinstance(result.get("data"), dict) and "error" in result["data"]
@@ -0,0 +1,591 @@
+"""
+Server giả lập Gemini (HTTP) và Cloud Speech/TTS (gRPC) để benchmark không tốn quota.
+
+  - HTTP: POST /v1beta/models/{model}:generateContent, :streamGenerateContent
+    (SSE), /v1beta/cachedContents và upload resumable của Files API
+    (/upload/v1beta/files). Phản hồi JSON được sinh theo responseSchema trong
+    request nên hợp lệ với schema của mọi feature.
+  - gRPC: google.cloud.speech.v1.Speech/Recognize, /StreamingRecognize và
+    google.cloud.texttospeech.v1.TextToSpeech/SynthesizeSpeech.
+
+Độ trễ cấu hình theo phân phối, ví dụ "fixed:0.2", "uniform:0.1,0.5" hoặc
+"lognormal:0.8,0.4" (median giây, sigma). Chạy độc lập:
+
+    python -m benchmark.server --gemini-latency lognormal:0.8,0.4
+"""
+
+import argparse
+import json
+import math
+import random
+import struct
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grpc
+from google.cloud import speech, texttospeech
+
+DEFAULT_GEMINI_LATENCY = "lognormal:0.8,0.4"
+DEFAULT_SPEECH_LATENCY = "lognormal:0.4,0.3"
+DEFAULT_TTS_LATENCY = "lognormal:0.3,0.3"
+STREAM_CHUNKS = 8
+TTS_SAMPLE_RATE = 24000
+
+
+def parse_latency(spec: str):
+    """
+    Trả về hàm không tham số sinh độ trễ (giây) theo spec "tên:tham số".
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        low, high = values
+        return lambda: random.uniform(low, high)
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"Phân phối độ trễ không hỗ trợ: {spec}")
+
+
+def sample_from_schema(schema: dict | None, string_bytes: int, number: float):
+    """
+    Sinh một giá trị hợp lệ theo response schema (OBJECT/ARRAY/STRING...).
+    """
+    if not schema:
+        return "x" * string_bytes
+    kind = schema.get("type", "STRING").upper()
+    if kind == "OBJECT":
+        return {
+            name: sample_from_schema(child, string_bytes, number)
+            for name, child in schema.get("properties", {}).items()
+        }
+    if kind == "ARRAY":
+        return [
+            sample_from_schema(schema.get("items"), string_bytes, number)
+            for _ in range(2)
+        ]
+    if kind == "INTEGER":
+        return int(number)
+    if kind == "NUMBER":
+        return number
+    if kind == "BOOLEAN":
+        return True
+    if schema.get("enum"):
+        return schema["enum"][0]
+    return ("lorem ipsum " * (string_bytes // 12 + 1))[:string_bytes].strip()
+
+
+def wav_bytes(seconds: float, sample_rate: int = TTS_SAMPLE_RATE) -> bytes:
+    """
+    File WAV LINEAR16 mono chứa sóng sin 220 Hz, dùng làm audio giả.
+    """
+    count = int(seconds * sample_rate)
+    samples = (
+        int(8000 * math.sin(2 * math.pi * 220 * index / sample_rate))
+        for index in range(count)
+    )
+    data = struct.pack(f"<{count}h", *samples)
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + len(data),
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        1,
+        sample_rate,
+        sample_rate * 2,
+        2,
+        16,
+        b"data",
+        len(data),
+    )
+    return header + data
+
+
+class StubConfig:
+    def __init__(
+        self,
+        gemini_latency: str = DEFAULT_GEMINI_LATENCY,
+        speech_latency: str = DEFAULT_SPEECH_LATENCY,
+        tts_latency: str = DEFAULT_TTS_LATENCY,
+        string_bytes: int = 64,
+        score: float = 7.0,
+        transcript: str = "hello",
+        stt_confidence: float = 0.85,
+        uncertain_words: str = "",
+        tts_seconds_per_char: float = 0.06,
+        error_rate: float = 0.0,
+    ):
+        self.gemini_latency = parse_latency(gemini_latency)
+        self.speech_latency = parse_latency(speech_latency)
+        self.tts_latency = parse_latency(tts_latency)
+        self.string_bytes = string_bytes
+        self.score = score
+        self.transcript = transcript
+        self.stt_confidence = stt_confidence
+        # Các từ này có độ tin cậy từng từ bằng một nửa stt_confidence.
+        self.uncertain_words = set(uncertain_words.lower().split())
+        self.tts_seconds_per_char = tts_seconds_per_char
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.stats = {
+            "gemini": 0,
+            "gemini_request_bytes": 0,
+            "speech": 0,
+            "speech_request_bytes": 0,
+            "tts": 0,
+            "errors": 0,
+            "uploads": 0,
+            "upload_bytes": 0,
+        }
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.stats[name] += value
+
+    def should_fail(self) -> bool:
+        if self.error_rate and random.random() < self.error_rate:
+            self.count("errors")
+            return True
+        return False
+
+
+def _generate_response(config: StubConfig, model: str, request: dict) -> dict:
+    generation_config = request.get("generationConfig") or {}
+    schema = generation_config.get("responseSchema")
+    if schema or generation_config.get("responseMimeType") == "application/json":
+        text = json.dumps(
+            sample_from_schema(schema, config.string_bytes, config.score),
+            ensure_ascii=False,
+        )
+    else:
+        text = "x" * config.string_bytes
+    prompt_tokens = max(1, len(json.dumps(request)) // 4)
+    output_tokens = max(1, len(text) // 4)
+    return {
+        "candidates": [
+            {
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "finishReason": "STOP",
+                "index": 0,
+            }
+        ],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        },
+        "modelVersion": model,
+    }
+
+
+def _split_text(response: dict, parts: int) -> list[dict]:
+    text = response["candidates"][0]["content"]["parts"][0]["text"]
+    size = max(1, math.ceil(len(text) / parts))
+    chunks = []
+    for start in range(0, len(text), size):
+        chunk = json.loads(json.dumps(response))
+        chunk["candidates"][0]["content"]["parts"][0]["text"] = text[
+            start : start + size
+        ]
+        chunks.append(chunk)
+    return chunks
+
+
+def _make_http_handler(config: StubConfig):
+    # name -> metadata của file đã upload qua Files API (và các upload đang dở).
+    files = {}
+    files_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, payload: dict) -> None:
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_body(self) -> bytes:
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length)
+
+        def _read_json(self) -> dict:
+            return json.loads(self._read_body() or b"{}")
+
+        def _cached_content(self, name: str | None = None) -> dict:
+            expire = datetime.now(timezone.utc) + timedelta(hours=1)
+            return {
+                "name": name or f"cachedContents/{uuid.uuid4().hex}",
+                "expireTime": expire.isoformat().replace("+00:00", "Z"),
+            }
+
+        def _start_upload(self) -> None:
+            metadata = self._read_json().get("file") or {}
+            file_id = uuid.uuid4().hex[:16]
+            expire = datetime.now(timezone.utc) + timedelta(hours=48)
+            with files_lock:
+                files[f"files/{file_id}"] = {
+                    "name": f"files/{file_id}",
+                    "displayName": metadata.get("displayName", ""),
+                    "mimeType": metadata.get("mimeType", "application/octet-stream"),
+                    "sizeBytes": "0",
+                    "uri": f"http://{self.headers['Host']}/v1beta/files/{file_id}",
+                    "expirationTime": expire.isoformat().replace("+00:00", "Z"),
+                    "state": "ACTIVE",
+                }
+            self.send_response(200)
+            self.send_header(
+                "X-Goog-Upload-URL",
+                f"http://{self.headers['Host']}/upload/v1beta/files?upload_id={file_id}",
+            )
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def _upload_chunk(self, file_id: str) -> None:
+            data = self._read_body()
+            config.count("upload_bytes", len(data))
+            with files_lock:
+                file = files.get(f"files/{file_id}")
+                if file is not None:
+                    file["sizeBytes"] = str(int(file["sizeBytes"]) + len(data))
+            if file is None:
+                self._send_json(404, {"error": {"code": 404, "message": file_id}})
+                return
+            finalize = "finalize" in self.headers.get("X-Goog-Upload-Command", "")
+            body = json.dumps({"file": file} if finalize else {}).encode("utf-8")
+            if finalize:
+                config.count("uploads")
+            self.send_response(200)
+            self.send_header("X-Goog-Upload-Status", "final" if finalize else "active")
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            name = self.path.split("?")[0].split("/v1beta/")[-1]
+            with files_lock:
+                file = files.get(name)
+            if file is None:
+                self._send_json(404, {"error": {"code": 404, "message": name}})
+            else:
+                self._send_json(200, file)
+
+        def do_PATCH(self):
+            self._read_json()
+            name = self.path.split("?")[0].split("/v1beta/")[-1]
+            self._send_json(200, self._cached_content(name))
+
+        def do_DELETE(self):
+            with files_lock:
+                files.pop(self.path.split("?")[0].split("/v1beta/")[-1], None)
+            self._send_json(200, {})
+
+        def do_POST(self):
+            path, _, query = self.path.partition("?")
+            if path == "/upload/v1beta/files":
+                if query.startswith("upload_id="):
+                    self._upload_chunk(query.split("=", 1)[1].split("&")[0])
+                else:
+                    self._start_upload()
+                return
+
+            body = self._read_body()
+            request = json.loads(body or b"{}")
+            if path.endswith("/cachedContents"):
+                self._send_json(200, self._cached_content())
+                return
+            if ":" not in path:
+                self._send_json(404, {"error": {"code": 404, "message": path}})
+                return
+
+            model, method = path.rsplit("/", 1)[-1].split(":", 1)
+            config.count("gemini")
+            config.count("gemini_request_bytes", len(body))
+            time.sleep(config.gemini_latency())
+            if config.should_fail():
+                self._send_json(
+                    503,
+                    {
+                        "error": {
+                            "code": 503,
+                            "status": "UNAVAILABLE",
+                            "message": "stub",
+                        }
+                    },
+                )
+                return
+
+            response = _generate_response(config, model, request)
+            if method != "streamGenerateContent":
+                self._send_json(200, response)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in _split_text(response, STREAM_CHUNKS):
+                data = f"data: {json.dumps(chunk)}\r\n\r\n".encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+def _abort_unavailable(context) -> None:
+    context.abort(grpc.StatusCode.UNAVAILABLE, "stub")
+
+
+def _timed_words(words: list[str], duration: float, config: StubConfig) -> list:
+    # Thời điểm từng từ chia đều theo thời lượng audio.
+    step = duration / max(1, len(words))
+    return [
+        speech.WordInfo(
+            word=word,
+            start_time=timedelta(seconds=index * step),
+            end_time=timedelta(seconds=(index + 1) * step),
+            confidence=(
+                config.stt_confidence / 2
+                if word.lower() in config.uncertain_words
+                else config.stt_confidence
+            ),
+        )
+        for index, word in enumerate(words)
+    ]
+
+
+def _make_grpc_handlers(config: StubConfig) -> list:
+    def recognize(request, context):
+        config.count("speech")
+        config.count("speech_request_bytes", len(request.audio.content))
+        time.sleep(config.speech_latency())
+        if config.should_fail():
+            _abort_unavailable(context)
+        transcript = config.transcript
+        duration = 0.0
+        encoding = speech.RecognitionConfig.AudioEncoding.LINEAR16
+        if request.config.encoding == encoding and request.config.sample_rate_hertz:
+            # WAV LINEAR16 mono: header 44 byte, 2 byte mỗi mẫu.
+            content = len(request.audio.content) - 44
+            duration = max(0, content) / (2 * request.config.sample_rate_hertz)
+        words = _timed_words(transcript.split(), duration, config)
+        alternative = speech.SpeechRecognitionAlternative(
+            transcript=transcript, confidence=config.stt_confidence, words=words
+        )
+        return speech.RecognizeResponse(
+            results=[speech.SpeechRecognitionResult(alternatives=[alternative])]
+        )
+
+    def streaming_recognize(requests, context):
+        # Mỗi STREAM_CHUNKS đoạn audio trả một bản tạm dài dần, hết audio thì
+        # trả bản chốt kèm thời điểm từng từ (chia đều theo thời lượng).
+        config.count("speech")
+        words = config.transcript.split()
+        sample_rate = 16000
+        received = 0
+        chunks = 0
+        for request in requests:
+            if "streaming_config" in request:
+                sample_rate = request.streaming_config.config.sample_rate_hertz
+                continue
+            received += len(request.audio_content)
+            config.count("speech_request_bytes", len(request.audio_content))
+            chunks += 1
+            if chunks % STREAM_CHUNKS == 0:
+                heard = words[: min(len(words), chunks // STREAM_CHUNKS)]
+                yield speech.StreamingRecognizeResponse(
+                    results=[
+                        speech.StreamingRecognitionResult(
+                            alternatives=[
+                                speech.SpeechRecognitionAlternative(
+                                    transcript=" ".join(heard)
+                                )
+                            ],
+                            stability=0.5,
+                        )
+                    ]
+                )
+        time.sleep(config.speech_latency())
+        if config.should_fail():
+            _abort_unavailable(context)
+        duration = received / (sample_rate * 2)
+        timed_words = _timed_words(words, duration, config)
+        yield speech.StreamingRecognizeResponse(
+            results=[
+                speech.StreamingRecognitionResult(
+                    alternatives=[
+                        speech.SpeechRecognitionAlternative(
+                            transcript=config.transcript,
+                            confidence=config.stt_confidence,
+                            words=timed_words,
+                        )
+                    ],
+                    is_final=True,
+                    result_end_time=timedelta(seconds=duration),
+                )
+            ]
+        )
+
+    def synthesize(request, context):
+        config.count("tts")
+        time.sleep(config.tts_latency())
+        if config.should_fail():
+            _abort_unavailable(context)
+        text = request.input.text or request.input.ssml
+        seconds = len(text) * config.tts_seconds_per_char
+        return texttospeech.SynthesizeSpeechResponse(audio_content=wav_bytes(seconds))
+
+    return [
+        grpc.method_handlers_generic_handler(
+            "google.cloud.speech.v1.Speech",
+            {
+                "Recognize": grpc.unary_unary_rpc_method_handler(
+                    recognize,
+                    request_deserializer=speech.RecognizeRequest.deserialize,
+                    response_serializer=speech.RecognizeResponse.serialize,
+                ),
+                "StreamingRecognize": grpc.stream_stream_rpc_method_handler(
+                    streaming_recognize,
+                    request_deserializer=speech.StreamingRecognizeRequest.deserialize,
+                    response_serializer=speech.StreamingRecognizeResponse.serialize,
+                ),
+            },
+        ),
+        grpc.method_handlers_generic_handler(
+            "google.cloud.texttospeech.v1.TextToSpeech",
+            {
+                "SynthesizeSpeech": grpc.unary_unary_rpc_method_handler(
+                    synthesize,
+                    request_deserializer=texttospeech.SynthesizeSpeechRequest.deserialize,
+                    response_serializer=texttospeech.SynthesizeSpeechResponse.serialize,
+                )
+            },
+        ),
+    ]
+
+
+class StubServer:
+    """
+    Chạy cả server HTTP và gRPC trong tiến trình hiện tại (mỗi request một thread).
+    """
+
+    def __init__(
+        self,
+        config: StubConfig,
+        host: str = "127.0.0.1",
+        http_port: int = 0,
+        grpc_port: int = 0,
+        max_workers: int = 256,
+    ):
+        self.config = config
+        self.host = host
+        self._http = ThreadingHTTPServer((host, http_port), _make_http_handler(config))
+        self._http.daemon_threads = True
+        self._grpc = grpc.server(ThreadPoolExecutor(max_workers=max_workers))
+        self._grpc.add_generic_rpc_handlers(_make_grpc_handlers(config))
+        self.grpc_port = self._grpc.add_insecure_port(f"{host}:{grpc_port}")
+        self.http_port = self._http.server_address[1]
+        self._thread = None
+
+    @property
+    def gemini_base_url(self) -> str:
+        return f"http://{self.host}:{self.http_port}"
+
+    @property
+    def grpc_endpoint(self) -> str:
+        return f"{self.host}:{self.grpc_port}"
+
+    def start(self) -> "StubServer":
+        self._grpc.start()
+        self._thread = threading.Thread(target=self._http.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._http.shutdown()
+        self._http.server_close()
+        self._grpc.stop(grace=None)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--gemini-latency", default=DEFAULT_GEMINI_LATENCY)
+    parser.add_argument("--speech-latency", default=DEFAULT_SPEECH_LATENCY)
+    parser.add_argument("--tts-latency", default=DEFAULT_TTS_LATENCY)
+    parser.add_argument(
+        "--string-bytes", type=int, default=64, help="độ dài mỗi trường STRING"
+    )
+    parser.add_argument(
+        "--score", type=float, default=7.0, help="giá trị các trường số"
+    )
+    parser.add_argument("--transcript", default="hello")
+    parser.add_argument("--stt-confidence", type=float, default=0.85)
+    parser.add_argument(
+        "--uncertain-words", default="", help="các từ có độ tin cậy thấp trong STT"
+    )
+    parser.add_argument("--tts-seconds-per-char", type=float, default=0.06)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+
+
+def config_from_args(args: argparse.Namespace) -> StubConfig:
+    return StubConfig(
+        gemini_latency=args.gemini_latency,
+        speech_latency=args.speech_latency,
+        tts_latency=args.tts_latency,
+        string_bytes=args.string_bytes,
+        score=args.score,
+        transcript=args.transcript,
+        stt_confidence=args.stt_confidence,
+        uncertain_words=args.uncertain_words,
+        tts_seconds_per_char=args.tts_seconds_per_char,
+        error_rate=args.error_rate,
+    )
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--http-port", type=int, default=8765)
+    parser.add_argument("--grpc-port", type=int, default=50051)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = StubServer(
+        config_from_args(args), args.host, args.http_port, args.grpc_port
+    ).start()
+    # Dòng đầu tiên trên stdout cho biết địa chỉ để tiến trình khác kết nối.
+    print(
+        json.dumps(
+            {
+                "GEMINI_BASE_URL": server.gemini_base_url,
+                "CLOUD_GRPC_ENDPOINT": server.grpc_endpoint,
+            }
+        ),
+        flush=True,
+    )
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+        print(json.dumps(server.config.stats), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+"""
+Các thành phần dùng chung cho ai-features/* và api/*.
+"""
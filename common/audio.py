@@ -0,0 +1,544 @@
+"""
+Tiền xử lý audio trước khi gửi lên Cloud STT / Gemini.
+
+Đọc header WAV (không giả định 24 kHz), trộn về mono, resample về
+AI_AUDIO_SAMPLE_RATE (mặc định 16 kHz, đủ cho nhận dạng giọng nói) rồi mã hoá
+theo AI_AUDIO_ENCODING: "wav" (LINEAR16), "flac" hoặc "opus" (Ogg). FLAC/Opus
+cần gói soundfile; thiếu thì dùng WAV. Cấu hình STT (recognition_config) và
+mime_type của Gemini lấy theo kết quả mã hoá nên luôn khớp nhau.
+AI_AUDIO_PREPROCESS=0 gửi nguyên file gốc.
+
+Khoảng lặng đầu/cuối được cắt theo năng lượng từng frame (AI_AUDIO_TRIM=1);
+AI_AUDIO_MAX_PAUSE (giây) rút ngắn các lần ngừng dài giữa câu. Thống kê ngắt
+nghỉ được đo trên bản ghi gốc, trước khi cắt, để chấm độ trôi chảy vẫn đúng.
+
+File được đọc qua mmap (map_file) và xử lý trên memoryview; resample chạy theo
+từng khối nên bộ nhớ tạm không tăng theo độ dài bản ghi. Bộ nhớ đỉnh của một
+request chỉ còn vài lần kích thước file.
+"""
+
+import io
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from math import gcd
+
+import numpy as np
+from google.cloud import speech
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+DEFAULT_SAMPLE_RATE = 16000
+DEFAULT_ENCODING = "flac"
+# Các mức Opus chấp nhận; rate khác được đưa về mức gần nhất phía trên.
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+# encoding -> (mime_type cho Gemini, AudioEncoding của Cloud STT)
+ENCODINGS = {
+    "wav": ("audio/wav", "LINEAR16"),
+    "flac": ("audio/flac", "FLAC"),
+    "opus": ("audio/ogg", "OGG_OPUS"),
+}
+CACHE_SIZE = 16
+
+# VAD theo năng lượng: frame 20 ms, có tiếng nói khi năng lượng vượt nền nhiễu
+# SPEECH_MARGIN_DB (nhưng không thấp hơn ABSOLUTE_SILENCE_DB, và không cao hơn
+# đỉnh trừ DYNAMIC_RANGE_DB để bản ghi toàn tiếng nói không bị coi là lặng).
+FRAME_SECONDS = 0.02
+SPEECH_MARGIN_DB = 12.0
+ABSOLUTE_SILENCE_DB = -60.0
+DYNAMIC_RANGE_DB = 30.0
+NOISE_FLOOR_PERCENTILE = 10
+# Giữ lại một chút lặng quanh tiếng nói để không cắt mất phụ âm đầu/cuối.
+TRIM_PADDING_SECONDS = 0.2
+# Chỉ tính là một lần ngừng khi lặng ít nhất khoảng này.
+MIN_PAUSE_SECONDS = 0.25
+# Gemini tính ~32 token cho mỗi giây audio.
+AUDIO_TOKENS_PER_SECOND = 32
+
+# Resample theo khối RESAMPLE_BLOCK_SECONDS, đệm RESAMPLE_MARGIN_SECONDS mỗi
+# bên (phần đệm bị bỏ sau khi biến đổi nên biên khối không bị méo). So với FFT
+# một lần: sai khác ~1e-7 với audio ít năng lượng gần tần số Nyquist mới (giọng
+# nói), tới ~3e-3 với nhiễu trắng (đuôi sinc của bộ lọc cắt phổ tắt chậm, tăng
+# phần đệm cũng giảm rất ít). Xem tests/test_audio.py.
+RESAMPLE_BLOCK_SECONDS = 10.0
+RESAMPLE_MARGIN_SECONDS = 0.1
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class PreparedAudio:
+    """
+    Audio đã xử lý: bytes gửi đi cùng định dạng tương ứng.
+    """
+
+    def __init__(
+        self,
+        data: bytes,
+        encoding: str,
+        sample_rate: int | None,
+        duration: float,
+        channels: int = 1,
+        pauses: dict | None = None,
+    ):
+        self.data = data
+        self.encoding = encoding
+        self.sample_rate = sample_rate
+        self.duration = duration
+        self.channels = channels
+        # Thống kê ngắt nghỉ của bản ghi gốc (xem pause_stats()).
+        self.pauses = pauses
+
+    @property
+    def removed_seconds(self) -> float:
+        return self.pauses["removed_seconds"] if self.pauses else 0.0
+
+    @property
+    def tokens_saved(self) -> int:
+        return int(self.removed_seconds * AUDIO_TOKENS_PER_SECOND)
+
+    @property
+    def mime_type(self) -> str:
+        return ENCODINGS[self.encoding][0]
+
+    @property
+    def stt_encoding(self) -> str:
+        return ENCODINGS[self.encoding][1]
+
+
+def map_file(path: str) -> memoryview:
+    """
+    Nội dung file dạng memoryview chỉ đọc trên mmap: không sao chép cả file vào
+    bộ nhớ của tiến trình, trang nào được đọc mới được nạp từ page cache.
+    mmap được đóng khi không còn view nào tham chiếu.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b"")
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def parse_wav(data) -> tuple[np.ndarray, int]:
+    """
+    Đọc file WAV (PCM 8/16/24/32 bit hoặc float) thành mảng float32 dạng
+    (số frame, số kênh) trong khoảng [-1, 1] cùng sample rate trong header.
+    """
+    view = memoryview(data)
+    if bytes(view[:4]) != b"RIFF" or bytes(view[8:12]) != b"WAVE":
+        raise ValueError("Không phải file WAV (thiếu header RIFF/WAVE).")
+
+    fmt = None
+    pcm = None
+    offset = 12
+    while offset + 8 <= len(view):
+        chunk_id = bytes(view[offset : offset + 4])
+        (size,) = struct.unpack_from("<I", view, offset + 4)
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack_from("<HHIIHH", view, body)
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE and size >= 26:
+                # Sub-format GUID bắt đầu bằng mã định dạng thật.
+                fmt = (struct.unpack_from("<H", view, body + 24)[0],) + fmt[1:]
+        elif chunk_id == b"data":
+            # File ghi dạng stream có thể để size = 0xFFFFFFFF.
+            pcm = view[body : min(body + size, len(view))]
+            break
+        offset = body + size + (size & 1)
+
+    if fmt is None or pcm is None:
+        raise ValueError("File WAV thiếu chunk fmt hoặc data.")
+    format_tag, channels, sample_rate, _, block_align, bits = fmt
+    pcm = pcm[: len(pcm) - len(pcm) % block_align]
+
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64):
+        samples = np.frombuffer(pcm, dtype=f"<f{bits // 8}").astype(np.float32)
+    elif format_tag == WAVE_FORMAT_PCM and bits == 8:
+        samples = (np.frombuffer(pcm, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif format_tag == WAVE_FORMAT_PCM and bits in (16, 32):
+        samples = np.frombuffer(pcm, dtype=f"<i{bits // 8}").astype(np.float32)
+        samples /= 2 ** (bits - 1)
+    elif format_tag == WAVE_FORMAT_PCM and bits == 24:
+        raw = np.frombuffer(pcm, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        packed = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        samples = (packed - ((packed & 0x800000) << 1)).astype(np.float32) / 2**23
+    else:
+        raise ValueError(f"Định dạng WAV chưa hỗ trợ: format={format_tag}, {bits} bit.")
+    return samples.reshape(-1, channels), sample_rate
+
+
+def downmix(samples: np.ndarray) -> np.ndarray:
+    """
+    Trộn (frame, kênh) về mono bằng trung bình các kênh.
+    """
+    if samples.ndim == 1:
+        return samples
+    if samples.shape[1] == 1:
+        return samples[:, 0]
+    return samples.mean(axis=1, dtype=np.float32)
+
+
+def _fft_length(count: int, multiple: int) -> int:
+    """
+    Độ dài FFT nhanh nhỏ nhất ≥ count và chia hết cho multiple: multiple × k
+    với k chỉ có ước nguyên tố 2, 3, 5, 7 (độ dài có ước nguyên tố lớn làm
+    FFT chậm đi hàng chục lần).
+    """
+    k = -(-count // multiple)
+    while True:
+        rest = k
+        for prime in (2, 3, 5, 7):
+            while rest % prime == 0:
+                rest //= prime
+        if rest == 1:
+            return k * multiple
+        k += 1
+
+
+def _resample_block(
+    samples: np.ndarray, source_rate: int, target_rate: int
+) -> np.ndarray:
+    count = int(round(len(samples) * target_rate / source_rate))
+    padded = _fft_length(len(samples), source_rate // gcd(source_rate, target_rate))
+    resampled_length = padded * target_rate // source_rate
+    spectrum = np.fft.rfft(samples, padded)
+    spectrum = spectrum[: min(len(spectrum), resampled_length // 2 + 1)]
+    resampled = np.fft.irfft(spectrum, resampled_length)
+    resampled *= resampled_length / padded
+    return resampled[:count].astype(np.float32)
+
+
+def resample(samples: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+    """
+    Resample mono bằng FFT: cắt (hoặc đệm) phổ tại tần số Nyquist mới, vừa lọc
+    chống aliasing vừa nội suy trong một bước. Audio được đệm 0 tới độ dài FFT
+    nhanh rồi cắt lại sau khi biến đổi. Bản ghi dài được xử lý theo từng khối
+    RESAMPLE_BLOCK_SECONDS và ghi thẳng vào mảng kết quả.
+    """
+    if source_rate == target_rate or len(samples) == 0:
+        return samples
+    # Biên khối là bội của multiple để vị trí mẫu đích là số nguyên.
+    multiple = source_rate // gcd(source_rate, target_rate)
+    block = max(1, int(RESAMPLE_BLOCK_SECONDS * source_rate) // multiple) * multiple
+    if len(samples) <= block:
+        return _resample_block(samples, source_rate, target_rate)
+
+    margin = max(1, int(RESAMPLE_MARGIN_SECONDS * source_rate) // multiple) * multiple
+    count = int(round(len(samples) * target_rate / source_rate))
+    resampled = np.empty(count, dtype=np.float32)
+    for start in range(0, len(samples), block):
+        low = max(0, start - margin)
+        high = min(len(samples), start + block + margin)
+        part = _resample_block(samples[low:high], source_rate, target_rate)
+        skip = (start - low) * target_rate // source_rate
+        out_start = start * target_rate // source_rate
+        out_end = min(count, (start + block) * target_rate // source_rate)
+        resampled[out_start:out_end] = part[skip : skip + out_end - out_start]
+    return resampled
+
+
+def frame_runs(mask: np.ndarray, value: bool) -> np.ndarray:
+    """
+    Các đoạn liên tiếp mask == value, dạng mảng (bắt đầu, kết thúc) theo frame.
+    """
+    padded = np.concatenate(([False], mask == value, [False]))
+    edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+    return edges.reshape(-1, 2)
+
+
+def speech_frames(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """
+    Mask có tiếng nói cho từng frame FRAME_SECONDS của audio mono.
+    """
+    frame = max(1, int(sample_rate * FRAME_SECONDS))
+    count = len(samples) // frame
+    if count == 0:
+        return np.zeros(0, dtype=bool)
+    frames = samples[: count * frame].reshape(count, frame)
+    power = np.einsum("ij,ij->i", frames, frames, dtype=np.float64) / frame
+    energy = 10 * np.log10(power + 1e-12)
+    floor = np.percentile(energy, NOISE_FLOOR_PERCENTILE)
+    threshold = min(floor + SPEECH_MARGIN_DB, energy.max() - DYNAMIC_RANGE_DB)
+    return energy > max(threshold, ABSOLUTE_SILENCE_DB)
+
+
+def pause_stats(mask: np.ndarray) -> dict:
+    """
+    Thống kê ngắt nghỉ từ mask tiếng nói: lặng đầu/cuối, số lần ngừng giữa câu
+    (≥ MIN_PAUSE_SECONDS), tổng và lần ngừng dài nhất, tỉ lệ thời gian có tiếng.
+    """
+    duration = len(mask) * FRAME_SECONDS
+    speech = np.flatnonzero(mask)
+    if len(speech) == 0:
+        return {
+            "duration": round(duration, 3),
+            "speech_seconds": 0.0,
+            "leading_silence": round(duration, 3),
+            "trailing_silence": 0.0,
+            "pause_count": 0,
+            "pause_seconds": 0.0,
+            "longest_pause": 0.0,
+            "mean_pause": 0.0,
+            "speech_ratio": 0.0,
+        }
+    first, last = speech[0], speech[-1] + 1
+    silences = frame_runs(mask[first:last], False)
+    lengths = (silences[:, 1] - silences[:, 0]) * FRAME_SECONDS
+    pauses = lengths[lengths >= MIN_PAUSE_SECONDS]
+    return {
+        "duration": round(duration, 3),
+        "speech_seconds": round(len(speech) * FRAME_SECONDS, 3),
+        "leading_silence": round(float(first) * FRAME_SECONDS, 3),
+        "trailing_silence": round(float(len(mask) - last) * FRAME_SECONDS, 3),
+        "pause_count": int(len(pauses)),
+        "pause_seconds": round(float(pauses.sum()), 3),
+        "longest_pause": round(float(pauses.max(initial=0.0)), 3),
+        "mean_pause": round(float(pauses.mean()) if len(pauses) else 0.0, 3),
+        "speech_ratio": round(len(speech) * FRAME_SECONDS / duration, 3),
+    }
+
+
+def trim_silence(
+    samples: np.ndarray, sample_rate: int, max_pause: float | None = None
+) -> tuple[np.ndarray, dict]:
+    """
+    Cắt khoảng lặng đầu/cuối (chừa TRIM_PADDING_SECONDS) và, nếu có max_pause,
+    rút mỗi lần ngừng dài hơn max_pause còn max_pause (bỏ phần giữa). Trả về
+    audio đã cắt và pause_stats() của bản gốc kèm "removed_seconds".
+    """
+    mask = speech_frames(samples, sample_rate)
+    stats = pause_stats(mask)
+    frame = max(1, int(sample_rate * FRAME_SECONDS))
+    speech = np.flatnonzero(mask)
+    if len(speech) == 0:
+        stats["removed_seconds"] = 0.0
+        return samples, stats
+
+    padding = int(TRIM_PADDING_SECONDS / FRAME_SECONDS)
+    first = max(0, speech[0] - padding)
+    last = min(len(mask), speech[-1] + 1 + padding)
+    # +1 tại đầu mỗi đoạn bỏ, -1 tại cuối; cumsum > 0 là frame bị bỏ.
+    delta = np.zeros(len(mask) + 1, dtype=np.int32)
+    delta[0] += 1
+    delta[first] -= 1
+    delta[last] += 1
+    if max_pause:
+        keep = int(max_pause / FRAME_SECONDS)
+        silences = frame_runs(mask[speech[0] : speech[-1] + 1], False) + speech[0]
+        long = silences[silences[:, 1] - silences[:, 0] > keep]
+        cut_start = long[:, 0] + keep // 2
+        cut_end = long[:, 1] - (keep - keep // 2)
+        np.add.at(delta, cut_start, 1)
+        np.add.at(delta, cut_end, -1)
+    drop = np.cumsum(delta[:-1]) > 0
+
+    keep_samples = np.repeat(~drop, frame)
+    # Phần lẻ cuối file (không đủ một frame) theo frame cuối cùng.
+    tail = len(samples) - len(keep_samples)
+    keep_samples = np.concatenate((keep_samples, np.full(tail, not drop[-1])))
+    trimmed = samples[keep_samples]
+    stats["removed_seconds"] = round((len(samples) - len(trimmed)) / sample_rate, 3)
+    return trimmed, stats
+
+
+def pause_note(prepared: PreparedAudio) -> str | None:
+    """
+    Ghi chú cho Gemini khi audio đã bị cắt lặng: số liệu ngắt nghỉ của bản ghi
+    gốc để đánh giá độ trôi chảy không dựa trên bản đã rút gọn.
+    """
+    if not prepared.removed_seconds:
+        return None
+    pauses = prepared.pauses
+    return (
+        f"Ghi chú kỹ thuật: đã cắt {prepared.removed_seconds:.1f} giây khoảng lặng "
+        f"khỏi audio đính kèm. Số liệu của bản ghi gốc: dài {pauses['duration']:.1f} "
+        f"giây, im lặng trước khi bắt đầu nói {pauses['leading_silence']:.1f} giây, "
+        f"{pauses['pause_count']} lần ngừng giữa chừng (tổng "
+        f"{pauses['pause_seconds']:.1f} giây, lâu nhất {pauses['longest_pause']:.1f} "
+        f"giây). Dùng số liệu này khi đánh giá sự trôi chảy."
+    )
+
+
+def to_pcm16(samples: np.ndarray) -> np.ndarray:
+    scaled = np.clip(samples, -1.0, 1.0)
+    scaled *= 32767
+    return scaled.astype("<i2")
+
+
+def wav_header(data_size: int, sample_rate: int, channels: int = 1) -> bytes:
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + data_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        WAVE_FORMAT_PCM,
+        channels,
+        sample_rate,
+        sample_rate * channels * 2,
+        channels * 2,
+        16,
+        b"data",
+        data_size,
+    )
+
+
+def encode(samples: np.ndarray, sample_rate: int, encoding: str) -> bytes:
+    """
+    Mã hoá audio mono float thành bytes theo encoding ("wav", "flac", "opus").
+    """
+    if encoding == "wav":
+        pcm = to_pcm16(samples)
+        # join ghi header và PCM thẳng vào bytes kết quả, không qua tobytes().
+        return b"".join((wav_header(pcm.nbytes, sample_rate), pcm.data))
+    buffer = io.BytesIO()
+    if encoding == "flac":
+        soundfile.write(buffer, to_pcm16(samples), sample_rate, format="FLAC")
+    elif encoding == "opus":
+        soundfile.write(buffer, samples, sample_rate, format="OGG", subtype="OPUS")
+    else:
+        raise ValueError(f"Encoding audio không hợp lệ: {encoding}")
+    return buffer.getvalue()
+
+
+def current_settings() -> tuple[bool, int, str, bool, float | None]:
+    enabled = os.getenv("AI_AUDIO_PREPROCESS", "1") != "0"
+    trim = os.getenv("AI_AUDIO_TRIM", "1") != "0"
+    max_pause = float(os.getenv("AI_AUDIO_MAX_PAUSE") or 0) or None
+    sample_rate = int(os.getenv("AI_AUDIO_SAMPLE_RATE", DEFAULT_SAMPLE_RATE))
+    encoding = os.getenv("AI_AUDIO_ENCODING", DEFAULT_ENCODING).lower()
+    if encoding not in ENCODINGS:
+        print(f"Lỗi cấu hình AI_AUDIO_ENCODING={encoding}, dùng wav.")
+        encoding = "wav"
+    if encoding != "wav" and soundfile is None:
+        encoding = "wav"
+    if encoding == "opus":
+        sample_rate = min(
+            (rate for rate in OPUS_SAMPLE_RATES if rate >= sample_rate),
+            default=OPUS_SAMPLE_RATES[-1],
+        )
+    return enabled, sample_rate, encoding, trim, max_pause
+
+
+def prepare(
+    data,
+    sample_rate: int | None = None,
+    encoding: str | None = None,
+    trim: bool | None = None,
+    max_pause: float | None = None,
+) -> PreparedAudio:
+    """
+    Xử lý bytes của một file WAV: mono, resample, cắt lặng, mã hoá. Tham số
+    không truyền thì lấy từ biến môi trường.
+    """
+    _, default_rate, default_encoding, default_trim, default_pause = current_settings()
+    sample_rate = sample_rate or default_rate
+    encoding = encoding or default_encoding
+    samples, source_rate = parse_wav(data)
+    mono = resample(downmix(samples), source_rate, sample_rate)
+    # Bản float ở sample rate gốc là mảng lớn nhất; bỏ ngay khi không cần nữa.
+    del samples
+    pauses = None
+    if default_trim if trim is None else trim:
+        mono, pauses = trim_silence(mono, sample_rate, max_pause or default_pause)
+        _record(pauses)
+    return PreparedAudio(
+        encode(mono, sample_rate, encoding),
+        encoding,
+        sample_rate,
+        len(mono) / sample_rate,
+        pauses=pauses,
+    )
+
+
+def _passthrough(data) -> PreparedAudio:
+    # Gửi nguyên file: chép khỏi mmap để bản trong cache không phụ thuộc vào
+    # file trên đĩa (file bị ghi đè/cắt ngắn sẽ làm hỏng mmap).
+    data = bytes(data)
+    try:
+        samples, sample_rate = parse_wav(data)
+        return PreparedAudio(
+            data, "wav", sample_rate, len(samples) / sample_rate, samples.shape[1]
+        )
+    except ValueError:
+        # Không đọc được header: để Cloud STT tự nhận sample rate.
+        return PreparedAudio(data, "wav", None, 0.0)
+
+
+_cache: OrderedDict = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {"files": 0, "input_seconds": 0.0, "removed_seconds": 0.0}
+
+
+def _record(pauses: dict) -> None:
+    with _cache_lock:
+        _stats["files"] += 1
+        _stats["input_seconds"] += pauses["duration"]
+        _stats["removed_seconds"] += pauses["removed_seconds"]
+
+
+def get_stats() -> dict:
+    """
+    Tổng số file đã cắt lặng, số giây bỏ đi và số token audio Gemini tiết kiệm.
+    """
+    with _cache_lock:
+        stats = dict(_stats)
+    stats["tokens_saved"] = int(stats["removed_seconds"] * AUDIO_TOKENS_PER_SECOND)
+    stats["removed_ratio"] = (
+        stats["removed_seconds"] / stats["input_seconds"]
+        if stats["input_seconds"]
+        else 0.0
+    )
+    return stats
+
+
+def prepare_file(path: str) -> PreparedAudio:
+    """
+    prepare() cho một file, có cache theo (đường dẫn, kích thước, mtime) để STT,
+    Gemini và các bước cascade trên cùng file chỉ xử lý một lần. File không
+    phải WAV hợp lệ được gửi nguyên bản.
+    """
+    settings = current_settings()
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns, settings)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    data = map_file(path)
+    enabled, sample_rate, encoding, trim, max_pause = settings
+    prepared = None
+    if enabled:
+        try:
+            prepared = prepare(data, sample_rate, encoding, trim, max_pause)
+        except (ValueError, RuntimeError) as e:
+            print(f"Lỗi tiền xử lý audio {path}: {e}")
+    if prepared is None:
+        prepared = _passthrough(data)
+
+    with _cache_lock:
+        _cache[key] = prepared
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return prepared
+
+
+def recognition_config(prepared: PreparedAudio, **kwargs) -> speech.RecognitionConfig:
+    """
+    RecognitionConfig của Cloud STT khớp encoding/sample rate của audio.
+    """
+    config = speech.RecognitionConfig(
+        encoding=speech.RecognitionConfig.AudioEncoding[prepared.stt_encoding],
+        audio_channel_count=prepared.channels,
+        **kwargs,
+    )
+    if prepared.sample_rate:
+        config.sample_rate_hertz = prepared.sample_rate
+    return config
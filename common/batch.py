@@ -0,0 +1,339 @@
+"""
+Chấm bài hàng loạt qua Gemini Batch API.
+
+Input là file JSONL, mỗi dòng một bài làm có trường "id". Các bài được gom thành
+file request JSONL, gửi thành batch job, chờ hoàn tất rồi ghi kết quả ra JSONL.
+Trạng thái (job đã gửi, bài đã chấm) được lưu trong file state cạnh output để
+có thể chạy lại sau khi bị dừng giữa chừng mà không gửi trùng: mỗi job được ghi
+vào state (chưa có tên) trước khi gửi, lần chạy sau tìm lại job theo
+display_name thay vì gửi lại. Dòng output ghi dở khi bị dừng được bỏ đi và bài
+đó được ghi lại.
+"""
+
+import base64
+import json
+import os
+import time
+import uuid
+
+from google.genai import types
+
+from common.file_uploads import default_uploads
+from common.gemini_client import get_client
+from common.schemas import validate
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_POLL_INTERVAL = 30.0
+SUCCEEDED = "JOB_STATE_SUCCEEDED"
+FAILED_STATES = {
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+}
+
+
+class GeminiBatchBackend:
+    """
+    Gửi batch job lên Gemini Batch API (hoặc server giả lập qua GEMINI_BASE_URL).
+    """
+
+    def __init__(self, client=None):
+        self.client = client or get_client()
+
+    def submit(self, model: str, requests_path: str, display_name: str) -> str:
+        uploaded = self.client.files.upload(
+            file=requests_path,
+            config=types.UploadFileConfig(display_name=display_name, mime_type="jsonl"),
+        )
+        job = self.client.batches.create(
+            model=model, src=uploaded.name, config={"display_name": display_name}
+        )
+        return job.name
+
+    def find(self, display_name: str) -> str | None:
+        """
+        Tên job đã tạo với display_name (None nếu chưa có job nào).
+        """
+        for job in self.client.batches.list():
+            if job.display_name == display_name:
+                return job.name
+        return None
+
+    def state(self, job_name: str) -> str:
+        return self.client.batches.get(name=job_name).state.name
+
+    def results(self, job_name: str) -> list[dict]:
+        job = self.client.batches.get(name=job_name)
+        content = self.client.files.download(file=job.dest.file_name)
+        return [
+            json.loads(line) for line in content.decode("utf-8").splitlines() if line
+        ]
+
+
+class LocalBatchBackend:
+    """
+    Batch endpoint giả lập chạy local để test luồng bulk mà không tốn quota.
+    responder(model, request) trả về text JSON cho từng request.
+    Job được lưu trên đĩa nên vẫn dùng được sau khi tiến trình khởi động lại.
+    """
+
+    def __init__(self, responder, work_dir: str, delay: float = 0.0):
+        self.responder = responder
+        self.work_dir = work_dir
+        self.delay = delay
+        os.makedirs(work_dir, exist_ok=True)
+
+    def _job_path(self, job_name: str) -> str:
+        return os.path.join(self.work_dir, f"{job_name.split('/')[-1]}.json")
+
+    def submit(self, model: str, requests_path: str, display_name: str) -> str:
+        job_name = f"batches/local-{uuid.uuid4().hex}"
+        job = {
+            "model": model,
+            "src": requests_path,
+            "display_name": display_name,
+            "created": time.time(),
+        }
+        with open(self._job_path(job_name), "w", encoding="utf-8") as f:
+            json.dump(job, f)
+        return job_name
+
+    def find(self, display_name: str) -> str | None:
+        for file_name in os.listdir(self.work_dir):
+            if not file_name.endswith(".json"):
+                continue
+            with open(os.path.join(self.work_dir, file_name), encoding="utf-8") as f:
+                if json.load(f).get("display_name") == display_name:
+                    return f"batches/{file_name[: -len('.json')]}"
+        return None
+
+    def state(self, job_name: str) -> str:
+        with open(self._job_path(job_name), "r", encoding="utf-8") as f:
+            job = json.load(f)
+        if time.time() - job["created"] < self.delay:
+            return "JOB_STATE_RUNNING"
+        return SUCCEEDED
+
+    def results(self, job_name: str) -> list[dict]:
+        with open(self._job_path(job_name), "r", encoding="utf-8") as f:
+            job = json.load(f)
+        results = []
+        for line in _read_jsonl(job["src"]):
+            try:
+                text = self.responder(job["model"], line["request"])
+                results.append(
+                    {
+                        "key": line["key"],
+                        "response": {
+                            "candidates": [{"content": {"parts": [{"text": text}]}}]
+                        },
+                    }
+                )
+            except Exception as e:
+                results.append({"key": line["key"], "error": {"message": str(e)}})
+        return results
+
+
+def _read_jsonl(path: str, repair: bool = False) -> list[dict]:
+    """
+    Đọc file JSONL. Với repair=True, dòng cuối ghi dở (tiến trình bị dừng khi
+    đang append, không có xuống dòng) được cắt khỏi file để ghi lại từ đầu.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        content = f.read()
+    lines = content.split(b"\n")
+    rows = []
+    offset = 0
+    for index, line in enumerate(lines):
+        if line.strip():
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                if not (repair and index == len(lines) - 1):
+                    raise
+                print(f"Bỏ dòng ghi dở ở cuối {path}.")
+                with open(path, "r+b") as f:
+                    f.truncate(offset)
+        offset += len(line) + 1
+    return rows
+
+
+def _jsonable(value):
+    # Batch request là JSON nên audio (bytes) phải mã hoá base64.
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(value).decode("ascii")
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    return value
+
+
+def _retain_files(value) -> None:
+    # File trong Files API mà batch job tham chiếu không được xoá khi tiến trình
+    # kết thúc: job có thể còn chạy hàng giờ sau đó.
+    if isinstance(value, dict):
+        file_data = value.get("file_data")
+        if isinstance(file_data, dict) and file_data.get("file_uri"):
+            default_uploads().retain(file_data["file_uri"])
+        for item in value.values():
+            _retain_files(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _retain_files(item)
+
+
+def _response_text(result: dict) -> str:
+    candidates = result["response"].get("candidates") or []
+    if not candidates:
+        return ""
+    parts = candidates[0].get("content", {}).get("parts", [])
+    return "".join(part.get("text", "") for part in parts)
+
+
+def _parse_result(result: dict, schema: dict | None) -> dict:
+    if "error" in result:
+        return {"error": result["error"].get("message", "Batch request lỗi.")}
+    text = _response_text(result).strip()
+    if not text:
+        return {"error": "Gemini không trả về kết quả."}
+    try:
+        data = json.loads(text.replace("```json", "").replace("```", "").strip())
+    except ValueError:
+        return {"error": "Phản hồi Gemini không phải JSON hợp lệ."}
+    errors = validate(schema, data) if schema else []
+    if errors:
+        return {"error": f"Phản hồi Gemini thiếu trường: {', '.join(errors)}"}
+    return data
+
+
+def _save_state(path: str, state: dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_bulk(
+    model: str,
+    input_path: str,
+    output_path: str,
+    build_contents,
+    schema: dict | None = None,
+    system_instruction: str | None = None,
+    backend=None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+) -> dict:
+    """
+    Chấm toàn bộ bài trong input_path qua batch job và ghi kết quả ra output_path.
+    build_contents(submission) trả về contents giống hệt lời gọi đồng bộ;
+    system_instruction là rubric tĩnh của feature (nếu có).
+    Chạy lại cùng lệnh sau khi bị dừng sẽ tiếp tục từ chỗ cũ.
+    """
+    backend = backend or GeminiBatchBackend()
+    state_path = f"{output_path}.state.json"
+    state = {"jobs": []}
+    if os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+
+    done_ids = {str(row["id"]) for row in _read_jsonl(output_path, repair=True)}
+    in_flight_ids = {key for job in state["jobs"] for key in job["keys"]}
+    pending = [
+        submission
+        for submission in _read_jsonl(input_path)
+        if str(submission["id"]) not in done_ids | in_flight_ids
+    ]
+
+    generation_config = {}
+    if schema is not None:
+        generation_config = {
+            "response_mime_type": "application/json",
+            "response_schema": schema,
+        }
+
+    # Job đã ghi vào state nhưng chưa kịp lưu tên: tìm lại theo display_name,
+    # chỉ gửi khi backend chưa có job đó.
+    for job in list(state["jobs"]):
+        if job["name"] is not None:
+            continue
+        job["name"] = backend.find(job["display_name"])
+        if job["name"] is None:
+            if not os.path.exists(job["requests_path"]):
+                state["jobs"].remove(job)
+                _save_state(state_path, state)
+                continue
+            job["name"] = backend.submit(
+                model, job["requests_path"], job["display_name"]
+            )
+            print(f"Đã gửi batch job {job['name']} ({len(job['keys'])} bài).")
+        _save_state(state_path, state)
+
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start : start + chunk_size]
+        requests_path = f"{output_path}.requests-{uuid.uuid4().hex[:8]}.jsonl"
+        with open(requests_path, "w", encoding="utf-8") as f:
+            for submission in chunk:
+                contents = build_contents(submission)
+                _retain_files(contents)
+                request = {"contents": _jsonable(contents)}
+                if generation_config:
+                    request["generation_config"] = generation_config
+                if system_instruction:
+                    request["system_instruction"] = {
+                        "parts": [{"text": system_instruction}]
+                    }
+                line = {"key": str(submission["id"]), "request": request}
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+        job = {
+            "name": None,
+            "display_name": os.path.basename(requests_path),
+            "keys": [str(s["id"]) for s in chunk],
+            "requests_path": requests_path,
+        }
+        state["jobs"].append(job)
+        _save_state(state_path, state)
+        job["name"] = backend.submit(model, requests_path, job["display_name"])
+        _save_state(state_path, state)
+        print(f"Đã gửi batch job {job['name']} ({len(chunk)} bài).")
+
+    summary = {"succeeded": 0, "failed": 0, "resubmit": 0}
+    while state["jobs"]:
+        for job in list(state["jobs"]):
+            job_state = backend.state(job["name"])
+            if job_state == SUCCEEDED:
+                # Job có thể đã được ghi một phần trước khi tiến trình bị dừng.
+                written_ids = {
+                    str(row["id"]) for row in _read_jsonl(output_path, repair=True)
+                }
+                with open(output_path, "a", encoding="utf-8") as out:
+                    for result in backend.results(job["name"]):
+                        if result["key"] in written_ids:
+                            continue
+                        row = {"id": result["key"], **_parse_result(result, schema)}
+                        summary["failed" if "error" in row else "succeeded"] += 1
+                        out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    out.flush()
+                    os.fsync(out.fileno())
+            elif job_state in FAILED_STATES:
+                # Bỏ job khỏi state để lần chạy sau gửi lại các bài này.
+                print(f"Batch job {job['name']} kết thúc với trạng thái {job_state}.")
+                summary["resubmit"] += len(job["keys"])
+            else:
+                continue
+
+            state["jobs"].remove(job)
+            _save_state(state_path, state)
+            if os.path.exists(job["requests_path"]):
+                os.remove(job["requests_path"])
+
+        if state["jobs"]:
+            time.sleep(poll_interval)
+
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    return summary
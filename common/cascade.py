@@ -0,0 +1,350 @@
+"""
+Cascade nhiều tầng cho các feature đánh giá: thử tầng rẻ/nhanh trước (model nhỏ
+hoặc heuristic cục bộ), chỉ chuyển lên model mạnh khi độ tin cậy thấp hoặc kết
+quả nằm sát ngưỡng phân loại.
+
+Ngưỡng mỗi feature cấu hình qua CASCADE_THRESHOLD_<NAME> (ví dụ
+CASCADE_THRESHOLD_49=0.6); CASCADE_ENABLED=0 luôn gọi thẳng tầng mạnh.
+
+Tầng mạnh không rơi về model của tầng rẻ khi bị circuit breaker ngắt
+(common.circuit_breaker.no_fallback_to): lỗi được trả về thay vì một kết quả
+của tầng rẻ trông như đã được phân tích lại.
+
+Chế độ dự phòng (speculative): khi tỉ lệ chuyển tầng của RECENT_WINDOW request
+gần nhất ≥ CASCADE_SPECULATE_<NAME>, tầng mạnh được chạy song song ngay từ đầu
+và bị huỷ nếu tầng rẻ đủ tin cậy. Ngưỡng thấp giảm độ trễ nhưng tốn thêm lời
+gọi bị bỏ (speculation_wasted trong stats()); không đặt thì tắt. Chỉ huỷ được
+khi tầng mạnh là hàm async (arun(), hoặc run() có aexpensive); lời gọi đồng bộ
+đã bắt đầu thì vẫn chạy hết và vẫn tốn chi phí dù kết quả bị bỏ.
+"""
+
+import asyncio
+import inspect
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from common.circuit_breaker import no_fallback_to
+from common.concurrency import submit_coroutine
+
+DEFAULT_CHEAP_MODEL = "gemini-2.5-flash-lite"
+ESCALATION_MODEL = "gemini-2.5-flash"
+# Tỉ lệ chuyển tầng "gần đây" tính trên chừng này request, và chỉ dùng khi đã
+# có ít nhất MIN_RECENT_REQUESTS request.
+RECENT_WINDOW = 50
+MIN_RECENT_REQUESTS = 10
+
+
+def cheap_model() -> str:
+    return os.getenv("CASCADE_CHEAP_MODEL", DEFAULT_CHEAP_MODEL)
+
+
+def score_confidence(
+    result: dict, field: str, cut_points: tuple[float, ...], margin: float
+) -> tuple[dict, float]:
+    """
+    Độ tin cậy theo khoảng cách từ điểm số tới ngưỡng phân loại gần nhất:
+    0 khi nằm đúng ngưỡng (hoặc lỗi), 1 khi cách xa ít nhất margin.
+    """
+    score = result.get(field)
+    if "error" in result or not isinstance(score, (int, float)):
+        return result, 0.0
+    distance = min(abs(score - cut) for cut in cut_points)
+    return result, min(1.0, distance / margin)
+
+
+def _escalate(expensive):
+    with no_fallback_to(cheap_model()):
+        return expensive()
+
+
+async def _aescalate(expensive):
+    with no_fallback_to(cheap_model()):
+        return await _maybe_await(expensive())
+
+
+_speculation_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_speculation_executor() -> ThreadPoolExecutor:
+    global _speculation_executor
+    with _executor_lock:
+        if _speculation_executor is None:
+            _speculation_executor = ThreadPoolExecutor(
+                thread_name_prefix="cascade-speculation"
+            )
+        return _speculation_executor
+
+
+class Cascade:
+    def __init__(
+        self,
+        name: str,
+        threshold: float,
+        enabled: bool = True,
+        speculate_above: float | None = None,
+    ):
+        self.name = name
+        self.threshold = threshold
+        self.enabled = enabled
+        self.speculate_above = speculate_above
+        self._lock = threading.Lock()
+        self._recent: deque = deque(maxlen=RECENT_WINDOW)
+        self._stats = {
+            "requests": 0,
+            "escalations": 0,
+            "cheap_seconds": 0.0,
+            "escalated_seconds": 0.0,
+            "accepted_cheap_seconds": 0.0,
+            "speculations": 0,
+            "speculation_wasted": 0,
+            "speculation_saved_seconds": 0.0,
+        }
+
+    def _accept(self, result, confidence: float) -> bool:
+        return result is not None and confidence >= self.threshold
+
+    def _record(
+        self,
+        cheap_seconds: float,
+        escalated_seconds: float | None,
+        speculated: bool = False,
+    ) -> None:
+        with self._lock:
+            stats = self._stats
+            stats["requests"] += 1
+            stats["cheap_seconds"] += cheap_seconds
+            self._recent.append(escalated_seconds is not None)
+            if speculated:
+                stats["speculations"] += 1
+            if escalated_seconds is None:
+                stats["accepted_cheap_seconds"] += cheap_seconds
+                if speculated:
+                    stats["speculation_wasted"] += 1
+            else:
+                stats["escalations"] += 1
+                stats["escalated_seconds"] += escalated_seconds
+                if speculated:
+                    # Chạy tuần tự mất cheap + expensive, song song mất max của hai.
+                    stats["speculation_saved_seconds"] += min(
+                        cheap_seconds, escalated_seconds
+                    )
+
+    def recent_escalation_rate(self) -> float | None:
+        """
+        Tỉ lệ chuyển tầng của RECENT_WINDOW request gần nhất; None khi chưa đủ
+        MIN_RECENT_REQUESTS request.
+        """
+        with self._lock:
+            if len(self._recent) < MIN_RECENT_REQUESTS:
+                return None
+            return sum(self._recent) / len(self._recent)
+
+    def should_speculate(self) -> bool:
+        if self.speculate_above is None:
+            return False
+        rate = self.recent_escalation_rate()
+        return rate is not None and rate >= self.speculate_above
+
+    def _escalate_message(self, confidence: float) -> None:
+        print(
+            f"[{self.name}] Độ tin cậy thấp ({confidence:.2f}), chuyển lên tầng mạnh..."
+        )
+
+    def _run_speculative(self, cheap, expensive, aexpensive=None):
+        timing = {}
+
+        def timed_expensive():
+            start = time.perf_counter()
+            try:
+                return _escalate(expensive)
+            finally:
+                timing["expensive"] = time.perf_counter() - start
+
+        async def atimed_expensive():
+            start = time.perf_counter()
+            try:
+                return await _aescalate(aexpensive)
+            finally:
+                timing["expensive"] = time.perf_counter() - start
+
+        if aexpensive is not None:
+            future = submit_coroutine(atimed_expensive())
+        else:
+            future = _get_speculation_executor().submit(timed_expensive)
+        start = time.perf_counter()
+        try:
+            result, confidence = cheap()
+        except BaseException:
+            future.cancel()
+            raise
+        cheap_seconds = time.perf_counter() - start
+        if self._accept(result, confidence):
+            # Bản async bị huỷ thật; lời gọi đồng bộ đã bắt đầu thì không dừng
+            # được, chỉ bỏ qua kết quả.
+            future.cancel()
+            self._record(cheap_seconds, None, speculated=True)
+            return result
+
+        self._escalate_message(confidence)
+        result = future.result()
+        self._record(cheap_seconds, timing["expensive"], speculated=True)
+        return result
+
+    async def _arun_speculative(self, cheap, expensive):
+        timing = {}
+
+        async def timed_expensive():
+            start = time.perf_counter()
+            try:
+                return await _aescalate(expensive)
+            finally:
+                timing["expensive"] = time.perf_counter() - start
+
+        task = asyncio.ensure_future(timed_expensive())
+        start = time.perf_counter()
+        try:
+            result, confidence = await _maybe_await(cheap())
+        except BaseException:
+            task.cancel()
+            raise
+        cheap_seconds = time.perf_counter() - start
+        if self._accept(result, confidence):
+            # Huỷ request HTTP đang chờ của tầng mạnh.
+            task.cancel()
+            self._record(cheap_seconds, None, speculated=True)
+            return result
+
+        self._escalate_message(confidence)
+        result = await task
+        self._record(cheap_seconds, timing["expensive"], speculated=True)
+        return result
+
+    def run(self, cheap, expensive, aexpensive=None):
+        """
+        cheap() trả về (kết quả, độ tin cậy 0-1); expensive() trả về kết quả.
+        aexpensive (hàm async tương đương expensive, tuỳ chọn) được dùng cho chế
+        độ dự phòng để lời gọi tầng mạnh bị huỷ được.
+        """
+        if not self.enabled:
+            return expensive()
+        if self.should_speculate():
+            return self._run_speculative(cheap, expensive, aexpensive)
+        start = time.perf_counter()
+        result, confidence = cheap()
+        cheap_seconds = time.perf_counter() - start
+        if self._accept(result, confidence):
+            self._record(cheap_seconds, None)
+            return result
+
+        self._escalate_message(confidence)
+        start = time.perf_counter()
+        result = _escalate(expensive)
+        self._record(cheap_seconds, time.perf_counter() - start)
+        return result
+
+    async def arun(self, cheap, expensive):
+        """
+        Phiên bản async của run(); cheap/expensive có thể là hàm async.
+        """
+        if not self.enabled:
+            return await _maybe_await(expensive())
+        if self.should_speculate():
+            return await self._arun_speculative(cheap, expensive)
+        start = time.perf_counter()
+        result, confidence = await _maybe_await(cheap())
+        cheap_seconds = time.perf_counter() - start
+        if self._accept(result, confidence):
+            self._record(cheap_seconds, None)
+            return result
+
+        self._escalate_message(confidence)
+        start = time.perf_counter()
+        result = await _aescalate(expensive)
+        self._record(cheap_seconds, time.perf_counter() - start)
+        return result
+
+    def escalation_rate(self) -> float:
+        with self._lock:
+            requests = self._stats["requests"]
+            return self._stats["escalations"] / requests if requests else 0.0
+
+    def stats(self) -> dict:
+        """
+        latency_saved_seconds ước lượng theo thời gian trung bình của tầng mạnh:
+        mỗi request dừng ở tầng rẻ tiết kiệm (trung bình tầng mạnh - thời gian
+        tầng rẻ), mỗi request bị chuyển tầng tốn thêm thời gian tầng rẻ.
+        speculation_wasted là số lời gọi dự phòng tầng mạnh bị bỏ vì tầng rẻ đã
+        đủ tin cậy; speculation_saved_seconds là độ trễ tiết kiệm nhờ dự phòng.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        requests, escalations = stats["requests"], stats["escalations"]
+        accepted = requests - escalations
+        stats["escalation_rate"] = escalations / requests if requests else 0.0
+        stats["latency_saved_seconds"] = 0.0
+        if escalations:
+            expensive_avg = stats["escalated_seconds"] / escalations
+            # Request chuyển tầng có chạy dự phòng không phải chờ hết tầng rẻ.
+            wasted = (
+                stats["cheap_seconds"]
+                - stats["accepted_cheap_seconds"]
+                - stats["speculation_saved_seconds"]
+            )
+            stats["latency_saved_seconds"] = (
+                accepted * expensive_avg - stats["accepted_cheap_seconds"] - wasted
+            )
+        stats["speculation_waste_rate"] = (
+            stats["speculation_wasted"] / stats["speculations"]
+            if stats["speculations"]
+            else 0.0
+        )
+        stats["recent_escalation_rate"] = self.recent_escalation_rate()
+        stats["speculate_above"] = self.speculate_above
+        stats["threshold"] = self.threshold
+        return stats
+
+
+async def _maybe_await(value):
+    return await value if inspect.isawaitable(value) else value
+
+
+_cascades: dict[str, Cascade] = {}
+_cascades_lock = threading.Lock()
+
+
+def get_cascade(
+    name: str, threshold: float, speculate_above: float | None = None
+) -> Cascade:
+    """
+    Cascade dùng chung của một feature; threshold và speculate_above là giá trị
+    mặc định khi không đặt CASCADE_THRESHOLD_<NAME> / CASCADE_SPECULATE_<NAME>
+    (đặt CASCADE_SPECULATE_<NAME>=off để tắt chế độ dự phòng).
+    """
+    with _cascades_lock:
+        cascade = _cascades.get(name)
+        if cascade is None:
+            suffix = name.upper().replace(".", "_")
+            speculate = os.getenv(f"CASCADE_SPECULATE_{suffix}", speculate_above)
+            cascade = Cascade(
+                name,
+                threshold=float(os.getenv(f"CASCADE_THRESHOLD_{suffix}", threshold)),
+                enabled=os.getenv("CASCADE_ENABLED", "1") != "0",
+                speculate_above=(
+                    None if speculate in (None, "", "off") else float(speculate)
+                ),
+            )
+            _cascades[name] = cascade
+        return cascade
+
+
+def get_stats() -> dict:
+    """
+    Thống kê escalation_rate và latency_saved_seconds của mọi cascade.
+    """
+    with _cascades_lock:
+        cascades = list(_cascades.values())
+    return {cascade.name: cascade.stats() for cascade in cascades}
@@ -0,0 +1,326 @@
+"""
+Circuit breaker theo từng model Gemini và tự động chuyển sang model dự phòng.
+
+Breaker theo dõi tỉ lệ lỗi và tỉ lệ request chậm trong cửa sổ gần nhất; vượt
+ngưỡng thì mở (từ chối ngay thay vì chờ timeout), sau open_seconds cho một vài
+request thử (half-open) để quyết định đóng lại hay mở tiếp. Khi model bị ngắt,
+request được gửi nguyên prompt tới model dự phòng trong GEMINI_FALLBACK_MODELS,
+ví dụ "gemini-1.5-flash:gemini-2.5-flash,gemini-2.5-flash:local/gemini-2.5-flash".
+Mặc định không có model dự phòng: điểm chấm bởi model khác không so sánh được
+với nhau, nên chỉ chuyển model khi đã cấu hình. Model thực sự trả lời được ghi
+vào span (model, requested_model) và response.model_version.
+Tiền tố "local/" trỏ tới server giả lập tại GEMINI_LOCAL_BASE_URL.
+
+Độ trễ để xét request chậm chỉ tính phần gửi tới provider (round_trip()), không
+tính thời gian chờ quota hay backoff 429. Trong no_fallback_to() các model
+được chỉ định bị bỏ khỏi chuỗi dự phòng (tầng mạnh của cascade không rơi về
+model của tầng rẻ).
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+from google.genai.errors import APIError
+
+LOCAL_PREFIX = "local/"
+DEFAULT_FALLBACKS: dict[str, str] = {}
+
+# Thời gian các lần gửi tới provider trong lời gọi hiện tại (xem round_trip()).
+_round_trips: ContextVar[list[float] | None] = ContextVar(
+    "breaker_round_trips", default=None
+)
+_excluded: ContextVar[frozenset] = ContextVar(
+    "breaker_excluded_fallbacks", default=frozenset()
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+def is_model_failure(error: Exception) -> bool:
+    """
+    Lỗi do phía model/server (5xx, timeout, mất kết nối). Lỗi 4xx do request
+    (kể cả 429 đã có rate limiter xử lý) không làm mở breaker.
+    """
+    if isinstance(error, APIError):
+        return error.code is not None and (error.code >= 500 or error.code == 408)
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        consecutive_failures: int = 3,
+        slow_seconds: float = 30.0,
+        slow_rate: float = 0.5,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 1,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.consecutive_failures = consecutive_failures
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self._outcomes: deque[tuple[bool, bool]] = deque(maxlen=window)
+        self._streak = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "failures": 0, "slow": 0, "rejected": 0, "opened": 0}
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self._stats["rejected"] += 1
+                    return False
+                self.state = HALF_OPEN
+                self._probes = 0
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self._stats["rejected"] += 1
+                    return False
+                self._probes += 1
+            return True
+
+    def release(self) -> None:
+        """
+        Trả lại lượt thử half-open khi request bị huỷ trước khi có kết quả.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._stats["opened"] += 1
+        print(f"Circuit breaker {self.name}: mở, chuyển sang model dự phòng.")
+
+    def record(self, latency: float, failed: bool) -> None:
+        slow = latency >= self.slow_seconds
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["failures"] += int(failed)
+            self._stats["slow"] += int(slow)
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    self._open()
+                else:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                    self._streak = 0
+                return
+
+            self._outcomes.append((failed, slow))
+            self._streak = self._streak + 1 if failed else 0
+            calls = len(self._outcomes)
+            failures = sum(1 for f, _ in self._outcomes if f)
+            slows = sum(1 for _, s in self._outcomes if s)
+            if self.state == CLOSED and (
+                self._streak >= self.consecutive_failures
+                or (
+                    calls >= self.min_calls
+                    and (
+                        failures / calls >= self.failure_rate
+                        or slows / calls >= self.slow_rate
+                    )
+                )
+            ):
+                self._open()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"state": self.state, **self._stats}
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(model: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(model)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                model,
+                slow_seconds=float(os.getenv("GEMINI_BREAKER_SLOW_SECONDS", 30.0)),
+                open_seconds=float(os.getenv("GEMINI_BREAKER_OPEN_SECONDS", 30.0)),
+            )
+            _breakers[model] = breaker
+        return breaker
+
+
+def _fallbacks() -> dict[str, str]:
+    spec = os.getenv("GEMINI_FALLBACK_MODELS")
+    if spec is None:
+        return DEFAULT_FALLBACKS
+    pairs = [item.split(":", 1) for item in spec.split(",") if ":" in item]
+    return {source.strip(): target.strip() for source, target in pairs}
+
+
+@contextmanager
+def no_fallback_to(*models: str):
+    """
+    Không chuyển sang các model này khi model gốc bị ngắt, trong phạm vi khối
+    with (kể cả task asyncio tạo bên trong).
+    """
+    token = _excluded.set(_excluded.get() | frozenset(models))
+    try:
+        yield
+    finally:
+        _excluded.reset(token)
+
+
+@contextmanager
+def round_trip():
+    """
+    Đánh dấu phần gửi request tới provider; breaker dùng thời gian của lần gửi
+    cuối cùng thay vì cả lời gọi (chờ quota, backoff, tạo context cache).
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        round_trips = _round_trips.get()
+        if round_trips is not None:
+            round_trips.append(time.monotonic() - start)
+
+
+def _latency(round_trips: list[float], start: float) -> float:
+    return round_trips[-1] if round_trips else time.monotonic() - start
+
+
+def fallback_chain(model: str) -> list[str]:
+    """
+    Model gốc rồi lần lượt các model dự phòng (không lặp lại, bỏ các model
+    trong no_fallback_to()).
+    """
+    fallbacks = _fallbacks()
+    chain = [model]
+    while chain[-1] in fallbacks and fallbacks[chain[-1]] not in chain:
+        chain.append(fallbacks[chain[-1]])
+    excluded = _excluded.get()
+    chain = [chain[0]] + [target for target in chain[1:] if target not in excluded]
+    if not os.getenv("GEMINI_LOCAL_BASE_URL"):
+        chain = [target for target in chain if not target.startswith(LOCAL_PREFIX)]
+    return chain
+
+
+def select_model(model: str) -> str:
+    """
+    Model đầu tiên trong chuỗi dự phòng có breaker cho phép (dùng cho stream,
+    vốn không thể chuyển model khi đã trả về một phần kết quả).
+    """
+    for target in fallback_chain(model):
+        if get_breaker(target).allow():
+            return target
+    raise CircuitOpenError(f"Không có model khả dụng cho {model}.")
+
+
+@contextmanager
+def track(model: str):
+    """
+    Ghi nhận kết quả của một lời gọi đã được select_model() cho phép.
+    """
+    breaker = get_breaker(model)
+    start = time.monotonic()
+    try:
+        yield
+    except Exception as e:
+        breaker.record(time.monotonic() - start, is_model_failure(e))
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    breaker.record(time.monotonic() - start, False)
+
+
+def call_with_fallback(model: str, func):
+    """
+    Gọi func(target_model) qua model đầu tiên trong chuỗi dự phòng có breaker
+    đang cho phép; lỗi phía model thì thử model kế tiếp.
+    """
+    last_error = None
+    for target in fallback_chain(model):
+        breaker = get_breaker(target)
+        if not breaker.allow():
+            continue
+        round_trips: list[float] = []
+        token = _round_trips.set(round_trips)
+        start = time.monotonic()
+        try:
+            result = func(target)
+        except Exception as e:
+            failed = is_model_failure(e)
+            breaker.record(_latency(round_trips, start), failed)
+            if not failed:
+                raise
+            print(f"Lỗi model {target}: {e}")
+            last_error = e
+            continue
+        finally:
+            _round_trips.reset(token)
+        breaker.record(_latency(round_trips, start), False)
+        return result
+    raise last_error or CircuitOpenError(f"Không có model khả dụng cho {model}.")
+
+
+async def acall_with_fallback(model: str, coro_func):
+    """
+    Phiên bản async của call_with_fallback(); coro_func(target) trả về coroutine.
+    """
+    last_error = None
+    for target in fallback_chain(model):
+        breaker = get_breaker(target)
+        if not breaker.allow():
+            continue
+        round_trips: list[float] = []
+        token = _round_trips.set(round_trips)
+        start = time.monotonic()
+        try:
+            result = await coro_func(target)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            failed = is_model_failure(e)
+            breaker.record(_latency(round_trips, start), failed)
+            if not failed:
+                raise
+            print(f"Lỗi model {target}: {e}")
+            last_error = e
+            continue
+        finally:
+            _round_trips.reset(token)
+        breaker.record(_latency(round_trips, start), False)
+        return result
+    raise last_error or CircuitOpenError(f"Không có model khả dụng cho {model}.")
+
+
+def get_stats() -> dict:
+    """
+    Trạng thái và số liệu của từng breaker.
+    """
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
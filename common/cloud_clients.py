@@ -0,0 +1,132 @@
+import os
+import threading
+from contextlib import contextmanager
+
+import grpc
+from google.cloud import speech, texttospeech
+from google.cloud.speech_v1.services.speech.transports import SpeechGrpcTransport
+from google.cloud.texttospeech_v1.services.text_to_speech.transports import (
+    TextToSpeechGrpcTransport,
+)
+
+from common import traffic
+
+DEFAULT_KEEPALIVE_TIME_MS = 30000
+DEFAULT_KEEPALIVE_TIMEOUT_MS = 10000
+DEFAULT_MAX_CONCURRENCY = 50
+
+SERVICES = {
+    "speech": (speech.SpeechClient, SpeechGrpcTransport),
+    "tts": (texttospeech.TextToSpeechClient, TextToSpeechGrpcTransport),
+}
+
+_lock = threading.Lock()
+_clients: dict[tuple[str, str | None], object] = {}
+_channels: dict[tuple[str, str | None], grpc.Channel] = {}
+_semaphores: dict[str, threading.BoundedSemaphore] = {}
+
+
+def _channel_options() -> list[tuple[str, int]]:
+    return [
+        (
+            "grpc.keepalive_time_ms",
+            int(os.getenv("CLOUD_GRPC_KEEPALIVE_TIME_MS", DEFAULT_KEEPALIVE_TIME_MS)),
+        ),
+        (
+            "grpc.keepalive_timeout_ms",
+            int(
+                os.getenv(
+                    "CLOUD_GRPC_KEEPALIVE_TIMEOUT_MS", DEFAULT_KEEPALIVE_TIMEOUT_MS
+                )
+            ),
+        ),
+        ("grpc.keepalive_permit_without_calls", 1),
+        ("grpc.http2.max_pings_without_data", 0),
+    ]
+
+
+def _get_client(service: str, credentials_file: str | None):
+    key = (service, credentials_file)
+    with _lock:
+        client = _clients.get(key)
+        if client is not None:
+            return client
+
+        client_cls, transport_cls = SERVICES[service]
+        endpoint = os.getenv("CLOUD_GRPC_ENDPOINT")
+        if traffic.replaying():
+            # Phát lại traffic đã ghi: channel không bao giờ kết nối thật.
+            channel = grpc.insecure_channel(traffic.REPLAY_TARGET)
+        elif endpoint:
+            # Server giả lập chạy local (benchmark/test): không cần credentials/TLS.
+            channel = grpc.insecure_channel(endpoint, options=_channel_options())
+        else:
+            # Tìm credentials và mở channel đúng một lần cho mỗi service.
+            channel = transport_cls.create_channel(
+                credentials_file=credentials_file, options=_channel_options()
+            )
+        client = client_cls(
+            transport=transport_cls(channel=traffic.intercept_channel(channel, service))
+        )
+        _channels[key] = channel
+        _clients[key] = client
+        return client
+
+
+def get_speech_client(credentials_file: str | None = None) -> speech.SpeechClient:
+    """
+    Trả về SpeechClient dùng chung, giữ gRPC channel sống lâu giữa các lần gọi.
+    """
+    return _get_client("speech", credentials_file)
+
+
+def get_tts_client(
+    credentials_file: str | None = None,
+) -> texttospeech.TextToSpeechClient:
+    """
+    Trả về TextToSpeechClient dùng chung, giữ gRPC channel sống lâu giữa các lần gọi.
+    """
+    return _get_client("tts", credentials_file)
+
+
+@contextmanager
+def limit(service: str):
+    """
+    Giới hạn số request đồng thời tới một service (CLOUD_MAX_CONCURRENCY,
+    riêng từng service bằng CLOUD_MAX_CONCURRENCY_<SERVICE>). Mỗi tên service
+    có semaphore riêng, ví dụ "speech_stream" cho stream STT để stream dài
+    không chiếm chỗ của request unary "speech".
+    Dùng semaphore của threading nên an toàn giữa các thread; code asyncio
+    nên gọi hàm đồng bộ qua asyncio.to_thread để không chặn event loop.
+    """
+    with _lock:
+        semaphore = _semaphores.get(service)
+        if semaphore is None:
+            default = os.getenv("CLOUD_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
+            semaphore = threading.BoundedSemaphore(
+                int(os.getenv(f"CLOUD_MAX_CONCURRENCY_{service.upper()}", default))
+            )
+            _semaphores[service] = semaphore
+
+    with semaphore:
+        yield
+
+
+def warm_up(
+    services: tuple[str, ...] = ("speech", "tts"),
+    credentials_file: str | None = None,
+    timeout: float = 10.0,
+) -> None:
+    """
+    Tạo client và chờ channel kết nối xong trước khi nhận request đầu tiên.
+    """
+    if traffic.replaying():
+        return
+    for service in services:
+        try:
+            _get_client(service, credentials_file)
+            grpc.channel_ready_future(_channels[(service, credentials_file)]).result(
+                timeout=timeout
+            )
+        except Exception as e:
+            print(f"Lỗi warm-up {service}: {e}")
@@ -0,0 +1,83 @@
+import asyncio
+import concurrent.futures
+import functools
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+DEFAULT_MAX_CONCURRENCY = 200
+DEFAULT_THREAD_POOL_SIZE = 64
+
+_lock = threading.Lock()
+_semaphores: (
+    "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]"
+) = weakref.WeakKeyDictionary()
+_executor: ThreadPoolExecutor | None = None
+_background_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    # asyncio.Semaphore gắn với event loop đang chạy nên mỗi loop có một semaphore riêng.
+    loop = asyncio.get_running_loop()
+    with _lock:
+        semaphore = _semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(
+                int(os.getenv("AI_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+            )
+            _semaphores[loop] = semaphore
+        return semaphore
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(
+                    os.getenv("AI_THREAD_POOL_SIZE", DEFAULT_THREAD_POOL_SIZE)
+                ),
+                thread_name_prefix="ai-features",
+            )
+        return _executor
+
+
+@asynccontextmanager
+async def slot():
+    """
+    Chiếm một chỗ trong giới hạn request đồng thời chung (AI_MAX_CONCURRENCY).
+    """
+    async with _get_semaphore():
+        yield
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """
+    Chạy hàm đồng bộ (Google Cloud STT/TTS, đọc file...) trong thread pool,
+    vẫn tính vào giới hạn đồng thời chung.
+    """
+    async with slot():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _get_executor(), functools.partial(func, *args, **kwargs)
+        )
+
+
+def submit_coroutine(coro) -> concurrent.futures.Future:
+    """
+    Chạy coroutine trên event loop nền dùng chung từ code đồng bộ. Khác với
+    thread pool, future.cancel() huỷ được task (kể cả request HTTP đang chờ).
+    """
+    global _background_loop
+    with _lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_background_loop.run_forever,
+                name="ai-features-loop",
+                daemon=True,
+            ).start()
+        loop = _background_loop
+    return asyncio.run_coroutine_threadsafe(coro, loop)
@@ -0,0 +1,250 @@
+"""
+Cache phần rubric tĩnh của prompt bằng Gemini cached content.
+
+Feature đặt rubric vào system_instruction qua system_config(); khi gọi Gemini,
+resolve() thay system_instruction bằng cached_content (tạo một lần, gia hạn
+trước khi hết hạn, dùng lại giữa các lời gọi). Nếu không tạo được cache (ví dụ
+prompt ngắn hơn số token tối thiểu), request vẫn gửi system_instruction như
+thường. get_stats() cho biết số token input đã được tính theo giá cache.
+
+Cache được tạo bằng client mặc định (get_client()), nên chỉ áp dụng cho model
+gọi qua client đó; model dự phòng "local/..." (server khác, xem
+common.circuit_breaker) luôn gửi system_instruction.
+"""
+
+import asyncio
+import datetime
+import hashlib
+import os
+import threading
+
+from google.genai import errors, types
+
+from common.circuit_breaker import LOCAL_PREFIX
+from common.gemini_client import get_client
+
+DEFAULT_TTL_SECONDS = 3600
+# Gia hạn khi cache còn ít hơn khoảng thời gian này.
+REFRESH_MARGIN_SECONDS = 300
+# Không thử tạo lại cache bị từ chối trong khoảng thời gian này.
+FAILURE_BACKOFF_SECONDS = 600
+
+_labels: dict[str, str] = {}
+
+
+def _digest(model: str, instruction: str) -> str:
+    return hashlib.sha256(f"{model}\n{instruction}".encode("utf-8")).hexdigest()
+
+
+def system_config(label: str, instruction: str, config=None):
+    """
+    Thêm rubric tĩnh vào system_instruction; label dùng để thống kê theo feature.
+    """
+    _labels[hashlib.sha256(instruction.encode("utf-8")).hexdigest()] = label
+    if config is None:
+        return types.GenerateContentConfig(system_instruction=instruction)
+    return config.model_copy(update={"system_instruction": instruction})
+
+
+def _label(instruction: str) -> str:
+    return _labels.get(hashlib.sha256(instruction.encode("utf-8")).hexdigest(), "")
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class ContextCache:
+    def __init__(
+        self,
+        ttl_seconds: int = DEFAULT_TTL_SECONDS,
+        refresh_margin: int = REFRESH_MARGIN_SECONDS,
+        enabled: bool = True,
+        client=None,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = refresh_margin
+        self.enabled = enabled
+        self._client = client
+        # digest -> (cache name, expire_time) hoặc (None, thời điểm được thử lại)
+        self._entries: dict[str, tuple[str | None, datetime.datetime]] = {}
+        self._lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}
+        self._stats: dict[str, dict] = {}
+
+    @property
+    def client(self):
+        return self._client or get_client()
+
+    def _count(self, label: str, name: str, amount: int = 1) -> None:
+        stats = self._stats.setdefault(
+            label,
+            {
+                "calls": 0,
+                "prompt_tokens": 0,
+                "cached_tokens": 0,
+                "creates": 0,
+                "refreshes": 0,
+                "fallbacks": 0,
+            },
+        )
+        stats[name] += amount
+
+    def _incr(self, label: str, name: str) -> None:
+        with self._lock:
+            self._count(label, name)
+
+    def _instruction(self, model: str, config) -> str | None:
+        if not self.enabled or model.startswith(LOCAL_PREFIX):
+            return None
+        instruction = getattr(config, "system_instruction", None)
+        return instruction if isinstance(instruction, str) else None
+
+    def _lookup(self, digest: str) -> tuple[bool, str | None]:
+        # (True, name) nếu không cần gọi API: cache còn hạn hoặc đang bị từ chối.
+        entry = self._entries.get(digest)
+        if entry is None:
+            return False, None
+        name, until = entry
+        margin = datetime.timedelta(seconds=self.refresh_margin if name else 0)
+        return until - _now() > margin, name
+
+    def _key_lock(self, digest: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(digest, threading.Lock())
+
+    def _ensure(self, model: str, instruction: str, digest: str) -> str | None:
+        # Lock theo digest: các rubric khác nhau tạo/gia hạn song song, còn các
+        # lời gọi cùng rubric chỉ gọi API một lần. self._lock chỉ giữ khi đọc/ghi
+        # _entries, không giữ trong lúc gọi mạng.
+        with self._key_lock(digest):
+            with self._lock:
+                fresh, name = self._lookup(digest)
+            if fresh:
+                return name
+            label = _label(instruction)
+            ttl = f"{self.ttl_seconds}s"
+            try:
+                if name:
+                    try:
+                        cached = self.client.caches.update(
+                            name=name, config=types.UpdateCachedContentConfig(ttl=ttl)
+                        )
+                        self._incr(label, "refreshes")
+                    except errors.APIError:
+                        # Cache đã bị xoá hoặc hết hạn phía server: tạo mới.
+                        name = None
+                if not name:
+                    cached = self.client.caches.create(
+                        model=model,
+                        config=types.CreateCachedContentConfig(
+                            system_instruction=instruction,
+                            display_name=f"{label or 'context'}-{digest[:12]}",
+                            ttl=ttl,
+                        ),
+                    )
+                    self._incr(label, "creates")
+            except errors.APIError as e:
+                print(f"Lỗi tạo Gemini context cache ({label or model}): {e}")
+                retry_at = _now() + datetime.timedelta(seconds=FAILURE_BACKOFF_SECONDS)
+                with self._lock:
+                    self._entries[digest] = (None, retry_at)
+                return None
+            expire_time = cached.expire_time or _now() + datetime.timedelta(
+                seconds=self.ttl_seconds
+            )
+            with self._lock:
+                self._entries[digest] = (cached.name, expire_time)
+            return cached.name
+
+    def _apply(self, config, instruction: str, name: str | None):
+        if name is None:
+            self._incr(_label(instruction), "fallbacks")
+            return config
+        return config.model_copy(
+            update={"system_instruction": None, "cached_content": name}
+        )
+
+    def resolve(self, model: str, config):
+        """
+        Thay system_instruction bằng cached_content nếu có thể.
+        """
+        instruction = self._instruction(model, config)
+        if instruction is None:
+            return config
+        digest = _digest(model, instruction)
+        fresh, name = self._lookup(digest)
+        if not fresh:
+            name = self._ensure(model, instruction, digest)
+        return self._apply(config, instruction, name)
+
+    async def aresolve(self, model: str, config):
+        """
+        Phiên bản async của resolve(); chỉ tạo/gia hạn cache trong thread riêng.
+        """
+        instruction = self._instruction(model, config)
+        if instruction is None:
+            return config
+        digest = _digest(model, instruction)
+        fresh, name = self._lookup(digest)
+        if not fresh:
+            name = await asyncio.to_thread(self._ensure, model, instruction, digest)
+        return self._apply(config, instruction, name)
+
+    def invalidate(self, model: str, config) -> None:
+        """
+        Bỏ cache đã lưu khi Gemini báo cached_content không còn dùng được.
+        """
+        instruction = getattr(config, "system_instruction", None)
+        if isinstance(instruction, str):
+            with self._lock:
+                self._entries.pop(_digest(model, instruction), None)
+
+    def record(self, config, response) -> None:
+        """
+        Ghi nhận usage_metadata để đo số token input được tính theo giá cache.
+        """
+        instruction = getattr(config, "system_instruction", None)
+        usage = getattr(response, "usage_metadata", None)
+        if not isinstance(instruction, str) or usage is None:
+            return
+        label = _label(instruction)
+        with self._lock:
+            self._count(label, "calls")
+            self._count(label, "prompt_tokens", usage.prompt_token_count or 0)
+            self._count(label, "cached_tokens", usage.cached_content_token_count or 0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {}
+            for label, stats in self._stats.items():
+                stats = dict(stats)
+                prompt_tokens = stats["prompt_tokens"]
+                stats["cached_ratio"] = (
+                    stats["cached_tokens"] / prompt_tokens if prompt_tokens else 0.0
+                )
+                result[label] = stats
+            return result
+
+
+_default: ContextCache | None = None
+
+
+def default_context_cache() -> ContextCache:
+    """
+    ContextCache dùng chung, cấu hình qua GEMINI_CONTEXT_CACHE(_TTL).
+    """
+    global _default
+    if _default is None:
+        _default = ContextCache(
+            ttl_seconds=int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", DEFAULT_TTL_SECONDS)),
+            enabled=os.getenv("GEMINI_CONTEXT_CACHE", "1") != "0",
+        )
+    return _default
+
+
+def get_stats() -> dict:
+    """
+    Thống kê theo feature: calls, prompt_tokens, cached_tokens, cached_ratio...
+    """
+    return default_context_cache().stats()
@@ -0,0 +1,246 @@
+"""
+Gửi audio lớn qua Gemini Files API thay vì nhúng bytes vào từng request.
+
+File nhỏ hơn AI_FILES_THRESHOLD_BYTES vẫn gửi inline. File lớn hơn được upload
+một lần theo hash nội dung; các request sau (retry, cascade chấm lại, câu hỏi
+tiếp theo, người khác gửi cùng file) chỉ gửi file_uri. Handle được dùng lại tới
+gần thời điểm hết hạn (Files API giữ file 48 giờ). Khi tiến trình kết thúc chỉ
+những file do chính tiến trình đó upload mới bị xoá, trừ file đang được batch
+job tham chiếu (retain()), các file đó tự hết hạn. AI_FILES_API=0 luôn gửi
+inline.
+"""
+
+import atexit
+import hashlib
+import io
+import os
+import threading
+import time
+from datetime import timezone
+
+from google.genai import types
+from google.genai.errors import APIError
+
+from common import telemetry
+from common.audio import pause_note, prepare_file
+from common.gemini_client import get_client
+from common.singleflight import get_flight
+
+DEFAULT_THRESHOLD_BYTES = 1024 * 1024
+# Upload lại khi handle còn ít hơn khoảng này trước khi hết hạn.
+REFRESH_MARGIN_SECONDS = 3600
+# Sau khi upload lỗi, tạm gửi inline trong khoảng này thay vì thử lại mỗi request.
+FAILURE_BACKOFF_SECONDS = 600
+PROCESSING_TIMEOUT_SECONDS = 60
+
+
+def _expires_at(file) -> float:
+    expiration = getattr(file, "expiration_time", None)
+    if expiration is None:
+        return time.time() + 47 * 3600
+    if expiration.tzinfo is None:
+        expiration = expiration.replace(tzinfo=timezone.utc)
+    return expiration.timestamp()
+
+
+class UploadManager:
+    def __init__(
+        self,
+        threshold_bytes: int = DEFAULT_THRESHOLD_BYTES,
+        enabled: bool = True,
+        client=None,
+    ):
+        self.threshold_bytes = threshold_bytes
+        self.enabled = enabled
+        self._client = client
+        self._lock = threading.Lock()
+        # sha256 -> {"name", "uri", "mime_type", "expires_at", "size", "uploaded_by"}
+        self._files: dict[str, dict] = {}
+        # uri của các file không được tự xoá (batch job còn dùng).
+        self._retained: set[str] = set()
+        self._failed_until = 0.0
+        self._cleanup_registered = False
+        self._stats = {
+            "inline_parts": 0,
+            "inline_bytes": 0,
+            "uploads": 0,
+            "upload_bytes": 0,
+            "file_parts": 0,
+            "file_part_bytes": 0,
+            "failures": 0,
+            "deleted": 0,
+        }
+
+    @property
+    def client(self):
+        return self._client or get_client()
+
+    def _incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += value
+
+    def _cached(self, digest: str) -> dict | None:
+        with self._lock:
+            handle = self._files.get(digest)
+            if handle is None:
+                return None
+            if handle["expires_at"] - time.time() < REFRESH_MARGIN_SECONDS:
+                del self._files[digest]
+                return None
+            return handle
+
+    def _wait_active(self, file):
+        deadline = time.monotonic() + PROCESSING_TIMEOUT_SECONDS
+        while getattr(file.state, "name", file.state) == "PROCESSING":
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"File {file.name} chưa xử lý xong.")
+            time.sleep(0.5)
+            file = self.client.files.get(name=file.name)
+        if getattr(file.state, "name", file.state) == "FAILED":
+            raise RuntimeError(f"Files API không xử lý được file {file.name}.")
+        return file
+
+    def _upload(self, data: bytes, mime_type: str, digest: str) -> dict:
+        handle = self._cached(digest)
+        if handle is not None:
+            return handle
+        config = types.UploadFileConfig(mime_type=mime_type, display_name=digest)
+        size = len(data)
+        with telemetry.span("gemini.files.upload", "gemini", request_bytes=size):
+            file = self.client.files.upload(file=io.BytesIO(data), config=config)
+            file = self._wait_active(file)
+        handle = {
+            "name": file.name,
+            "uri": file.uri,
+            "mime_type": file.mime_type or mime_type,
+            "expires_at": _expires_at(file),
+            "size": size,
+            "uploaded_by": os.getpid(),
+        }
+        with self._lock:
+            self._files[digest] = handle
+            self._stats["uploads"] += 1
+            self._stats["upload_bytes"] += size
+            if not self._cleanup_registered:
+                atexit.register(self.cleanup)
+                self._cleanup_registered = True
+        return handle
+
+    def _inline(self, data: bytes, mime_type: str) -> dict:
+        self._incr("inline_parts")
+        self._incr("inline_bytes", len(data))
+        return {"inline_data": {"mime_type": mime_type, "data": data}}
+
+    def part(self, data: bytes, mime_type: str) -> dict:
+        """
+        Part cho contents: inline_data với dữ liệu nhỏ, file_data (file_uri) với
+        dữ liệu lớn. Upload lỗi thì quay về inline.
+        """
+        if (
+            not self.enabled
+            or len(data) < self.threshold_bytes
+            or time.monotonic() < self._failed_until
+        ):
+            return self._inline(data, mime_type)
+
+        digest = hashlib.sha256(data).hexdigest()
+        handle = self._cached(digest)
+        if handle is None:
+            try:
+                # Nhiều request cùng file chỉ upload một lần.
+                handle = get_flight("files").do(
+                    digest, self._upload, data, mime_type, digest
+                )
+            except (APIError, OSError, RuntimeError, TimeoutError, KeyError) as e:
+                print(f"Lỗi upload file lên Gemini Files API: {e}")
+                self._incr("failures")
+                self._failed_until = time.monotonic() + FAILURE_BACKOFF_SECONDS
+                return self._inline(data, mime_type)
+            # Handle do tiến trình khác upload (AI_SINGLEFLIGHT_DIR) chỉ dùng
+            # cho request này, không giữ lại: tiến trình đó xoá file khi kết thúc.
+        self._incr("file_parts")
+        self._incr("file_part_bytes", handle["size"])
+        return {
+            "file_data": {"mime_type": handle["mime_type"], "file_uri": handle["uri"]}
+        }
+
+    def retain(self, uri: str) -> None:
+        """
+        Không tự xoá file có uri này khi tiến trình kết thúc (ví dụ file được
+        batch job đã gửi tham chiếu); file tự hết hạn sau 48 giờ.
+        """
+        with self._lock:
+            self._retained.add(uri)
+
+    def cleanup(self) -> None:
+        """
+        Xoá các file do tiến trình này upload, trừ file đã retain() (gọi tự
+        động khi tiến trình kết thúc).
+        """
+        with self._lock:
+            handles = [
+                handle
+                for handle in self._files.values()
+                if handle.get("uploaded_by") == os.getpid()
+                and handle["uri"] not in self._retained
+            ]
+            self._files.clear()
+        for handle in handles:
+            if handle["expires_at"] < time.time():
+                continue
+            try:
+                self.client.files.delete(name=handle["name"])
+                self._incr("deleted")
+            except Exception as e:
+                print(f"Lỗi xoá file {handle['name']}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["active_files"] = len(self._files)
+            stats["retained"] = len(self._retained)
+        # Mỗi part file_data không phải lần upload đầu là một lần dùng lại handle.
+        stats["reuses"] = stats["file_parts"] - stats["uploads"]
+        stats["reused_bytes"] = stats["file_part_bytes"] - stats["upload_bytes"]
+        parts = stats["inline_parts"] + stats["file_parts"]
+        sent = stats["inline_bytes"] + stats["upload_bytes"]
+        stats["upload_bytes_per_request"] = sent / parts if parts else 0.0
+        return stats
+
+
+_default_manager: UploadManager | None = None
+_default_lock = threading.Lock()
+
+
+def default_uploads() -> UploadManager:
+    """
+    UploadManager dùng chung, cấu hình qua AI_FILES_API và AI_FILES_THRESHOLD_BYTES.
+    """
+    global _default_manager
+    with _default_lock:
+        if _default_manager is None:
+            _default_manager = UploadManager(
+                threshold_bytes=int(
+                    os.getenv("AI_FILES_THRESHOLD_BYTES", DEFAULT_THRESHOLD_BYTES)
+                ),
+                enabled=os.getenv("AI_FILES_API", "1") != "0",
+            )
+        return _default_manager
+
+
+def audio_parts(path: str) -> list[dict]:
+    """
+    Các part audio cho contents của Gemini: audio đã tiền xử lý (common.audio),
+    inline hoặc qua Files API tuỳ kích thước, kèm ghi chú ngắt nghỉ của bản
+    gốc khi audio đã bị cắt lặng.
+    """
+    prepared = prepare_file(path)
+    parts = [default_uploads().part(prepared.data, prepared.mime_type)]
+    note = pause_note(prepared)
+    if note:
+        parts.append({"text": note})
+    return parts
+
+
+def get_stats() -> dict:
+    return default_uploads().stats()
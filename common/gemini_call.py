@@ -0,0 +1,458 @@
+import json
+import os
+
+from google.genai import types
+from google.genai.errors import APIError
+
+from common import telemetry
+from common.circuit_breaker import (
+    LOCAL_PREFIX,
+    acall_with_fallback,
+    call_with_fallback,
+    round_trip,
+    select_model,
+    track,
+)
+from common.concurrency import slot
+from common.context_cache import default_context_cache
+from common.gemini_client import get_client
+from common.hedging import get_policy
+from common.json_stream import IncrementalJSONParser
+from common.rate_limiter import (
+    acall_with_limits,
+    astream_with_limits,
+    call_with_limits,
+    stream_with_limits,
+    try_reserve,
+)
+from common.response_cache import CachedResponse, ResponseCache, make_key
+from common.schemas import sub_schema, validate
+from common.singleflight import get_flight
+
+
+def _cache_lookup(cache: ResponseCache | None, model: str, contents, config):
+    if cache is None:
+        return None, None
+    key = make_key(model, contents, config)
+    text = cache.get(key)
+    return key, CachedResponse(text) if text is not None else None
+
+
+def _cache_store(cache: ResponseCache | None, key: str | None, response) -> None:
+    # Chỉ lưu response parse được để lỗi định dạng không bị "dính" trong cache.
+    if cache is None or not response.text:
+        return
+    try:
+        parse_json_response(response)
+    except ValueError:
+        return
+    cache.set(key, response.text)
+
+
+def json_config(schema: dict | None, config=None):
+    """
+    Thêm response_mime_type/response_schema vào generation config.
+    """
+    if schema is None:
+        return config
+    update = {"response_mime_type": "application/json", "response_schema": schema}
+    if config is None:
+        return types.GenerateContentConfig(**update)
+    return config.model_copy(update=update)
+
+
+def _annotate(span, contents, response) -> None:
+    if not telemetry.enabled():
+        return
+    span.set(
+        request_bytes=telemetry.payload_bytes(contents),
+        response_bytes=len((response.text or "").encode("utf-8")),
+        cache_hit=isinstance(response, CachedResponse),
+    )
+    span.record_usage(response.usage_metadata)
+
+
+def generate_content(
+    model: str, contents, config=None, cache: ResponseCache | None = None
+):
+    """
+    Gọi Gemini (đồng bộ) qua client dùng chung.
+    Truyền cache để dùng lại kết quả của các lần gọi có cùng input.
+    """
+    with telemetry.span("gemini.generate_content", "gemini", model) as span:
+        with span.stage("cache_lookup"):
+            key, cached = _cache_lookup(cache, model, contents, config)
+        if cached is not None:
+            _annotate(span, contents, cached)
+            return cached
+
+        served = []
+
+        def attempt(target):
+            served.append(target)
+            return _generate(target, contents, config)
+
+        with span.stage("network"):
+            response = call_with_fallback(model, attempt)
+        if _mark_served(span, response, model, served[-1]):
+            _cache_store(cache, key, response)
+        _annotate(span, contents, response)
+        return response
+
+
+def _mark_served(span, response, model: str, served: str) -> bool:
+    """
+    Ghi model thực sự trả lời; False nếu đó là model dự phòng (khi đó không lưu
+    cache dưới key của model yêu cầu).
+    """
+    span.set_model(served)
+    if served == model:
+        return True
+    response.model_version = served
+    return False
+
+
+def _target(model: str):
+    # "local/<model>" là server giả lập dùng làm dự phòng khi model thật bị ngắt.
+    if model.startswith(LOCAL_PREFIX):
+        base_url = os.getenv("GEMINI_LOCAL_BASE_URL")
+        return get_client(base_url=base_url), model[len(LOCAL_PREFIX) :]
+    return get_client(), model
+
+
+def _generate(model: str, contents, config):
+    context = default_context_cache()
+    request_config = context.resolve(model, config)
+    try:
+        response = _call(model, contents, request_config)
+    except APIError as e:
+        if request_config is config or e.code not in (400, 403, 404):
+            raise
+        # cached_content bị xoá phía server: gửi lại kèm system_instruction.
+        context.invalidate(model, config)
+        response = _call(model, contents, config)
+    context.record(config, response)
+    return response
+
+
+def _call(model: str, contents, config):
+    client, model_name = _target(model)
+
+    def send():
+        return client.models.generate_content(
+            model=model_name, contents=contents, config=config
+        )
+
+    def network():
+        # Hedge và breaker chỉ tính lời gọi mạng; chờ quota, backoff 429 nằm ngoài.
+        with round_trip():
+            if policy is None:
+                return send()
+            return policy.call(model, send, lambda: try_reserve(model, contents))
+
+    policy = get_policy()
+    return call_with_limits(model, contents, network)
+
+
+async def agenerate_content(
+    model: str, contents, config=None, cache: ResponseCache | None = None
+):
+    """
+    Gọi Gemini qua client.aio, giới hạn bởi semaphore đồng thời chung.
+    """
+    with telemetry.span("gemini.generate_content", "gemini", model) as span:
+        with span.stage("cache_lookup"):
+            key, cached = _cache_lookup(cache, model, contents, config)
+        if cached is not None:
+            _annotate(span, contents, cached)
+            return cached
+
+        served = []
+
+        def attempt(target):
+            served.append(target)
+            return _agenerate(target, contents, config)
+
+        with span.stage("network"):
+            response = await acall_with_fallback(model, attempt)
+        if _mark_served(span, response, model, served[-1]):
+            _cache_store(cache, key, response)
+        _annotate(span, contents, response)
+        return response
+
+
+async def _agenerate(model: str, contents, config):
+    context = default_context_cache()
+    request_config = await context.aresolve(model, config)
+    async with slot():
+        try:
+            response = await _acall(model, contents, request_config)
+        except APIError as e:
+            if request_config is config or e.code not in (400, 403, 404):
+                raise
+            context.invalidate(model, config)
+            response = await _acall(model, contents, config)
+    context.record(config, response)
+    return response
+
+
+async def _acall(model: str, contents, config):
+    client, model_name = _target(model)
+
+    def send():
+        return client.aio.models.generate_content(
+            model=model_name, contents=contents, config=config
+        )
+
+    async def network():
+        with round_trip():
+            if policy is None:
+                return await send()
+            return await policy.acall(model, send, lambda: try_reserve(model, contents))
+
+    policy = get_policy()
+    return await acall_with_limits(model, contents, network)
+
+
+def _salvage(text: str) -> dict:
+    # JSON hỏng (thường do bị cắt giữa chừng): giữ lại các trường đã hoàn chỉnh.
+    parser = IncrementalJSONParser()
+    data = {}
+    for start in range(0, len(text), 256):
+        try:
+            data.update(parser.feed(text[start : start + 256]))
+        except ValueError:
+            break
+    return data
+
+
+def _check(response, schema: dict) -> tuple[dict, list[str]]:
+    with telemetry.stage("parse"):
+        try:
+            data = parse_json_response(response)
+        except ValueError:
+            data = _salvage(response.text)
+    if "error" in data and len(data) == 1:
+        return data, []
+    with telemetry.stage("validate"):
+        return data, validate(schema, data)
+
+
+def _repair_request(
+    contents, previous_text: str, schema: dict, errors: list[str], config=None
+):
+    """
+    Chỉ yêu cầu lại các trường bị thiếu/sai. Bỏ phần inline_data (audio) khỏi
+    request vì model đã có kết quả lần trước làm ngữ cảnh.
+    """
+    fields = sorted({error.split(".")[0].split("[")[0] for error in errors})
+    fields = [name for name in fields if name in schema["properties"]]
+    request_schema = sub_schema(schema, fields)
+    if not fields:
+        # Lỗi ở gốc ("$", ví dụ trả về mảng thay vì object): yêu cầu lại cả đối tượng.
+        fields = list(schema["properties"])
+        request_schema = schema
+    history = [
+        {
+            "role": content.get("role", "user"),
+            "parts": [part for part in content["parts"] if "inline_data" not in part],
+        }
+        for content in contents
+    ]
+    history += [
+        {"role": "model", "parts": [{"text": previous_text}]},
+        {
+            "role": "user",
+            "parts": [
+                {
+                    "text": "Phản hồi JSON ở trên bị thiếu hoặc sai các trường: "
+                    f"{', '.join(errors)}. Chỉ trả về một đối tượng JSON gồm "
+                    f"đúng các trường cấp cao nhất sau: {', '.join(fields)}."
+                }
+            ],
+        },
+    ]
+    return fields, history, json_config(request_schema, config)
+
+
+def _merge(data: dict, repair_response, fields: list[str]) -> dict:
+    try:
+        repaired = parse_json_response(repair_response)
+    except ValueError:
+        return data
+    if not isinstance(repaired, dict):
+        return data
+    if not isinstance(data, dict):
+        data = {}
+    for name in fields:
+        if name in repaired:
+            data[name] = repaired[name]
+    return data
+
+
+def generate_json(
+    model: str,
+    contents,
+    schema: dict,
+    config=None,
+    cache: ResponseCache | None = None,
+    coalesce: bool = False,
+) -> dict:
+    """
+    Gọi Gemini với response_schema, kiểm tra kết quả và chỉ yêu cầu lại
+    những trường bị thiếu/sai thay vì gọi lại toàn bộ.
+    coalesce=True gộp các lời gọi giống hệt nhau đang chạy đồng thời thành một.
+    """
+    if coalesce:
+        key = make_key(model, contents, json_config(schema, config))
+        return get_flight("gemini").do(
+            key, _generate_json, model, contents, schema, config, cache
+        )
+    return _generate_json(model, contents, schema, config, cache)
+
+
+def _generate_json(
+    model: str, contents, schema: dict, config, cache: ResponseCache | None
+) -> dict:
+    with telemetry.span("gemini.generate_json", "gemini", model):
+        response = generate_content(model, contents, json_config(schema, config), cache)
+        data, errors = _check(response, schema)
+        if not errors:
+            return data
+
+        print(f"Phản hồi Gemini chưa hợp lệ ({', '.join(errors)}), yêu cầu bổ sung...")
+        fields, repair_contents, repair_config = _repair_request(
+            contents, response.text, schema, errors, config
+        )
+        with telemetry.stage("repair"):
+            repaired = generate_content(model, repair_contents, repair_config)
+        data = _merge(data, repaired, fields)
+    remaining = validate(schema, data)
+    if remaining:
+        raise ValueError(f"Phản hồi Gemini vẫn thiếu trường: {', '.join(remaining)}")
+    return data
+
+
+async def agenerate_json(
+    model: str,
+    contents,
+    schema: dict,
+    config=None,
+    cache: ResponseCache | None = None,
+    coalesce: bool = False,
+) -> dict:
+    """
+    Phiên bản async của generate_json().
+    """
+    if coalesce:
+        key = make_key(model, contents, json_config(schema, config))
+        return await get_flight("gemini").ado(
+            key, _agenerate_json, model, contents, schema, config, cache
+        )
+    return await _agenerate_json(model, contents, schema, config, cache)
+
+
+async def _agenerate_json(
+    model: str, contents, schema: dict, config, cache: ResponseCache | None
+) -> dict:
+    with telemetry.span("gemini.generate_json", "gemini", model):
+        response = await agenerate_content(
+            model, contents, json_config(schema, config), cache
+        )
+        data, errors = _check(response, schema)
+        if not errors:
+            return data
+
+        print(f"Phản hồi Gemini chưa hợp lệ ({', '.join(errors)}), yêu cầu bổ sung...")
+        fields, repair_contents, repair_config = _repair_request(
+            contents, response.text, schema, errors, config
+        )
+        with telemetry.stage("repair"):
+            repaired = await agenerate_content(model, repair_contents, repair_config)
+        data = _merge(data, repaired, fields)
+    remaining = validate(schema, data)
+    if remaining:
+        raise ValueError(f"Phản hồi Gemini vẫn thiếu trường: {', '.join(remaining)}")
+    return data
+
+
+def generate_json_stream(
+    model: str, contents, config=None, schema: dict | None = None, max_depth: int = 2
+):
+    """
+    Gọi generate_content_stream và trả về từng trường JSON (path, value)
+    ngay khi trường đó hoàn chỉnh, không chờ hết response. Stream được tính
+    vào quota như lời gọi thường (common.rate_limiter.stream_with_limits).
+    """
+    parser = IncrementalJSONParser(max_depth=max_depth)
+    config = json_config(schema, config)
+    context = default_context_cache()
+    requested, model = model, select_model(model)
+    client, model_name = _target(model)
+    chunk = None
+    with telemetry.span(
+        "gemini.generate_json_stream", "gemini", requested, current=False
+    ) as span:
+        span.set_model(model)
+        request_config = context.resolve(model, config)
+        with track(model):
+            for chunk in stream_with_limits(
+                model,
+                contents,
+                lambda: client.models.generate_content_stream(
+                    model=model_name, contents=contents, config=request_config
+                ),
+            ):
+                if chunk.text:
+                    yield from parser.feed(chunk.text)
+        if chunk is not None:
+            span.record_usage(chunk.usage_metadata)
+    context.record(config, chunk)
+
+
+async def agenerate_json_stream(
+    model: str, contents, config=None, schema: dict | None = None, max_depth: int = 2
+):
+    """
+    Phiên bản async của generate_json_stream().
+    """
+    parser = IncrementalJSONParser(max_depth=max_depth)
+    config = json_config(schema, config)
+    context = default_context_cache()
+    requested, model = model, select_model(model)
+    client, model_name = _target(model)
+    chunk = None
+    async with slot():
+        with telemetry.span(
+            "gemini.generate_json_stream", "gemini", requested, current=False
+        ) as span:
+            span.set_model(model)
+            request_config = await context.aresolve(model, config)
+            with track(model):
+                stream = astream_with_limits(
+                    model,
+                    contents,
+                    lambda: client.aio.models.generate_content_stream(
+                        model=model_name, contents=contents, config=request_config
+                    ),
+                )
+                async for chunk in stream:
+                    if chunk.text:
+                        for field in parser.feed(chunk.text):
+                            yield field
+            if chunk is not None:
+                span.record_usage(chunk.usage_metadata)
+    context.record(config, chunk)
+
+
+def parse_json_response(response) -> dict:
+    """
+    Bỏ code fence (```json ... ```) và parse text của response thành dict.
+    """
+    if not response.text:
+        return {"error": "Gemini không trả về kết quả."}
+
+    cleaned_response = (
+        response.text.strip().replace("```json", "").replace("```", "").strip()
+    )
+    return json.loads(cleaned_response)
@@ -0,0 +1,131 @@
+import os
+import threading
+
+import httpx
+from google import genai
+from google.genai import types
+
+from common import traffic
+
+DEFAULT_POOL_SIZE = 20
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+WARM_UP_MODELS = ("gemini-2.5-flash",)
+
+_lock = threading.Lock()
+_clients: dict[tuple, genai.Client] = {}
+_stats = {
+    "registry_hits": 0,
+    "registry_misses": 0,
+    "requests": 0,
+    "pool_misses": 0,
+}
+
+
+def _incr(name: str, value: int = 1) -> None:
+    with _lock:
+        _stats[name] += value
+
+
+def _on_trace(event_name: str, info: dict) -> None:
+    # httpcore chỉ phát sự kiện connect_tcp khi phải mở kết nối mới (TCP + TLS).
+    if event_name == "connection.connect_tcp.started":
+        _incr("pool_misses")
+
+
+async def _on_trace_async(event_name: str, info: dict) -> None:
+    _on_trace(event_name, info)
+
+
+def _attach_trace(request: httpx.Request) -> None:
+    _incr("requests")
+    request.extensions["trace"] = _on_trace
+
+
+async def _attach_trace_async(request: httpx.Request) -> None:
+    _incr("requests")
+    request.extensions["trace"] = _on_trace_async
+
+
+def _pool_size() -> int:
+    return int(os.getenv("GEMINI_POOL_SIZE", DEFAULT_POOL_SIZE))
+
+
+def _make_client(
+    api_key: str | None, pool_size: int, base_url: str | None = None
+) -> genai.Client:
+    limits = httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=float(
+            os.getenv("GEMINI_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY)
+        ),
+    )
+    client_args = {"limits": limits, "event_hooks": {"request": [_attach_trace]}}
+    async_client_args = {
+        "limits": limits,
+        "event_hooks": {"request": [_attach_trace_async]},
+    }
+    if traffic.mode():
+        # Ghi/phát lại traffic (AI_TRAFFIC_MODE); pool kết nối nằm trong transport gốc.
+        client_args["transport"] = traffic.HttpxTransport(
+            httpx.HTTPTransport(limits=limits)
+        )
+        async_client_args["transport"] = traffic.AsyncHttpxTransport(
+            httpx.AsyncHTTPTransport(limits=limits)
+        )
+        if traffic.replaying() and not api_key:
+            api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
+            api_key = api_key or "replay"
+    http_options = types.HttpOptions(
+        # GEMINI_BASE_URL cho phép trỏ sang server giả lập chạy local khi test/benchmark.
+        base_url=base_url or os.getenv("GEMINI_BASE_URL") or None,
+        client_args=client_args,
+        async_client_args=async_client_args,
+    )
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+
+def get_client(
+    api_key: str | None = None,
+    pool_size: int | None = None,
+    base_url: str | None = None,
+) -> genai.Client:
+    """
+    Trả về Gemini client dùng chung cho cả tiến trình (giữ kết nối keep-alive).
+    Mỗi bộ (api_key, pool_size, base_url) chỉ tạo client một lần.
+    """
+    key = (api_key, pool_size or _pool_size(), base_url)
+    with _lock:
+        client = _clients.get(key)
+        if client is not None:
+            _stats["registry_hits"] += 1
+            return client
+
+        _stats["registry_misses"] += 1
+        client = _make_client(api_key, key[1], base_url)
+        _clients[key] = client
+        return client
+
+
+def warm_up(models: tuple[str, ...] = WARM_UP_MODELS, api_key: str | None = None):
+    """
+    Mở sẵn kết nối tới Gemini khi khởi động để request đầu tiên không phải chờ TLS.
+    """
+    client = get_client(api_key)
+    for model in models:
+        try:
+            client.models.get(model=model)
+        except Exception as e:
+            print(f"Lỗi warm-up Gemini ({model}): {e}")
+
+
+def get_pool_stats() -> dict:
+    """
+    Số liệu tái sử dụng client và kết nối:
+      - registry_hits/registry_misses: lấy lại client có sẵn / phải tạo client mới
+      - pool_hits/pool_misses: request dùng lại kết nối keep-alive / phải mở kết nối mới
+    """
+    with _lock:
+        stats = dict(_stats)
+    stats["pool_hits"] = max(stats["requests"] - stats["pool_misses"], 0)
+    return stats
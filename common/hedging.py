@@ -0,0 +1,259 @@
+"""
+Hedged requests cho Gemini: nếu request chưa trả lời sau một percentile độ trễ
+gần đây, gửi thêm một bản sao; kết quả về trước được dùng, bản còn lại bị huỷ.
+
+Bật bằng GEMINI_HEDGE=1. GEMINI_HEDGE_PERCENTILE chọn percentile làm ngưỡng chờ,
+GEMINI_HEDGE_BUDGET giới hạn tỉ lệ request được gửi thêm (chi phí phát sinh).
+Một phần nhỏ request (GEMINI_HEDGE_CONTROL) chạy không hedge làm nhóm đối chứng
+để đo p99 khi không hedge.
+
+Chỉ bọc lời gọi mạng: thời gian chờ quota và backoff 429 (common.rate_limiter)
+nằm ngoài, không làm lệch percentile. Bản hedge cần còn quota ngay lúc gửi
+(admit), nếu không thì không gửi.
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import random
+import threading
+import time
+from collections import deque
+
+DEFAULT_PERCENTILE = 95.0
+DEFAULT_BUDGET = 0.05
+DEFAULT_CONTROL_RATE = 0.05
+# Chưa đủ mẫu thì chưa hedge để tránh ngưỡng chờ sai lệch.
+MIN_SAMPLES = 20
+WINDOW_SIZE = 500
+
+
+def _percentile(samples, percentile: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _start_thread(func) -> concurrent.futures.Future:
+    # Thread riêng cho mỗi lời gọi: số request đồng thời không bị giới hạn bởi
+    # pool dành cho bản hedge.
+    future = concurrent.futures.Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="gemini-hedge-primary", daemon=True).start()
+    return future
+
+
+class HedgePolicy:
+    def __init__(
+        self,
+        percentile: float = DEFAULT_PERCENTILE,
+        budget: float = DEFAULT_BUDGET,
+        control_rate: float = DEFAULT_CONTROL_RATE,
+        min_samples: int = MIN_SAMPLES,
+        max_workers: int = 32,
+    ):
+        self.percentile = percentile
+        self.budget = budget
+        self.control_rate = control_rate
+        self.min_samples = min_samples
+        # Độ trễ người gọi nhận được, dùng để tính ngưỡng chờ.
+        self._latencies: dict[str, deque] = {}
+        self._control: dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="gemini-hedge"
+        )
+        self._stats = {
+            "requests": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "over_budget": 0,
+            "no_quota": 0,
+        }
+
+    def _window(self, table: dict, model: str) -> deque:
+        return table.setdefault(model, deque(maxlen=WINDOW_SIZE))
+
+    def delay(self, model: str) -> float | None:
+        """
+        Thời gian chờ trước khi hedge; None nếu chưa đủ mẫu.
+        """
+        with self._lock:
+            samples = self._window(self._latencies, model)
+            if len(samples) < self.min_samples:
+                return None
+            return _percentile(samples, self.percentile)
+
+    def _allow_hedge(self, admit=None) -> bool:
+        with self._lock:
+            if self._stats["hedged"] + 1 > self.budget * self._stats["requests"]:
+                self._stats["over_budget"] += 1
+                return False
+        if admit is not None and not admit():
+            with self._lock:
+                self._stats["no_quota"] += 1
+            return False
+        with self._lock:
+            self._stats["hedged"] += 1
+        return True
+
+    def _record(
+        self, model: str, latency: float, hedge_won: bool = False, control=False
+    ) -> None:
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["hedge_wins"] += int(hedge_won)
+            self._window(self._latencies, model).append(latency)
+            if control:
+                self._window(self._control, model).append(latency)
+
+    def _delay(self, model: str) -> tuple[float | None, bool]:
+        # (ngưỡng chờ, có thuộc nhóm đối chứng không)
+        if random.random() < self.control_rate:
+            return None, True
+        return self.delay(model), False
+
+    def call(self, model: str, func, admit=None):
+        """
+        Gọi func() (đồng bộ) với hedging; admit() (nếu có) được gọi trước khi
+        gửi bản hedge và trả về False khi không nên gửi. Client đồng bộ không
+        huỷ được request đang chạy, nên bản thua chỉ bị bỏ qua kết quả.
+
+        Bản chính chạy trong thread riêng của lời gọi (không giới hạn như pool);
+        pool max_workers chỉ dùng cho bản hedge.
+        """
+        start = time.perf_counter()
+        delay, control = self._delay(model)
+        if delay is None:
+            result = func()
+            self._record(model, time.perf_counter() - start, control=control)
+            return result
+
+        primary = _start_thread(func)
+        try:
+            result = primary.result(timeout=delay)
+            self._record(model, time.perf_counter() - start)
+            return result
+        except concurrent.futures.TimeoutError:
+            pass
+
+        if not self._allow_hedge(admit):
+            result = primary.result()
+            self._record(model, time.perf_counter() - start)
+            return result
+
+        hedge = self._executor.submit(func)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                for loser in pending:
+                    loser.cancel()
+                self._record(model, time.perf_counter() - start, future is hedge)
+                return future.result()
+        raise error
+
+    async def acall(self, model: str, coro_func, admit=None):
+        """
+        Phiên bản async của call(); bản thua (và mọi bản đang chạy khi người
+        gọi bị huỷ) bị cancel thật sự.
+        """
+        start = time.perf_counter()
+        delay, control = self._delay(model)
+        if delay is None:
+            result = await coro_func()
+            self._record(model, time.perf_counter() - start, control=control)
+            return result
+
+        primary = asyncio.ensure_future(coro_func())
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self._allow_hedge(admit):
+                result = await primary
+                self._record(model, time.perf_counter() - start)
+                return result
+
+            hedge = asyncio.ensure_future(coro_func())
+            tasks.append(hedge)
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    self._record(model, time.perf_counter() - start, task is hedge)
+                    return task.result()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            latencies = [
+                value for window in self._latencies.values() for value in window
+            ]
+            control = [value for window in self._control.values() for value in window]
+        requests = stats["requests"]
+        stats["hedge_rate"] = stats["hedged"] / requests if requests else 0.0
+        stats["p50"] = _percentile(latencies, 50)
+        stats["p99"] = _percentile(latencies, 99)
+        stats["p99_unhedged"] = _percentile(control, 99)
+        stats["control_samples"] = len(control)
+        return stats
+
+
+_policy: HedgePolicy | None = None
+_policy_lock = threading.Lock()
+
+
+def get_policy() -> HedgePolicy | None:
+    """
+    HedgePolicy dùng chung; None nếu chưa bật GEMINI_HEDGE.
+    """
+    global _policy
+    if os.getenv("GEMINI_HEDGE", "0") != "1":
+        return None
+    with _policy_lock:
+        if _policy is None:
+            _policy = HedgePolicy(
+                percentile=float(
+                    os.getenv("GEMINI_HEDGE_PERCENTILE", DEFAULT_PERCENTILE)
+                ),
+                budget=float(os.getenv("GEMINI_HEDGE_BUDGET", DEFAULT_BUDGET)),
+                control_rate=float(
+                    os.getenv("GEMINI_HEDGE_CONTROL", DEFAULT_CONTROL_RATE)
+                ),
+            )
+        return _policy
+
+
+def get_stats() -> dict:
+    """
+    Thống kê hedge_rate, p50/p99 (có hedge) và p99_unhedged (nhóm đối chứng).
+    """
+    policy = get_policy()
+    return policy.stats() if policy else {}
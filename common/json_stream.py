@@ -0,0 +1,80 @@
+import json
+
+_decoder = json.JSONDecoder()
+
+
+class IncrementalJSONParser:
+    """
+    Parser JSON tăng dần cho output stream của Gemini.
+    Mỗi lần feed() một đoạn text, trả về các trường (path, value) vừa hoàn chỉnh.
+    Với max_depth=2, ngoài các trường cấp cao nhất ("overall_score") còn trả về
+    từng khối con ngay khi xong ("criteria_breakdown.grammar").
+    Bỏ qua code fence (```json) và mọi ký tự trước dấu { đầu tiên.
+    """
+
+    def __init__(self, max_depth: int = 1):
+        self.max_depth = max_depth
+        self.done = False
+        self._buffer = ""
+        self._pos = 0
+        self._stack: list[dict] = []
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> list[tuple[str, object]]:
+        self._buffer += chunk
+        fields = []
+
+        while self._pos < len(self._buffer) and not self.done:
+            char = self._buffer[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif not self._stack:
+                if char == "{":
+                    self._push(())
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._open(char)
+            elif char in "}]":
+                frame = self._stack.pop()
+                if frame["tracked"]:
+                    fields += self._flush(frame, self._pos)
+                if not self._stack:
+                    self.done = True
+            elif char == "," and self._stack[-1]["tracked"]:
+                fields += self._flush(self._stack[-1], self._pos)
+                self._stack[-1]["start"] = self._pos + 1
+
+            self._pos += 1
+
+        return fields
+
+    def _push(self, path: tuple | None) -> None:
+        self._stack.append(
+            {"start": self._pos + 1, "path": path, "tracked": path is not None}
+        )
+
+    def _open(self, char: str) -> None:
+        parent = self._stack[-1]
+        if char == "{" and parent["tracked"] and len(self._stack) < self.max_depth:
+            member = self._buffer[parent["start"] : self._pos].strip()
+            key, _ = _decoder.raw_decode(member)
+            self._push(parent["path"] + (key,))
+        else:
+            self._push(None)
+
+    def _flush(self, frame: dict, end: int) -> list[tuple[str, object]]:
+        member = self._buffer[frame["start"] : end].strip()
+        if not member:
+            return []
+        return [
+            (".".join(frame["path"] + (key,)), value)
+            for key, value in json.loads("{" + member + "}").items()
+        ]
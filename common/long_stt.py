@@ -0,0 +1,265 @@
+"""
+Nhận dạng bản ghi dài bằng Cloud STT.
+
+recognize đồng bộ chỉ nhận khoảng một phút audio và xử lý cả file trong một
+lời gọi. Ở đây audio được cắt tại khoảng lặng thành các đoạn tối đa
+AI_STT_CHUNK_SECONDS giây (chồng lấn AI_STT_CHUNK_OVERLAP giây ở mỗi biên),
+các đoạn được nhận dạng song song (tối đa AI_STT_CHUNK_CONCURRENCY đoạn cùng
+lúc) rồi ghép lại: thời điểm từng từ được cộng offset của đoạn, từ nằm trong
+vùng chồng lấn chỉ được giữ ở đoạn sở hữu nó. Thời gian chạy xấp xỉ
+(số đoạn / concurrency) × thời gian một lời gọi.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from google.cloud import speech
+
+from common import telemetry
+from common.audio import (
+    FRAME_SECONDS,
+    PreparedAudio,
+    current_settings,
+    downmix,
+    encode,
+    frame_runs,
+    map_file,
+    parse_wav,
+    recognition_config,
+    resample,
+    speech_frames,
+)
+from common.cloud_clients import get_speech_client, limit
+from common.concurrency import run_in_thread
+
+# Giới hạn của recognize đồng bộ là 60 giây; chừa biên cho phần chồng lấn.
+SYNC_MAX_SECONDS = 55.0
+DEFAULT_CHUNK_SECONDS = 50.0
+DEFAULT_OVERLAP_SECONDS = 1.0
+DEFAULT_CONCURRENCY = 8
+# Tìm khoảng lặng để cắt trong SEARCH_SECONDS cuối mỗi đoạn.
+SEARCH_SECONDS = 10.0
+
+
+def _options(chunk_seconds, overlap_seconds, concurrency) -> tuple:
+    return (
+        chunk_seconds
+        or float(os.getenv("AI_STT_CHUNK_SECONDS", DEFAULT_CHUNK_SECONDS)),
+        (
+            overlap_seconds
+            if overlap_seconds is not None
+            else float(os.getenv("AI_STT_CHUNK_OVERLAP", DEFAULT_OVERLAP_SECONDS))
+        ),
+        concurrency or int(os.getenv("AI_STT_CHUNK_CONCURRENCY", DEFAULT_CONCURRENCY)),
+    )
+
+
+def split_at_silence(
+    samples: np.ndarray,
+    sample_rate: int,
+    chunk_seconds: float = DEFAULT_CHUNK_SECONDS,
+    overlap_seconds: float = DEFAULT_OVERLAP_SECONDS,
+) -> list[tuple[int, int, int, int]]:
+    """
+    Chia audio mono thành các đoạn (start, end, own_start, own_end) tính theo
+    mẫu. Điểm cắt là giữa khoảng lặng dài nhất trong SEARCH_SECONDS cuối mỗi
+    đoạn (không có khoảng lặng thì cắt cứng); [start, end) gồm cả phần chồng
+    lấn, [own_start, own_end) là phần đoạn đó chịu trách nhiệm khi ghép.
+    """
+    frame = max(1, int(sample_rate * FRAME_SECONDS))
+    mask = speech_frames(samples, sample_rate)
+    max_frames = max(1, int((chunk_seconds - 2 * overlap_seconds) / FRAME_SECONDS))
+    search_frames = min(max_frames - 1, int(SEARCH_SECONDS / FRAME_SECONDS))
+
+    cuts = [0]
+    while len(mask) - cuts[-1] > max_frames:
+        low = cuts[-1] + max_frames - search_frames
+        high = cuts[-1] + max_frames
+        silences = frame_runs(mask[low:high], False)
+        if len(silences):
+            longest = silences[np.argmax(silences[:, 1] - silences[:, 0])]
+            cuts.append(low + int(longest.sum()) // 2)
+        else:
+            cuts.append(high)
+
+    bounds = [cut * frame for cut in cuts] + [len(samples)]
+    overlap = int(overlap_seconds * sample_rate)
+    return [
+        (max(0, own_start - overlap), min(len(samples), own_end + overlap))
+        + (own_start, own_end)
+        for own_start, own_end in zip(bounds, bounds[1:])
+        if own_end > own_start
+    ]
+
+
+def _recognize_chunk(
+    samples: np.ndarray,
+    sample_rate: int,
+    encoding: str,
+    offset: float,
+    language_code: str,
+) -> list[dict]:
+    """
+    Nhận dạng một đoạn; trả về các kết quả với thời điểm từng từ đã cộng offset.
+    """
+    prepared = PreparedAudio(
+        encode(samples, sample_rate, encoding),
+        encoding,
+        sample_rate,
+        len(samples) / sample_rate,
+    )
+    config = recognition_config(
+        prepared,
+        language_code=language_code,
+        enable_automatic_punctuation=True,
+        enable_word_time_offsets=True,
+        enable_word_confidence=True,
+    )
+    with telemetry.span(
+        "speech.recognize",
+        "google-cloud-speech",
+        request_bytes=len(prepared.data),
+        audio_seconds=prepared.duration,
+    ), limit("speech"):
+        response = get_speech_client().recognize(
+            config=config, audio=speech.RecognitionAudio(content=prepared.data)
+        )
+
+    results = []
+    for result in response.results:
+        if not result.alternatives:
+            continue
+        alternative = result.alternatives[0]
+        results.append(
+            {
+                "transcript": alternative.transcript,
+                "confidence": alternative.confidence,
+                "words": [
+                    {
+                        "word": word.word,
+                        "start": round(offset + word.start_time.total_seconds(), 3),
+                        "end": round(offset + word.end_time.total_seconds(), 3),
+                        "confidence": word.confidence,
+                    }
+                    for word in alternative.words
+                ],
+            }
+        )
+    return results
+
+
+def stitch(chunk_results: list[list[dict]], chunks: list[tuple], sample_rate: int):
+    """
+    Ghép kết quả các đoạn: mỗi từ chỉ được giữ ở đoạn chứa điểm giữa của nó
+    trong [own_start, own_end), nên phần chồng lấn không bị lặp.
+    """
+    words = []
+    transcripts = []
+    weighted = 0.0
+    total = 0
+    for results, (_, _, own_start, own_end) in zip(chunk_results, chunks):
+        low, high = own_start / sample_rate, own_end / sample_rate
+        for result in results:
+            if not result["words"]:
+                # Không có thời điểm từng từ thì không khử trùng được; giữ nguyên.
+                transcripts.append(result["transcript"].strip())
+                continue
+            kept = [
+                word
+                for word in result["words"]
+                if low <= (word["start"] + word["end"]) / 2 < high
+            ]
+            words += kept
+            transcripts.append(" ".join(word["word"] for word in kept))
+            weighted += result["confidence"] * len(kept)
+            total += len(kept)
+    return {
+        "transcript": " ".join(text for text in transcripts if text),
+        "confidence": weighted / total if total else 0.0,
+        "words": words,
+    }
+
+
+def load_samples(path: str) -> tuple[np.ndarray, int, str]:
+    """
+    Audio mono ở sample rate/encoding theo cấu hình, không cắt lặng: thời điểm
+    các từ phải khớp với file gốc.
+    """
+    _, sample_rate, encoding, _, _ = current_settings()
+    samples, source_rate = parse_wav(map_file(path))
+    return resample(downmix(samples), source_rate, sample_rate), sample_rate, encoding
+
+
+def transcribe_long(
+    path: str,
+    language_code: str = "en-US",
+    chunk_seconds: float | None = None,
+    overlap_seconds: float | None = None,
+    concurrency: int | None = None,
+) -> dict:
+    """
+    Nhận dạng file WAV dài bất kỳ. Trả về transcript, confidence (trung bình
+    theo số từ), words (word, start, end, confidence theo giây của file gốc),
+    số đoạn và thời lượng.
+    """
+    chunk_seconds, overlap_seconds, concurrency = _options(
+        chunk_seconds, overlap_seconds, concurrency
+    )
+    samples, sample_rate, encoding = load_samples(path)
+    chunks = split_at_silence(samples, sample_rate, chunk_seconds, overlap_seconds)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        chunk_results = list(
+            executor.map(
+                lambda chunk: _recognize_chunk(
+                    samples[chunk[0] : chunk[1]],
+                    sample_rate,
+                    encoding,
+                    chunk[0] / sample_rate,
+                    language_code,
+                ),
+                chunks,
+            )
+        )
+    return {
+        **stitch(chunk_results, chunks, sample_rate),
+        "chunks": len(chunks),
+        "duration": round(len(samples) / sample_rate, 3),
+    }
+
+
+async def atranscribe_long(
+    path: str,
+    language_code: str = "en-US",
+    chunk_seconds: float | None = None,
+    overlap_seconds: float | None = None,
+    concurrency: int | None = None,
+) -> dict:
+    """
+    Phiên bản async của transcribe_long(); các đoạn chạy trong thread pool chung.
+    """
+    chunk_seconds, overlap_seconds, concurrency = _options(
+        chunk_seconds, overlap_seconds, concurrency
+    )
+    samples, sample_rate, encoding = await run_in_thread(load_samples, path)
+    chunks = split_at_silence(samples, sample_rate, chunk_seconds, overlap_seconds)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def recognize(chunk):
+        async with semaphore:
+            return await run_in_thread(
+                _recognize_chunk,
+                samples[chunk[0] : chunk[1]],
+                sample_rate,
+                encoding,
+                chunk[0] / sample_rate,
+                language_code,
+            )
+
+    chunk_results = await asyncio.gather(*(recognize(chunk) for chunk in chunks))
+    return {
+        **stitch(chunk_results, chunks, sample_rate),
+        "chunks": len(chunks),
+        "duration": round(len(samples) / sample_rate, 3),
+    }
@@ -0,0 +1,270 @@
+"""
+Chấm phát âm một từ ngay trên CPU, trước khi gọi STT/Gemini.
+
+Cách đọc chuẩn của từ được tổng hợp bằng Cloud TTS với REFERENCE_VOICES (một
+lần cho mỗi từ, lưu file WAV trong AI_TTS_REFERENCE_DIR). Bản ghi của người
+học và bản mẫu được cắt về phần có tiếng, tính MFCC (NumPy, trừ trung bình
+theo từng hệ số để bớt phụ thuộc giọng và micro) rồi căn chỉnh bằng DTW với
+khoảng cách cosine giữa các frame; khoảng cách trung bình trên đường căn
+chỉnh được đổi thành điểm 0-1. Mỗi lần chấm mất vài mili giây.
+
+Điểm ≥ AI_LOCAL_SCORE_ACCEPT là đọc đúng, ≤ AI_LOCAL_SCORE_REJECT là đọc sai;
+chỉ phần nằm giữa (vùng mơ hồ) mới cần phân tích trên cloud. Hai ngưỡng nên
+được hiệu chỉnh lại trên bản ghi thật. AI_LOCAL_SCORER=0 tắt bước này.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
+from google.cloud import texttospeech
+
+from common import telemetry
+from common.audio import (
+    FRAME_SECONDS,
+    downmix,
+    map_file,
+    parse_wav,
+    resample,
+    speech_frames,
+)
+from common.cloud_clients import get_tts_client, limit
+from common.singleflight import get_flight
+
+SAMPLE_RATE = 16000
+FRAME_LENGTH_SECONDS = 0.025
+FRAME_STEP_SECONDS = 0.01
+FFT_SIZE = 512
+MEL_BANDS = 26
+# Bỏ hệ số 0 (năng lượng), giữ 12 hệ số phổ.
+MFCC_COUNT = 13
+PRE_EMPHASIS = 0.97
+# Một giọng nam, một giọng nữ; điểm lấy theo giọng mẫu gần nhất.
+REFERENCE_VOICES = ("en-US-Wavenet-A", "en-US-Wavenet-F")
+DEFAULT_REFERENCE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "ai-features", "tts-references"
+)
+# Khoảng cách DTW ứng với điểm 1 và điểm 0. Trên bản ghi mẫu của feature 12,
+# cùng từ (người học, đọc chậm, nhỏ tiếng) cho ~0.18-0.21, đoạn nói khác ≥ 0.35.
+MATCH_DISTANCE = 0.15
+MISMATCH_DISTANCE = 0.45
+DEFAULT_ACCEPT = 0.75
+DEFAULT_REJECT = 0.3
+REFERENCE_CACHE_SIZE = 256
+
+_lock = threading.Lock()
+_stats = {
+    "scored": 0,
+    "correct": 0,
+    "incorrect": 0,
+    "ambiguous": 0,
+    "errors": 0,
+    "seconds": 0.0,
+}
+
+
+@lru_cache(maxsize=4)
+def _mel_filterbank(sample_rate: int, fft_size: int, bands: int) -> np.ndarray:
+    def to_mel(hz):
+        return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+    def to_hz(mel):
+        return 700.0 * (10.0 ** (mel / 2595.0) - 1.0)
+
+    edges = to_hz(np.linspace(0.0, to_mel(sample_rate / 2), bands + 2))
+    bins = np.fft.rfftfreq(fft_size, 1.0 / sample_rate)
+    lower, center, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    rising = (bins - lower) / (center - lower)
+    falling = (upper - bins) / (upper - center)
+    return np.maximum(0.0, np.minimum(rising, falling)).astype(np.float32)
+
+
+@lru_cache(maxsize=4)
+def _dct_matrix(bands: int, count: int) -> np.ndarray:
+    # DCT-II có chuẩn hoá, dạng ma trận để áp dụng cho mọi frame một lần.
+    n = np.arange(bands)
+    k = np.arange(count)[:, None]
+    matrix = np.cos(np.pi * k * (2 * n + 1) / (2 * bands)) * np.sqrt(2.0 / bands)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+def mfcc(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    MFCC (frames × MFCC_COUNT-1) của audio mono, đã trừ trung bình từng hệ số
+    trên toàn bản ghi.
+    """
+    frame_length = int(sample_rate * FRAME_LENGTH_SECONDS)
+    step = int(sample_rate * FRAME_STEP_SECONDS)
+    if len(samples) < frame_length:
+        samples = np.pad(samples, (0, frame_length - len(samples)))
+    emphasized = np.append(samples[:1], samples[1:] - PRE_EMPHASIS * samples[:-1])
+    frames = np.lib.stride_tricks.sliding_window_view(emphasized, frame_length)[::step]
+    frames = frames * np.hamming(frame_length).astype(np.float32)
+    power = np.abs(np.fft.rfft(frames, FFT_SIZE)) ** 2 / FFT_SIZE
+    mel = power @ _mel_filterbank(sample_rate, FFT_SIZE, MEL_BANDS).T
+    coefficients = np.log(mel + 1e-10) @ _dct_matrix(MEL_BANDS, MFCC_COUNT).T
+    coefficients = coefficients[:, 1:]
+    return (coefficients - coefficients.mean(axis=0)).astype(np.float32)
+
+
+def dtw_distance(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    Khoảng cách DTW (cosine giữa các frame) giữa hai chuỗi đặc trưng, chia
+    cho (len(a) + len(b)).
+
+    Mỗi hàng của ma trận tích luỹ được tính bằng phép toán vector: với
+    m[j] = min(D[i-1, j-1], D[i-1, j]) và S là tổng dồn chi phí của hàng,
+    D[i, j] = S[j] + min_{k ≤ j}(m[k] - S[k-1]).
+    """
+    a = a / (np.linalg.norm(a, axis=1, keepdims=True) + 1e-8)
+    b = b / (np.linalg.norm(b, axis=1, keepdims=True) + 1e-8)
+    cost = (1.0 - a @ b.T).astype(np.float64)
+    previous = np.full(len(b), np.inf)
+    corner = 0.0
+    for row in cost:
+        diagonal = np.concatenate(([corner], previous[:-1]))
+        best = np.minimum(diagonal, previous)
+        totals = np.cumsum(row)
+        previous = totals + np.minimum.accumulate(best - (totals - row))
+        corner = np.inf
+    return float(previous[-1] / (len(a) + len(b)))
+
+
+def similarity(distance: float) -> float:
+    """
+    Đổi khoảng cách DTW thành điểm 0-1 (1 là giống hệt bản mẫu).
+    """
+    score = (MISMATCH_DISTANCE - distance) / (MISMATCH_DISTANCE - MATCH_DISTANCE)
+    return float(min(1.0, max(0.0, score)))
+
+
+def _speech_features(data) -> np.ndarray | None:
+    samples, source_rate = parse_wav(data)
+    samples = resample(downmix(samples), source_rate, SAMPLE_RATE)
+    speech = np.flatnonzero(speech_frames(samples, SAMPLE_RATE))
+    if len(speech) == 0:
+        return None
+    frame = int(SAMPLE_RATE * FRAME_SECONDS)
+    return mfcc(samples[speech[0] * frame : (speech[-1] + 1) * frame])
+
+
+def _reference_path(word: str, voice: str) -> str:
+    directory = os.getenv("AI_TTS_REFERENCE_DIR", DEFAULT_REFERENCE_DIR)
+    digest = hashlib.sha256(word.encode("utf-8")).hexdigest()[:32]
+    return os.path.join(directory, voice, f"{digest}.wav")
+
+
+def _synthesize_reference(word: str, voice: str) -> str:
+    """
+    Đường dẫn file WAV mẫu của word, gọi TTS nếu chưa có trên đĩa.
+    """
+    path = _reference_path(word, voice)
+    if os.path.exists(path):
+        return path
+
+    with telemetry.span(
+        "tts.synthesize_speech", "google-cloud-tts", characters=len(word)
+    ) as span, limit("tts"):
+        response = get_tts_client().synthesize_speech(
+            input=texttospeech.SynthesisInput(text=word),
+            voice=texttospeech.VoiceSelectionParams(language_code="en-US", name=voice),
+            audio_config=texttospeech.AudioConfig(
+                audio_encoding=texttospeech.AudioEncoding.LINEAR16,
+                sample_rate_hertz=SAMPLE_RATE,
+            ),
+        )
+        span.set(response_bytes=len(response.audio_content))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(response.audio_content)
+    os.replace(temp_path, path)
+    return path
+
+
+@lru_cache(maxsize=REFERENCE_CACHE_SIZE)
+def reference_features(word: str) -> tuple[np.ndarray, ...]:
+    """
+    MFCC của cách đọc chuẩn theo từng giọng trong REFERENCE_VOICES. Lần đầu
+    gọi TTS (các request cùng từ chỉ gọi một lần), sau đó đọc từ đĩa/bộ nhớ.
+    """
+    features = []
+    for voice in REFERENCE_VOICES:
+        path = get_flight("tts-reference").do(
+            f"{voice}:{word}", _synthesize_reference, word, voice
+        )
+        reference = _speech_features(map_file(path))
+        if reference is not None:
+            features.append(reference)
+    if not features:
+        raise ValueError(f"Audio mẫu của '{word}' không có tiếng.")
+    return tuple(features)
+
+
+def score_file(path: str, word: str) -> float:
+    """
+    Điểm 0-1 của bản ghi WAV so với cách đọc chuẩn gần nhất của word.
+    Bản ghi không có tiếng được 0 điểm.
+    """
+    references = reference_features(word.lower().strip())
+    learner = _speech_features(map_file(path))
+    if learner is None:
+        return 0.0
+    return max(similarity(dtw_distance(learner, reference)) for reference in references)
+
+
+def current_thresholds() -> tuple[float, float]:
+    return (
+        float(os.getenv("AI_LOCAL_SCORE_ACCEPT", DEFAULT_ACCEPT)),
+        float(os.getenv("AI_LOCAL_SCORE_REJECT", DEFAULT_REJECT)),
+    )
+
+
+def judge(path: str, word: str) -> tuple[str, float] | None:
+    """
+    ("correct" | "incorrect" | "ambiguous", điểm) cho bản ghi; None khi bước
+    chấm cục bộ bị tắt hoặc lỗi (người gọi chuyển thẳng lên cloud).
+    """
+    if os.getenv("AI_LOCAL_SCORER", "1") == "0":
+        return None
+    start = time.perf_counter()
+    try:
+        score = score_file(path, word)
+    except Exception as e:
+        print(f"Lỗi chấm phát âm cục bộ: {e}")
+        with _lock:
+            _stats["errors"] += 1
+        return None
+
+    accept, reject = current_thresholds()
+    if score >= accept:
+        verdict = "correct"
+    elif score <= reject:
+        verdict = "incorrect"
+    else:
+        verdict = "ambiguous"
+    with _lock:
+        _stats["scored"] += 1
+        _stats[verdict] += 1
+        _stats["seconds"] += time.perf_counter() - start
+    return verdict, score
+
+
+def get_stats() -> dict:
+    """
+    Số lần chấm theo kết luận, thời gian chấm trung bình và tỉ lệ request
+    không cần gọi cloud.
+    """
+    with _lock:
+        stats = dict(_stats)
+    scored = stats["scored"]
+    stats["mean_ms"] = stats["seconds"] / scored * 1000 if scored else 0.0
+    stats["cloud_skip_rate"] = (
+        (stats["correct"] + stats["incorrect"]) / scored if scored else 0.0
+    )
+    return stats
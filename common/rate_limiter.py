@@ -0,0 +1,346 @@
+"""
+Giới hạn tốc độ gọi Gemini theo quota (requests/phút và tokens/phút) cho từng
+model và API key.
+
+- Mỗi (model, api_key) có 2 token bucket: RPM và TPM. Người gọi phải chờ tới khi
+  đủ chỗ thay vì bị lỗi.
+- Khi nhận 429, giới hạn hiệu dụng được hạ xuống mức thực tế đã gửi được trong
+  60 giây gần nhất, rồi tăng dần trở lại sau mỗi request thành công.
+- Request bị 429 được thử lại với exponential backoff có jitter (hoặc theo
+  retryDelay mà API trả về).
+"""
+
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+from google.genai import errors
+
+# Quota mặc định (RPM, TPM); ghi đè bằng GEMINI_RPM_LIMIT / GEMINI_TPM_LIMIT.
+DEFAULT_LIMITS = {
+    "gemini-2.5-flash": (1000, 1_000_000),
+    "gemini-2.5-flash-lite": (4000, 4_000_000),
+    "gemini-1.5-flash": (2000, 4_000_000),
+}
+FALLBACK_LIMITS = (60, 250_000)
+MIN_RPM = 1
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+DEFAULT_MAX_RETRIES = 6
+# Audio WAV 24 kHz 16-bit ~ 48 KB/giây, Gemini tính ~32 token/giây audio.
+AUDIO_BYTES_PER_TOKEN = 1500
+
+
+def estimate_tokens(contents) -> int:
+    """
+    Ước lượng số token input (≈ 4 ký tự/token cho text, theo thời lượng cho audio).
+    """
+    if isinstance(contents, str):
+        return len(contents) // 4 + 1
+    if isinstance(contents, (bytes, bytearray, memoryview)):
+        return len(contents) // AUDIO_BYTES_PER_TOKEN + 1
+    if isinstance(contents, dict):
+        return sum(estimate_tokens(v) for v in contents.values())
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(v) for v in contents)
+    return 0
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return isinstance(error, errors.APIError) and (
+        error.code == 429 or error.status == "RESOURCE_EXHAUSTED"
+    )
+
+
+def _retry_delay(error: Exception) -> float | None:
+    # API có thể gợi ý thời gian chờ qua google.rpc.RetryInfo ("retryDelay": "17s").
+    details = getattr(error, "details", None) or {}
+    for detail in details.get("error", {}).get("details", []) or []:
+        match = re.fullmatch(r"([\d.]+)s", str(detail.get("retryDelay", "")))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.capacity / 60.0
+        )
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # Request lớn hơn cả bucket vẫn được gửi khi bucket đầy.
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.capacity
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, rpm: float, tpm: float):
+        self.max_rpm = rpm
+        self.max_tpm = tpm
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0
+        self.throttle_streak = 0
+        self._sent: deque[tuple[float, int]] = deque()
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "throttled": 0, "waited_seconds": 0.0}
+
+    def _reserve(self, tokens: int) -> float:
+        # Trả về thời gian cần chờ; 0 nghĩa là đã giữ chỗ thành công.
+        with self._lock:
+            now = time.monotonic()
+            wait = max(
+                self.blocked_until - now,
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(tokens, now),
+            )
+            if wait > 0:
+                return wait
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self._sent.append((now, tokens))
+            self._stats["requests"] += 1
+            return 0.0
+
+    def try_acquire(self, tokens: int) -> bool:
+        """
+        Giữ chỗ nếu còn quota ngay lúc này, không chờ.
+        """
+        return self._reserve(tokens) <= 0
+
+    def acquire(self, tokens: int) -> None:
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            self._add_wait(wait)
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int) -> None:
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            self._add_wait(wait)
+            await asyncio.sleep(wait)
+
+    def _add_wait(self, wait: float) -> None:
+        with self._lock:
+            self._stats["waited_seconds"] += wait
+
+    def record_usage(self, estimated: int, actual: int | None) -> None:
+        """
+        Bù chênh lệch giữa số token ước lượng và usage_metadata thực tế.
+        """
+        if actual is None:
+            return
+        with self._lock:
+            self.tokens.tokens -= actual - estimated
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.throttle_streak = 0
+            # Tăng dần giới hạn trở lại (additive increase) tới mức cấu hình.
+            self.requests.capacity = min(self.max_rpm, self.requests.capacity + 1)
+            self.tokens.capacity = min(
+                self.max_tpm, self.tokens.capacity + self.max_tpm / self.max_rpm
+            )
+
+    def on_throttled(self, error: Exception) -> float:
+        """
+        Học giới hạn thực tế từ lỗi 429 và trả về thời gian backoff.
+        """
+        with self._lock:
+            now = time.monotonic()
+            while self._sent and now - self._sent[0][0] > 60.0:
+                self._sent.popleft()
+            observed_rpm = len(self._sent)
+            observed_tpm = sum(tokens for _, tokens in self._sent)
+
+            # Hạ giới hạn về mức thực tế đã gửi được, nhưng mỗi lần 429 giảm
+            # tối đa một nửa để lưu lượng thấp không kéo quota về gần 0.
+            self.requests.capacity = max(
+                MIN_RPM,
+                min(
+                    self.requests.capacity,
+                    max(observed_rpm * 0.9, self.requests.capacity / 2),
+                ),
+            )
+            self.requests.tokens = min(self.requests.tokens, self.requests.capacity)
+            if observed_tpm:
+                self.tokens.capacity = min(
+                    self.tokens.capacity,
+                    max(observed_tpm * 0.9, self.tokens.capacity / 2),
+                )
+                self.tokens.tokens = min(self.tokens.tokens, self.tokens.capacity)
+
+            self.throttle_streak += 1
+            delay = _retry_delay(error)
+            if delay is None:
+                ceiling = min(BACKOFF_CAP, BACKOFF_BASE * 2**self.throttle_streak)
+                delay = random.uniform(ceiling / 2, ceiling)
+            self.blocked_until = max(self.blocked_until, now + delay)
+            self._stats["throttled"] += 1
+            return delay
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["effective_rpm"] = self.requests.capacity
+            stats["effective_tpm"] = self.tokens.capacity
+            return stats
+
+
+_limiters: dict[tuple[str, str | None], AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(model: str, api_key: str | None = None) -> AdaptiveRateLimiter:
+    api_key = api_key or os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    key = (model, api_key)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            rpm, tpm = DEFAULT_LIMITS.get(model, FALLBACK_LIMITS)
+            limiter = AdaptiveRateLimiter(
+                rpm=float(os.getenv("GEMINI_RPM_LIMIT", rpm)),
+                tpm=float(os.getenv("GEMINI_TPM_LIMIT", tpm)),
+            )
+            _limiters[key] = limiter
+        return limiter
+
+
+def _usage_tokens(response) -> int | None:
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) if usage else None
+
+
+def try_reserve(model: str, contents) -> bool:
+    """
+    Giữ chỗ cho một request gửi thêm (ví dụ bản hedge) nếu còn quota ngay lúc
+    này; False thì không nên gửi.
+    """
+    return get_limiter(model).try_acquire(estimate_tokens(contents))
+
+
+def call_with_limits(
+    model: str, contents, func, max_retries: int = DEFAULT_MAX_RETRIES
+):
+    """
+    Chờ quota rồi gọi func(); gặp 429 thì backoff và thử lại thay vì báo lỗi ngay.
+    """
+    limiter = get_limiter(model)
+    estimated = estimate_tokens(contents)
+    for attempt in range(max_retries + 1):
+        limiter.acquire(estimated)
+        try:
+            response = func()
+        except Exception as e:
+            if not is_rate_limited(e) or attempt == max_retries:
+                raise
+            delay = limiter.on_throttled(e)
+            print(f"Gemini 429 ({model}), thử lại sau {delay:.1f}s...")
+            continue
+        limiter.on_success()
+        limiter.record_usage(estimated, _usage_tokens(response))
+        return response
+
+
+async def acall_with_limits(
+    model: str, contents, func, max_retries: int = DEFAULT_MAX_RETRIES
+):
+    """
+    Phiên bản async của call_with_limits(); func trả về coroutine.
+    """
+    limiter = get_limiter(model)
+    estimated = estimate_tokens(contents)
+    for attempt in range(max_retries + 1):
+        await limiter.aacquire(estimated)
+        try:
+            response = await func()
+        except Exception as e:
+            if not is_rate_limited(e) or attempt == max_retries:
+                raise
+            delay = limiter.on_throttled(e)
+            print(f"Gemini 429 ({model}), thử lại sau {delay:.1f}s...")
+            continue
+        limiter.on_success()
+        limiter.record_usage(estimated, _usage_tokens(response))
+        return response
+
+
+def stream_with_limits(
+    model: str, contents, func, max_retries: int = DEFAULT_MAX_RETRIES
+):
+    """
+    Phiên bản stream của call_with_limits(): func() trả về iterator các chunk.
+    Quota được giữ trước khi mở stream; 429 khi mở stream (trước chunk đầu
+    tiên) thì backoff rồi mở lại. usage_metadata của chunk cuối dùng để bù số
+    token ước lượng.
+    """
+    limiter = get_limiter(model)
+    estimated = estimate_tokens(contents)
+    for attempt in range(max_retries + 1):
+        limiter.acquire(estimated)
+        try:
+            iterator = iter(func())
+            chunk = next(iterator, None)
+        except Exception as e:
+            if not is_rate_limited(e) or attempt == max_retries:
+                raise
+            delay = limiter.on_throttled(e)
+            print(f"Gemini 429 ({model}), thử lại sau {delay:.1f}s...")
+            continue
+        break
+    limiter.on_success()
+    if chunk is not None:
+        yield chunk
+        for chunk in iterator:
+            yield chunk
+    limiter.record_usage(estimated, _usage_tokens(chunk))
+
+
+async def astream_with_limits(
+    model: str, contents, func, max_retries: int = DEFAULT_MAX_RETRIES
+):
+    """
+    Phiên bản async của stream_with_limits(); func() trả về coroutine cho ra
+    async iterator các chunk.
+    """
+    limiter = get_limiter(model)
+    estimated = estimate_tokens(contents)
+    for attempt in range(max_retries + 1):
+        await limiter.aacquire(estimated)
+        try:
+            iterator = aiter(await func())
+            chunk = await anext(iterator, None)
+        except Exception as e:
+            if not is_rate_limited(e) or attempt == max_retries:
+                raise
+            delay = limiter.on_throttled(e)
+            print(f"Gemini 429 ({model}), thử lại sau {delay:.1f}s...")
+            continue
+        break
+    limiter.on_success()
+    if chunk is not None:
+        yield chunk
+        async for chunk in iterator:
+            yield chunk
+    limiter.record_usage(estimated, _usage_tokens(chunk))
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MEMORY_ENTRIES = 1024
+DEFAULT_DISK_BYTES = 200 * 1024 * 1024
+# Khi vượt giới hạn, xoá xuống còn tỉ lệ này để không phải quét thư mục ở mỗi lần ghi.
+DISK_EVICT_RATIO = 0.9
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ai-features")
+
+
+class CachedResponse:
+    """
+    Response lấy từ cache; có cùng thuộc tính .text như response của Gemini.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.usage_metadata = None
+
+
+def _canonical(value):
+    # Bytes (audio/ảnh) được thay bằng hash để key không phụ thuộc vào kích thước dữ liệu.
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"__sha256__": hashlib.sha256(value).hexdigest()}
+    if hasattr(value, "model_dump"):
+        return _canonical(value.model_dump(exclude_none=True))
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def make_key(model: str, contents, config=None) -> str:
+    """
+    Key theo nội dung: hash của model, prompt đã render, generation config và media.
+    """
+    payload = json.dumps(
+        _canonical({"model": model, "contents": contents, "config": config}),
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache 2 tầng cho text trả về từ Gemini: LRU trong bộ nhớ và file JSON trên đĩa.
+
+    Khác với common.singleflight, vốn chỉ gộp các lời gọi đang chạy cùng lúc
+    (chia sẻ kết quả giữa các tiến trình chỉ khi đặt AI_SINGLEFLIGHT_DIR, giữ
+    AI_SINGLEFLIGHT_TTL giây).
+    """
+
+    def __init__(
+        self,
+        cache_dir: str | None = DEFAULT_CACHE_DIR,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_memory_entries: int = DEFAULT_MEMORY_ENTRIES,
+        max_disk_bytes: int = DEFAULT_DISK_BYTES,
+    ):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        # Tổng dung lượng/số file trên đĩa, cộng dồn khi ghi; None cho tới lần quét đầu.
+        self._disk_bytes: int | None = None
+        self._disk_entries = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _expired(self, stored_at: float) -> bool:
+        return time.time() - stored_at > self.ttl_seconds
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[0]):
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return entry[1]
+            if entry is not None:
+                del self._memory[key]
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._remember(key, entry)
+            return entry[1]
+
+    def set(self, key: str, text: str) -> None:
+        entry = (time.time(), text)
+        with self._lock:
+            self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def _remember(self, key: str, entry: tuple[float, str]) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _read_disk(self, key: str) -> tuple[float, str] | None:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            stored_at, text = data["stored_at"], data["text"]
+        except (OSError, ValueError, KeyError, TypeError):
+            # File hỏng hoặc thiếu trường: coi như miss, lần set sau sẽ ghi đè.
+            return None
+
+        if self._expired(stored_at):
+            self._remove_disk(self._path(key))
+            return None
+        return stored_at, text
+
+    def _write_disk(self, key: str, entry: tuple[float, str]) -> None:
+        if not self.cache_dir:
+            return
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"stored_at": entry[0], "text": entry[1]}, f, ensure_ascii=False
+                )
+            old_size = self._file_size(self._path(key))
+            os.replace(tmp_path, self._path(key))
+            new_size = self._file_size(self._path(key)) or 0
+        except OSError as e:
+            print(f"Lỗi ghi cache: {e}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += new_size - (old_size or 0)
+                if old_size is None:
+                    self._disk_entries += 1
+            over = self._disk_bytes is None or self._disk_bytes > self.max_disk_bytes
+        if over:
+            self._evict_disk()
+
+    @staticmethod
+    def _file_size(path: str) -> int | None:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return None
+
+    def _remove_disk(self, path: str) -> bool:
+        size = self._file_size(path)
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        with self._lock:
+            if self._disk_bytes is not None and size is not None:
+                self._disk_bytes -= size
+                self._disk_entries -= 1
+        return True
+
+    def _evict_disk(self) -> None:
+        """
+        Quét thư mục (chỉ khi lần đầu hoặc tổng cộng dồn vượt giới hạn) rồi xoá
+        file cũ nhất cho tới khi còn DISK_EVICT_RATIO giới hạn. Quét lại cũng đồng
+        bộ số liệu với file do tiến trình khác ghi.
+        """
+        files = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".json"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        count = len(files)
+        if total > self.max_disk_bytes:
+            files.sort()
+            for _, size, path in files:
+                if total <= self.max_disk_bytes * DISK_EVICT_RATIO:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                count -= 1
+                with self._lock:
+                    self._stats["evictions"] += 1
+        with self._lock:
+            self._disk_bytes = total
+            self._disk_entries = count
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_bytes"] = self._disk_bytes
+            stats["disk_entries"] = self._disk_entries
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+
+_default_cache: ResponseCache | None = None
+_default_lock = threading.Lock()
+
+
+def default_cache() -> ResponseCache:
+    """
+    Cache dùng chung cho các feature đã opt-in, cấu hình qua biến môi trường AI_CACHE_*.
+    """
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(
+                cache_dir=os.path.expanduser(
+                    os.getenv("AI_CACHE_DIR", DEFAULT_CACHE_DIR)
+                )
+                or None,
+                ttl_seconds=float(os.getenv("AI_CACHE_TTL", DEFAULT_TTL_SECONDS)),
+                max_memory_entries=int(
+                    os.getenv("AI_CACHE_MEMORY_ENTRIES", DEFAULT_MEMORY_ENTRIES)
+                ),
+                max_disk_bytes=int(
+                    os.getenv("AI_CACHE_DISK_BYTES", DEFAULT_DISK_BYTES)
+                ),
+            )
+        return _default_cache
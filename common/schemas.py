@@ -0,0 +1,284 @@
+"""
+Registry schema JSON cho từng feature trong ai-features/*.
+Schema viết theo định dạng response_schema của Gemini (OBJECT/ARRAY/STRING...),
+đồng thời dùng để kiểm tra nhanh phản hồi trước khi trả về cho người dùng.
+"""
+
+STRING = {"type": "STRING"}
+NUMBER = {"type": "NUMBER"}
+INTEGER = {"type": "INTEGER"}
+
+_PYTHON_TYPES = {
+    "STRING": (str,),
+    "NUMBER": (int, float),
+    "INTEGER": (int,),
+    "BOOLEAN": (bool,),
+    "OBJECT": (dict,),
+    "ARRAY": (list,),
+}
+
+
+def _obj(optional: tuple[str, ...] = (), **properties) -> dict:
+    return {
+        "type": "OBJECT",
+        "properties": properties,
+        "required": [name for name in properties if name not in optional],
+        "property_ordering": list(properties),
+    }
+
+
+def _arr(items: dict) -> dict:
+    return {"type": "ARRAY", "items": items}
+
+
+STRING_LIST = _arr(STRING)
+
+
+def _criterion(weakness_field: str = "weaknesses") -> dict:
+    return _obj(score=NUMBER, strengths=STRING, **{weakness_field: STRING})
+
+
+_EXAMPLE = _obj(sentence=STRING, translation=STRING, explanation=STRING)
+
+FEATURE_SCHEMAS = {
+    "12": _obj(
+        overall_score=INTEGER,
+        transcribed_text=STRING,
+        positive_feedback=STRING,
+        points_to_improve=_arr(
+            _obj(phoneme=STRING, error_description=STRING, suggestion=STRING)
+        ),
+    ),
+    "21": _obj(
+        level=STRING,
+        grammar_focus=STRING_LIST,
+        exercises=_arr(
+            _obj(
+                optional=("options",),
+                id=INTEGER,
+                question_text=STRING,
+                options=STRING_LIST,
+                correct_answer=STRING,
+                explanation=STRING,
+            )
+        ),
+    ),
+    "24": _obj(
+        overall_score=INTEGER,
+        transcribed_text=STRING,
+        sentence_level_feedback=_obj(fluency=STRING, intonation=STRING),
+        word_level_errors=_arr(
+            _obj(word=STRING, error_description=STRING, suggestion=STRING)
+        ),
+    ),
+    "26": _obj(
+        pronunciation_focus=STRING,
+        level=STRING,
+        practice_sentences=_arr(
+            _obj(id=INTEGER, sentence=STRING, ipa_transcription=STRING, tip_vi=STRING)
+        ),
+    ),
+    "30": _obj(
+        topic=STRING,
+        level=STRING,
+        full_text=STRING,
+        exercise_text=STRING,
+        answers=STRING_LIST,
+    ),
+    "49": _obj(
+        overall_score=NUMBER,
+        summary_feedback_vi=STRING,
+        criteria_breakdown=_obj(
+            task_fulfillment=_criterion(),
+            organization=_criterion(),
+            vocabulary=_criterion(),
+            grammar=_criterion(),
+        ),
+        corrected_text=STRING,
+    ),
+    "56": _obj(
+        overall_score=NUMBER,
+        full_transcript=STRING,
+        criteria_breakdown=_obj(
+            grammar=_criterion(),
+            vocabulary=_criterion(),
+            fluency_coherence=_criterion(),
+            pronunciation=_criterion(),
+        ),
+        actionable_feedback=_arr(
+            _obj(error_quote=STRING, issue_type=STRING, suggestion=STRING)
+        ),
+    ),
+    "90": _obj(
+        overall_score=NUMBER,
+        level_assessment={
+            "type": "STRING",
+            "enum": ["Pre-A1", "A1", "A2", "Above A2"],
+        },
+        full_transcript=STRING,
+        criteria_scores=_obj(
+            grammar_vocabulary=_criterion("areas_for_improvement"),
+            pronunciation=_criterion("areas_for_improvement"),
+            discourse_management=_criterion("areas_for_improvement"),
+            interactive_communication=_criterion("areas_for_improvement"),
+        ),
+        detailed_feedback=_obj(
+            positive_highlights=STRING_LIST,
+            specific_errors=_arr(
+                _obj(
+                    error_quote=STRING,
+                    error_type=STRING,
+                    correction=STRING,
+                    explanation=STRING,
+                )
+            ),
+            improvement_suggestions=STRING_LIST,
+        ),
+        next_steps=STRING,
+    ),
+    "167": _obj(
+        word=STRING,
+        context=STRING,
+        level=STRING,
+        contextual_meaning=_obj(
+            vietnamese=STRING, english_definition=STRING, word_class=STRING
+        ),
+        pronunciation=_obj(ipa=STRING, phonetic_spelling=STRING, stress_pattern=STRING),
+        detailed_explanation=_obj(
+            usage_in_context=STRING, grammar_notes=STRING, common_mistakes=STRING
+        ),
+        example_sentences=_arr(_EXAMPLE),
+        related_vocabulary=_obj(
+            synonyms=STRING_LIST, antonyms=STRING_LIST, collocations=STRING_LIST
+        ),
+        audio_text=STRING,
+    ),
+    "170.analysis": _obj(
+        selected_sentence=STRING,
+        paragraph_context=STRING,
+        level=STRING,
+        sentence_analysis=_obj(
+            sentence_type=STRING, main_tense=STRING, sentence_function=STRING
+        ),
+        grammar_structures=_arr(
+            _obj(
+                structure_id=INTEGER,
+                structure_name=STRING,
+                pattern=STRING,
+                highlighted_part=STRING,
+                contextual_meaning=_obj(vietnamese=STRING, function=STRING),
+                detailed_explanation=_obj(
+                    usage_rules=STRING,
+                    when_to_use=STRING,
+                    common_situations=STRING,
+                    grammar_notes=STRING,
+                ),
+                examples=_arr(_EXAMPLE),
+                common_mistakes=_arr(
+                    _obj(mistake=STRING, correction=STRING, explanation=STRING)
+                ),
+                related_structures=STRING_LIST,
+            )
+        ),
+        contextual_analysis=_obj(
+            paragraph_theme=STRING,
+            sentence_role=STRING,
+            discourse_markers=STRING,
+            register=STRING,
+        ),
+        learning_suggestions=STRING_LIST,
+    ),
+    "170.details": _obj(
+        structure_name=STRING,
+        level=STRING,
+        comprehensive_info=_obj(
+            definition=STRING,
+            pattern=STRING,
+            variations=STRING_LIST,
+            formation_rules=STRING,
+        ),
+        usage_contexts=_obj(
+            when_to_use=STRING,
+            common_situations=STRING_LIST,
+            register=STRING,
+            frequency=STRING,
+        ),
+        detailed_examples=_arr(
+            _obj(
+                category=STRING,
+                sentence=STRING,
+                translation=STRING,
+                breakdown=STRING,
+                context=STRING,
+            )
+        ),
+        comparison_with_similar=_arr(
+            _obj(
+                similar_structure=STRING,
+                difference=STRING,
+                example_comparison=STRING,
+            )
+        ),
+        common_errors=_arr(
+            _obj(
+                error_type=STRING,
+                wrong_example=STRING,
+                correct_example=STRING,
+                explanation=STRING,
+                prevention_tip=STRING,
+            )
+        ),
+        practice_exercises=_arr(
+            _obj(
+                exercise_type=STRING,
+                question=STRING,
+                answer=STRING,
+                explanation=STRING,
+            )
+        ),
+        learning_progression=_obj(
+            prerequisite_knowledge=STRING_LIST,
+            next_level_structures=STRING_LIST,
+            practice_recommendations=STRING,
+        ),
+    ),
+}
+
+
+def get_schema(feature: str) -> dict:
+    return FEATURE_SCHEMAS[feature]
+
+
+def validate(schema: dict, data, path: str = "") -> list[str]:
+    """
+    Kiểm tra data theo schema, trả về danh sách đường dẫn trường bị thiếu hoặc sai kiểu
+    (ví dụ "criteria_breakdown.grammar.score"). Danh sách rỗng nghĩa là hợp lệ.
+    """
+    expected = _PYTHON_TYPES[schema["type"]]
+    if not isinstance(data, expected) or (
+        isinstance(data, bool) and schema["type"] != "BOOLEAN"
+    ):
+        return [path or "$"]
+    if "enum" in schema and data not in schema["enum"]:
+        return [path or "$"]
+
+    errors = []
+    if schema["type"] == "OBJECT":
+        for name, child in schema["properties"].items():
+            child_path = f"{path}.{name}" if path else name
+            if name not in data:
+                if name in schema.get("required", ()):
+                    errors.append(child_path)
+                continue
+            errors += validate(child, data[name], child_path)
+    elif schema["type"] == "ARRAY":
+        for index, item in enumerate(data):
+            errors += validate(schema["items"], item, f"{path}[{index}]")
+    return errors
+
+
+def sub_schema(schema: dict, fields: list[str]) -> dict:
+    """
+    Schema chỉ gồm các trường cấp cao nhất cần yêu cầu lại.
+    """
+    return _obj(**{name: schema["properties"][name] for name in fields})
@@ -0,0 +1,267 @@
+"""
+Gộp các lời gọi giống hệt nhau đang chạy đồng thời (single-flight).
+
+Trong một tiến trình: lời gọi đầu tiên với một key thực hiện request, các lời gọi
+cùng key đến sau chờ và dùng chung kết quả (cả thread lẫn asyncio). Mỗi người gọi
+nhận một bản sao riêng (deepcopy) nên có thể sửa kết quả mà không ảnh hưởng nhau.
+
+Giữa các tiến trình (worker), chỉ khi đặt AI_SINGLEFLIGHT_DIR: dùng file lock theo
+key; tiến trình đến sau chờ lock rồi đọc kết quả (dạng JSON) mà tiến trình trước
+vừa ghi ra, hết hạn sau AI_SINGLEFLIGHT_TTL giây (file hết hạn được xoá khi đọc
+và định kỳ quét lại thư mục). Đây không phải cache: kết quả lưu lâu dài dùng
+common.response_cache. File lock cần fcntl (Linux/macOS); trên
+Windows chỉ gộp trong một tiến trình.
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEFAULT_RESULT_TTL = 10.0
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(
+        self,
+        name: str,
+        shared_dir: str | None = None,
+        result_ttl: float = DEFAULT_RESULT_TTL,
+    ):
+        self.name = name
+        self.shared_dir = os.path.join(shared_dir, name) if shared_dir else None
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+        self._futures: dict[tuple, asyncio.Future] = {}
+        self._stats = {"leaders": 0, "coalesced": 0, "cross_process_coalesced": 0}
+        self._last_sweep = 0.0
+        if self.shared_dir and fcntl is not None:
+            os.makedirs(self.shared_dir, exist_ok=True)
+
+    def _incr(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def do(self, key: str, func, *args, **kwargs):
+        """
+        Chạy func(*args, **kwargs) một lần cho mỗi key đang in-flight.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self._stats["leaders"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = self._shared(key, lambda: func(*args, **kwargs))
+            return copy.deepcopy(call.result)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def ado(self, key: str, coro_func, *args, **kwargs):
+        """
+        Phiên bản async của do(); coro_func là hàm async.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            future = self._futures.get((loop, key))
+            leader = future is None
+            if leader:
+                future = loop.create_future()
+                self._futures[(loop, key)] = future
+                self._stats["leaders"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            try:
+                return copy.deepcopy(await asyncio.shield(future))
+            except asyncio.CancelledError:
+                # Lời gọi dẫn đầu bị huỷ (ví dụ lời gọi dự phòng của cascade),
+                # còn lời gọi này vẫn cần kết quả: chạy lại.
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+            return await self.ado(key, coro_func, *args, **kwargs)
+
+        try:
+            result = await self._ashared(key, lambda: coro_func(*args, **kwargs))
+            future.set_result(result)
+            return copy.deepcopy(result)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Tránh cảnh báo "exception never retrieved" khi không có ai chờ.
+            future.exception()
+            raise
+        finally:
+            with self._lock:
+                del self._futures[(loop, key)]
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        base = os.path.join(self.shared_dir, digest)
+        return f"{base}.lock", f"{base}.json"
+
+    def _read_result(self, path: str):
+        # Gọi khi đang giữ lock của key nên có thể xoá file hết hạn.
+        try:
+            if time.time() - os.path.getmtime(path) > self.result_ttl:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)["result"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_result(self, path: str, result) -> None:
+        # Không chia sẻ kết quả lỗi giữa các tiến trình.
+        if result is None or (isinstance(result, dict) and "error" in result):
+            return
+        try:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"result": result}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError) as e:
+            print(f"Lỗi ghi kết quả single-flight: {e}")
+
+    def _sweep(self) -> None:
+        """
+        Xoá file .json/.lock cũ hơn TTL của các key không còn được gọi lại
+        (_read_result chỉ dọn key được gọi lại). Chạy tối đa một lần mỗi TTL.
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < self.result_ttl:
+                return
+            self._last_sweep = now
+        try:
+            names = os.listdir(self.shared_dir)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(".lock"):
+                continue
+            lock_path = os.path.join(self.shared_dir, name)
+            result_path = lock_path[: -len(".lock")] + ".json"
+            try:
+                if now - os.path.getmtime(lock_path) <= self.result_ttl:
+                    continue
+                with open(lock_path, "a") as lock_file:
+                    # Bỏ qua key đang có tiến trình giữ lock.
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    try:
+                        if os.path.exists(result_path) and (
+                            now - os.path.getmtime(result_path) <= self.result_ttl
+                        ):
+                            continue
+                        if os.path.exists(result_path):
+                            os.remove(result_path)
+                        os.remove(lock_path)
+                    finally:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+            except OSError:
+                continue
+
+    def _shared(self, key: str, call):
+        if not self.shared_dir or fcntl is None:
+            return call()
+
+        lock_path, result_path = self._paths(key)
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                result = self._read_result(result_path)
+                if result is not None:
+                    self._incr("cross_process_coalesced")
+                    return result
+                result = call()
+                self._write_result(result_path, result)
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                self._sweep()
+
+    async def _ashared(self, key: str, call):
+        if not self.shared_dir or fcntl is None:
+            return await call()
+
+        lock_path, result_path = self._paths(key)
+        loop = asyncio.get_running_loop()
+        with open(lock_path, "a") as lock_file:
+            # flock chặn thread nên phải chờ lock trong thread pool.
+            await loop.run_in_executor(None, fcntl.flock, lock_file, fcntl.LOCK_EX)
+            try:
+                result = self._read_result(result_path)
+                if result is not None:
+                    self._incr("cross_process_coalesced")
+                    return result
+                result = await call()
+                self._write_result(result_path, result)
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                self._sweep()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+_flights: dict[str, SingleFlight] = {}
+_flights_lock = threading.Lock()
+
+
+def get_flight(name: str) -> SingleFlight:
+    """
+    SingleFlight dùng chung theo tên ("gemini", "tts"...), cấu hình qua AI_SINGLEFLIGHT_*
+    (không đặt AI_SINGLEFLIGHT_DIR thì chỉ gộp trong một tiến trình).
+    """
+    with _flights_lock:
+        flight = _flights.get(name)
+        if flight is None:
+            flight = SingleFlight(
+                name,
+                shared_dir=os.getenv("AI_SINGLEFLIGHT_DIR") or None,
+                result_ttl=float(os.getenv("AI_SINGLEFLIGHT_TTL", DEFAULT_RESULT_TTL)),
+            )
+            _flights[name] = flight
+        return flight
+
+
+def get_stats() -> dict:
+    with _flights_lock:
+        return {name: flight.stats() for name, flight in _flights.items()}
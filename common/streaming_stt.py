@@ -0,0 +1,219 @@
+"""
+Nhận dạng giọng nói dạng stream với Cloud STT (streaming_recognize).
+
+Audio được gửi lên theo từng đoạn ngay khi thu (không cần chờ đủ file); kết quả
+trả về dần gồm bản tạm (interim, có thể còn đổi) và bản chốt (is_final) kèm
+thời điểm bắt đầu/kết thúc của từng từ. Audio gửi dạng LINEAR16 mono.
+
+Mỗi stream của Cloud STT chỉ nhận khoảng 5 phút audio: sau MAX_STREAM_SECONDS
+audio, stream hiện tại được đóng (lấy nốt kết quả chốt) và mở stream mới cho
+phần còn lại; thời điểm trong kết quả vẫn tính từ đầu bản ghi. Từ nằm đúng
+chỗ chuyển stream có thể bị tách đôi. Số stream đồng thời được giới hạn riêng
+(limit("speech_stream")), không tính vào giới hạn request unary.
+"""
+
+import asyncio
+import queue
+from typing import AsyncIterable, Iterable, Iterator
+
+import numpy as np
+from google.cloud import speech
+
+from common import telemetry
+from common.audio import (
+    DEFAULT_SAMPLE_RATE,
+    downmix,
+    map_file,
+    parse_wav,
+    resample,
+    to_pcm16,
+)
+from common.cloud_clients import get_speech_client, limit
+from common.concurrency import run_in_thread
+
+# Mỗi message audio của stream tối đa 25 KB.
+MAX_CHUNK_BYTES = 25 * 1024
+DEFAULT_CHUNK_SECONDS = 0.1
+# Giới hạn của Cloud STT là ~305 giây audio mỗi stream; chừa lại một khoảng.
+MAX_STREAM_SECONDS = 290
+
+
+def streaming_config(
+    sample_rate: int = DEFAULT_SAMPLE_RATE,
+    language_code: str = "en-US",
+    interim_results: bool = True,
+    single_utterance: bool = False,
+) -> speech.StreamingRecognitionConfig:
+    return speech.StreamingRecognitionConfig(
+        config=speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+            sample_rate_hertz=sample_rate,
+            language_code=language_code,
+            enable_automatic_punctuation=True,
+            enable_word_time_offsets=True,
+            enable_word_confidence=True,
+        ),
+        interim_results=interim_results,
+        single_utterance=single_utterance,
+    )
+
+
+def _seconds(offset) -> float:
+    return round(offset.total_seconds(), 3) if offset is not None else 0.0
+
+
+def _result_event(result, offset: float = 0.0) -> dict:
+    # offset: số giây audio đã gửi ở các stream trước.
+    alternative = result.alternatives[0]
+    return {
+        "is_final": result.is_final,
+        "transcript": alternative.transcript,
+        "confidence": alternative.confidence,
+        "stability": result.stability,
+        "end_time": round(offset + _seconds(result.result_end_time), 3),
+        "words": [
+            {
+                "word": word.word,
+                "start": round(offset + _seconds(word.start_time), 3),
+                "end": round(offset + _seconds(word.end_time), 3),
+                "confidence": word.confidence,
+            }
+            for word in alternative.words
+        ],
+    }
+
+
+def stream_transcribe(
+    chunks: Iterable[bytes],
+    sample_rate: int = DEFAULT_SAMPLE_RATE,
+    language_code: str = "en-US",
+    interim_results: bool = True,
+    single_utterance: bool = False,
+) -> Iterator[dict]:
+    """
+    Gửi các đoạn audio LINEAR16 mono (bytes, không có header WAV) lên STT và
+    yield từng kết quả dạng dict: is_final, transcript, confidence, stability,
+    end_time và words (word, start, end, confidence; chỉ có ở bản chốt).
+    Lỗi được yield dạng {"error": ...} rồi kết thúc.
+    """
+    sent = 0
+    stream_bytes = int(MAX_STREAM_SECONDS * sample_rate) * 2
+
+    def pieces():
+        for chunk in chunks:
+            for start in range(0, len(chunk), MAX_CHUNK_BYTES):
+                yield chunk[start : start + MAX_CHUNK_BYTES]
+
+    source = pieces()
+    pending = None
+
+    def requests(limit_bytes: int):
+        # Gửi tới khi hết audio hoặc đủ limit_bytes; mảnh vượt quá để dành cho
+        # stream sau.
+        nonlocal sent, pending
+        count = 0
+        while True:
+            piece = pending if pending is not None else next(source, None)
+            pending = None
+            if piece is None:
+                return
+            if count and count + len(piece) > limit_bytes:
+                pending = piece
+                return
+            count += len(piece)
+            sent += len(piece)
+            yield speech.StreamingRecognizeRequest(audio_content=bytes(piece))
+
+    config = streaming_config(
+        sample_rate, language_code, interim_results, single_utterance
+    )
+    responses = None
+    try:
+        with telemetry.span(
+            "speech.streaming_recognize", "google-cloud-speech", current=False
+        ) as span, limit("speech_stream"):
+            while True:
+                offset = sent / (sample_rate * 2)
+                responses = get_speech_client().streaming_recognize(
+                    config=config, requests=requests(stream_bytes)
+                )
+                for response in responses:
+                    for result in response.results:
+                        if result.alternatives:
+                            yield _result_event(result, offset)
+                responses = None
+                if single_utterance or pending is None:
+                    break
+            span.set(request_bytes=sent, audio_seconds=sent / (sample_rate * 2))
+
+    except Exception as e:
+        print(f"Lỗi STT stream: {e}")
+        yield {"error": f"Không thể nhận dạng giọng nói: {str(e)}"}
+
+    finally:
+        # Người gọi dừng giữa chừng: huỷ stream để giải phóng kết nối.
+        if responses is not None:
+            responses.cancel()
+
+
+async def astream_transcribe(
+    chunks: AsyncIterable[bytes],
+    sample_rate: int = DEFAULT_SAMPLE_RATE,
+    language_code: str = "en-US",
+    interim_results: bool = True,
+    single_utterance: bool = False,
+):
+    """
+    Phiên bản async của stream_transcribe(): nhận audio từ async iterator
+    (ví dụ websocket), stream gRPC chạy trong thread pool.
+    """
+    loop = asyncio.get_running_loop()
+    inbox: queue.Queue = queue.Queue()
+    outbox: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    def worker():
+        try:
+            for event in stream_transcribe(
+                iter(inbox.get, None),
+                sample_rate,
+                language_code,
+                interim_results,
+                single_utterance,
+            ):
+                loop.call_soon_threadsafe(outbox.put_nowait, event)
+        finally:
+            loop.call_soon_threadsafe(outbox.put_nowait, done)
+
+    async def pump():
+        try:
+            async for chunk in chunks:
+                inbox.put(chunk)
+        finally:
+            inbox.put(None)
+
+    pump_task = asyncio.create_task(pump())
+    worker_task = asyncio.ensure_future(run_in_thread(worker))
+    try:
+        while (event := await outbox.get()) is not done:
+            yield event
+    finally:
+        pump_task.cancel()
+        inbox.put(None)
+        await worker_task
+
+
+def file_chunks(
+    path: str,
+    sample_rate: int = DEFAULT_SAMPLE_RATE,
+    chunk_seconds: float = DEFAULT_CHUNK_SECONDS,
+) -> Iterator[bytes]:
+    """
+    Chia file WAV thành các đoạn LINEAR16 mono cho stream_transcribe(), dùng
+    để thử hoặc phát lại bản ghi như đang thu trực tiếp.
+    """
+    samples, source_rate = parse_wav(map_file(path))
+    pcm = to_pcm16(resample(downmix(samples), source_rate, sample_rate))
+    step = max(1, int(sample_rate * chunk_seconds))
+    for start in range(0, len(pcm), step):
+        yield np.ascontiguousarray(pcm[start : start + step]).tobytes()
@@ -0,0 +1,438 @@
+"""
+Telemetry cho mọi lời gọi provider (Gemini, Cloud STT/TTS, Together, Freepik,
+Clipdrop, Imagen): thời gian từng giai đoạn, token (usage_metadata), số byte
+gửi/nhận và chi phí ước tính.
+
+Bật bằng AI_TELEMETRY=1. Khi tắt, span() trả về một đối tượng rỗng dùng chung
+nên gần như không tốn chi phí. Dữ liệu xuất ra:
+  - export_prometheus(): text format của Prometheus
+  - export_spans(): danh sách span theo cấu trúc OpenTelemetry (OTLP JSON)
+  - AI_TELEMETRY_PROM_FILE / AI_TELEMETRY_SPANS_FILE: ghi ra file khi tiến trình kết thúc
+"""
+
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+
+# Giá niêm yết tham khảo (USD), chỉ dùng để ước tính; cập nhật khi bảng giá thay đổi.
+TOKEN_PRICES = {
+    # model: (USD / 1M token input, USD / 1M token output)
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-2.0-flash-preview-image-generation": (0.10, 0.40),
+}
+UNIT_PRICES = {
+    # (provider, đơn vị): USD / đơn vị
+    ("google-cloud-tts", "characters"): 16.0 / 1_000_000,
+    ("google-cloud-speech", "audio_seconds"): 0.024 / 60,
+    ("together", "images"): 0.0027,
+    ("freepik", "images"): 0.005,
+    ("clipdrop", "images"): 0.02,
+    ("imagen", "images"): 0.04,
+}
+# Model miễn phí: vẫn ghi số ảnh nhưng không tính chi phí.
+FREE_MODELS = {"black-forest-labs/FLUX.1-schnell-Free"}
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MAX_SPANS = 2000
+
+_enabled: bool | None = None
+_current: contextvars.ContextVar = contextvars.ContextVar("ai_span", default=None)
+_lock = threading.Lock()
+_spans: deque = deque(maxlen=MAX_SPANS)
+_counters: dict[tuple, float] = {}
+_histograms: dict[tuple, list] = {}
+
+
+def enabled() -> bool:
+    global _enabled
+    if _enabled is None:
+        _enabled = os.getenv("AI_TELEMETRY", "0") == "1"
+        if _enabled:
+            atexit.register(_flush_files)
+    return _enabled
+
+
+def _labels(**labels) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _incr(name: str, value: float, **labels) -> None:
+    key = (name, _labels(**labels))
+    _counters[key] = _counters.get(key, 0.0) + value
+
+
+def _observe(name: str, value: float, **labels) -> None:
+    key = (name, _labels(**labels))
+    histogram = _histograms.setdefault(key, [0] * len(LATENCY_BUCKETS) + [0, 0.0])
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if value <= bound:
+            histogram[index] += 1
+    histogram[-2] += 1
+    histogram[-1] += value
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def set_model(self, model: str) -> None:
+        pass
+
+    def stage(self, name: str):
+        return self
+
+    def record_usage(self, usage_metadata) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    def __init__(
+        self,
+        name: str,
+        provider: str,
+        model: str | None,
+        attributes,
+        local: bool = False,
+        current: bool = True,
+    ):
+        self.name = name
+        self.provider = provider
+        self.model = model
+        # Span cục bộ (đọc file, dựng prompt) chỉ ghi ai_stage_seconds; khi đó
+        # provider là mã feature.
+        self.local = local
+        # Span bao quanh generator không được đặt làm span hiện tại vì context
+        # có thể đổi giữa các lần yield.
+        self.current = current
+        key = "feature" if local else "provider"
+        self.attributes = {key: provider, **attributes}
+        if model:
+            self.attributes["model"] = model
+        self.events = []
+        self.status = "ok"
+        self.parent = None
+        self._token = None
+
+    def __enter__(self):
+        self.parent = _current.get()
+        self.trace_id = self.parent.trace_id if self.parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        if self.current:
+            self._token = _current.set(self)
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        self.end_ns = time.time_ns()
+        if self._token is not None:
+            _current.reset(self._token)
+        if exc is not None:
+            self.status = "error"
+            self.attributes["error.type"] = exc_type.__name__
+        self._finish(duration)
+        return False
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def set_model(self, model: str) -> None:
+        """
+        Model thực sự trả lời (model dự phòng); chi phí và nhãn metric tính theo
+        model này, model yêu cầu ban đầu giữ trong requested_model.
+        """
+        if model == self.model:
+            return
+        self.attributes["requested_model"] = self.model
+        self.attributes["model"] = model
+        self.model = model
+
+    def stage(self, name: str):
+        """
+        Đo thời gian một giai đoạn bên trong span, ví dụ "network" hoặc "parse".
+        """
+        return _Stage(self, name)
+
+    def record_usage(self, usage_metadata) -> None:
+        if usage_metadata is None:
+            return
+        self.set(
+            input_tokens=usage_metadata.prompt_token_count or 0,
+            output_tokens=usage_metadata.candidates_token_count or 0,
+            cached_tokens=usage_metadata.cached_content_token_count or 0,
+        )
+
+    def _cost(self) -> float:
+        attributes = self.attributes
+        cost = 0.0
+        if self.model in FREE_MODELS:
+            return cost
+        if self.model in TOKEN_PRICES:
+            input_price, output_price = TOKEN_PRICES[self.model]
+            cost += attributes.get("input_tokens", 0) * input_price / 1e6
+            cost += attributes.get("output_tokens", 0) * output_price / 1e6
+        for (provider, unit), price in UNIT_PRICES.items():
+            if provider == self.provider and unit in attributes:
+                cost += attributes[unit] * price
+        return cost
+
+    def _finish(self, duration: float) -> None:
+        cost = self._cost()
+        if cost:
+            self.attributes["cost_usd"] = round(cost, 8)
+        labels = {"provider": self.provider, "model": self.model}
+        with _lock:
+            _spans.append(self._to_otel())
+            if self.local:
+                _observe(
+                    "ai_stage_seconds", duration, feature=self.provider, stage=self.name
+                )
+                return
+            _incr(
+                "ai_provider_calls_total",
+                1,
+                operation=self.name,
+                status=self.status,
+                **labels,
+            )
+            _observe(
+                "ai_provider_latency_seconds", duration, operation=self.name, **labels
+            )
+            for key in ("input_tokens", "output_tokens", "cached_tokens"):
+                if self.attributes.get(key):
+                    _incr(
+                        "ai_tokens_total", self.attributes[key], type=key[:-7], **labels
+                    )
+            for key in ("request_bytes", "response_bytes"):
+                if self.attributes.get(key):
+                    _incr(
+                        "ai_payload_bytes_total",
+                        self.attributes[key],
+                        direction=key[:-6],
+                        **labels,
+                    )
+            if cost:
+                _incr("ai_cost_usd_total", cost, **labels)
+
+    def _to_otel(self) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent.span_id if self.parent else "",
+            "name": self.name,
+            "kind": "SPAN_KIND_INTERNAL" if self.local else "SPAN_KIND_CLIENT",
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": [
+                {"key": key, "value": _otel_value(value)}
+                for key, value in self.attributes.items()
+            ],
+            "events": self.events,
+            "status": {
+                "code": (
+                    "STATUS_CODE_ERROR" if self.status == "error" else "STATUS_CODE_OK"
+                )
+            },
+        }
+
+
+class _Stage:
+    def __init__(self, span: Span, name: str):
+        self.span = span
+        self.name = name
+
+    def __enter__(self):
+        self._start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self._start
+        self.span.events.append(
+            {
+                "name": self.name,
+                "timeUnixNano": self._start_ns,
+                "attributes": [
+                    {"key": "duration_seconds", "value": {"doubleValue": duration}}
+                ],
+            }
+        )
+        with _lock:
+            _observe(
+                "ai_stage_seconds",
+                duration,
+                provider=self.span.provider,
+                operation=self.span.name,
+                stage=self.name,
+            )
+        return False
+
+
+def _otel_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": value}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def span(
+    name: str,
+    provider: str,
+    model: str | None = None,
+    current: bool = True,
+    **attributes,
+):
+    """
+    Mở span cho một lời gọi provider; dùng với `with ... as span:`.
+    current=False cho span bao quanh generator/stream.
+    """
+    if not enabled():
+        return _NOOP
+    return Span(name, provider, model, attributes, current=current)
+
+
+def stage(name: str):
+    """
+    Đo một giai đoạn trong span đang mở (ví dụ tách code fence, json.loads).
+    """
+    if not enabled():
+        return _NOOP
+    current = _current.get()
+    return current.stage(name) if current else _NOOP
+
+
+def _local(name: str, feature: str):
+    if not enabled():
+        return _NOOP
+    current = _current.get()
+    if current is not None:
+        return current.stage(name)
+    return Span(name, provider=feature, model=None, attributes={}, local=True)
+
+
+def timed(name: str, feature: str):
+    """
+    Decorator đo thời gian một bước cục bộ của feature (ví dụ _build_contents:
+    đọc file audio và dựng prompt). Nằm trong span đang mở thì ghi thành giai
+    đoạn của span đó, nếu không thì thành span riêng.
+    """
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with _local(name, feature):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _local(name, feature):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def payload_bytes(contents) -> int:
+    """
+    Ước lượng kích thước payload của contents (text UTF-8 + dữ liệu nhị phân).
+    """
+    if isinstance(contents, str):
+        return len(contents.encode("utf-8"))
+    if isinstance(contents, (bytes, bytearray, memoryview)):
+        return len(contents)
+    if isinstance(contents, dict):
+        return sum(payload_bytes(value) for value in contents.values())
+    if isinstance(contents, (list, tuple)):
+        return sum(payload_bytes(value) for value in contents)
+    return 0
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    body = ",".join(f'{key}="{_escape(value)}"' for key, value in items)
+    return "{" + body + "}"
+
+
+def export_prometheus() -> str:
+    """
+    Toàn bộ counter/histogram ở text format của Prometheus.
+    """
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, list(value)) for key, value in _histograms.items())
+    seen = set()
+    for (name, labels), value in counters:
+        if name not in seen:
+            lines.append(f"# TYPE {name} counter")
+            seen.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), histogram in histograms:
+        if name not in seen:
+            lines.append(f"# TYPE {name} histogram")
+            seen.add(name)
+        for bound, count in zip(LATENCY_BUCKETS, histogram):
+            lines.append(
+                f"{name}_bucket{_format_labels(labels, (('le', str(bound)),))} {count}"
+            )
+        lines.append(
+            f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {histogram[-2]}"
+        )
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram[-2]}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def export_spans(clear: bool = False) -> list[dict]:
+    """
+    Các span đã kết thúc gần đây (tối đa MAX_SPANS), theo cấu trúc OTLP JSON.
+    """
+    with _lock:
+        spans = list(_spans)
+        if clear:
+            _spans.clear()
+    return spans
+
+
+def _flush_files() -> None:
+    prom_path = os.getenv("AI_TELEMETRY_PROM_FILE")
+    if prom_path:
+        with open(prom_path, "w", encoding="utf-8") as f:
+            f.write(export_prometheus())
+    spans_path = os.getenv("AI_TELEMETRY_SPANS_FILE")
+    if spans_path:
+        with open(spans_path, "a", encoding="utf-8") as f:
+            for item in export_spans(clear=True):
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
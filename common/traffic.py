@@ -0,0 +1,588 @@
+"""
+Ghi lại và phát lại traffic tới provider (Gemini, Cloud Speech/TTS, các API ảnh)
+để tái hiện vấn đề hiệu năng offline.
+
+AI_TRAFFIC_MODE=record: mọi request/response đi qua client dùng chung được ghi
+vào AI_TRAFFIC_DIR (mặc định ./traffic):
+  - tape.jsonl: mỗi dòng một cặp request/response kèm độ trễ gốc
+  - blobs/<sha256>: audio/ảnh (chuỗi base64 lớn, bytes) lưu một lần theo hash
+AI_TRAFFIC_MODE=replay: trả lại response đã ghi cho request giống hệt, không
+mở kết nối mạng. AI_TRAFFIC_REPLAY_SPEED=1 giữ nguyên độ trễ gốc, 0 trả ngay
+(nhanh nhất có thể), 0.5 nhanh gấp đôi...
+
+Điểm gắn: httpx transport (client Gemini trong common/gemini_client.py), gRPC
+interceptor (common/cloud_clients.py) và requests_session() cho các script
+gọi REST trực tiếp.
+"""
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import importlib
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import grpc
+import httpx
+
+RECORD = "record"
+REPLAY = "replay"
+DEFAULT_DIR = "traffic"
+# Chuỗi base64 dài hơn ngưỡng này (audio, ảnh) được tách ra blobs/.
+BLOB_MIN_CHARS = 1024
+# Trường thay đổi giữa các lần chạy, không dùng để so khớp request.
+VOLATILE_FIELDS = {"cachedContent"}
+REPLAY_TARGET = "replay.invalid:443"
+
+_BASE64 = re.compile(r"^[A-Za-z0-9+/_-]+={0,2}$")
+
+
+class ReplayMissError(LookupError):
+    pass
+
+
+class _ReplayRpcError(grpc.RpcError):
+    """
+    Lỗi gRPC đã ghi lại; có code()/details() để google.api_core chuyển thành
+    exception tương ứng như khi gọi thật.
+    """
+
+    def __init__(self, code: str, details: str):
+        super().__init__(details)
+        self._code = grpc.StatusCode[code]
+        self._details = details
+
+    def code(self):
+        return self._code
+
+    def details(self):
+        return self._details
+
+    def trailing_metadata(self):
+        return None
+
+    def initial_metadata(self):
+        return None
+
+
+class Tape:
+    def __init__(self, directory: str, speed: float = 1.0):
+        self.directory = directory
+        self.speed = speed
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.path = os.path.join(directory, "tape.jsonl")
+        self._lock = threading.Lock()
+        self._entries: dict[str, deque] | None = None
+        self._started = time.time()
+        self._stats = {"recorded": 0, "replayed": 0, "misses": 0, "blobs": 0}
+
+    # --- blob ---
+
+    def put_blob(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.blob_dir, digest)
+        if not os.path.exists(path):
+            os.makedirs(self.blob_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._stats["blobs"] += 1
+        return digest
+
+    def get_blob(self, digest: str) -> bytes:
+        with open(os.path.join(self.blob_dir, digest), "rb") as f:
+            return f.read()
+
+    def externalize(self, value, store: bool = True):
+        """
+        Thay chuỗi base64 lớn bằng {"$blob": sha256}; store=False chỉ tính hash
+        (dùng để tạo key so khớp).
+        """
+        if isinstance(value, dict):
+            return {
+                key: self.externalize(item, store)
+                for key, item in value.items()
+                if not (not store and key in VOLATILE_FIELDS)
+            }
+        if isinstance(value, list):
+            return [self.externalize(item, store) for item in value]
+        if (
+            isinstance(value, str)
+            and len(value) >= BLOB_MIN_CHARS
+            and _BASE64.match(value)
+        ):
+            try:
+                data = base64.b64decode(value + "=" * (-len(value) % 4), b"-_")
+            except (binascii.Error, ValueError):
+                return value
+            if store:
+                return {"$blob": self.put_blob(data), "$encoding": "base64"}
+            return {"$blob": hashlib.sha256(data).hexdigest()}
+        return value
+
+    def internalize(self, value):
+        if isinstance(value, dict):
+            if "$blob" in value:
+                return base64.b64encode(self.get_blob(value["$blob"])).decode("ascii")
+            return {key: self.internalize(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.internalize(item) for item in value]
+        return value
+
+    # --- body ---
+
+    def encode_body(self, body: bytes, content_type: str | None = ""):
+        if not body:
+            return {"empty": True}
+        if "json" in (content_type or ""):
+            try:
+                return {"json": self.externalize(json.loads(body))}
+            except ValueError:
+                pass
+        if (content_type or "").startswith("text/"):
+            return {"text": body.decode("utf-8", "replace")}
+        return {"$blob": self.put_blob(body)}
+
+    def decode_body(self, encoded: dict) -> bytes:
+        if "json" in encoded:
+            return json.dumps(self.internalize(encoded["json"])).encode("utf-8")
+        if "text" in encoded:
+            return encoded["text"].encode("utf-8")
+        if "$blob" in encoded:
+            return self.get_blob(encoded["$blob"])
+        return b""
+
+    def key(self, service: str, method: str, body) -> str:
+        """
+        Key so khớp request: service, method và body đã chuẩn hoá (không gồm
+        header, API key hay trường thay đổi theo lần chạy).
+        """
+        if isinstance(body, (bytes, bytearray)):
+            try:
+                body = self.externalize(json.loads(body), store=False)
+            except ValueError:
+                body = hashlib.sha256(body).hexdigest()
+        else:
+            body = self.externalize(body, store=False)
+        canonical = json.dumps([service, method, body], sort_keys=True)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    # --- tape ---
+
+    def record(self, key: str, service: str, method: str, **entry) -> None:
+        line = {
+            "key": key,
+            "service": service,
+            "method": method,
+            "offset": round(time.time() - self._started, 6),
+            **entry,
+        }
+        data = json.dumps(line, ensure_ascii=False)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data + "\n")
+            self._stats["recorded"] += 1
+
+    def _load(self) -> dict[str, deque]:
+        entries: dict[str, deque] = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        entries.setdefault(entry["key"], deque()).append(entry)
+        return entries
+
+    def lookup(self, key: str, method: str) -> dict:
+        """
+        Lấy response đã ghi theo thứ tự ghi; hết bản ghi thì dùng lại bản cuối.
+        """
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            queue = self._entries.get(key)
+            if not queue:
+                self._stats["misses"] += 1
+                raise ReplayMissError(f"Không có bản ghi traffic cho {method}.")
+            self._stats["replayed"] += 1
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def wait(self, entry: dict) -> float:
+        return entry.get("latency", 0.0) * self.speed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+_tape: Tape | None = None
+_mode: str | None = None
+_tape_lock = threading.Lock()
+
+
+def mode() -> str:
+    """
+    "record", "replay" hoặc "" (tắt), đọc từ AI_TRAFFIC_MODE một lần.
+    """
+    global _mode
+    if _mode is None:
+        _mode = os.getenv("AI_TRAFFIC_MODE", "").lower()
+        if _mode not in (RECORD, REPLAY):
+            _mode = ""
+    return _mode
+
+
+def replaying() -> bool:
+    return mode() == REPLAY
+
+
+def get_tape() -> Tape:
+    global _tape
+    with _tape_lock:
+        if _tape is None:
+            _tape = Tape(
+                os.getenv("AI_TRAFFIC_DIR", DEFAULT_DIR),
+                speed=float(os.getenv("AI_TRAFFIC_REPLAY_SPEED", 1.0)),
+            )
+        return _tape
+
+
+def _method(request_method: str, url: str) -> str:
+    # Bỏ query string (có thể chứa API key) và host.
+    return f"{request_method} {urlsplit(url).path}"
+
+
+def _strip_headers(headers) -> dict:
+    # Body đã được giải nén khi ghi nên bỏ các header mô tả cách mã hoá cũ.
+    skip = {"content-encoding", "content-length", "transfer-encoding"}
+    return {key: value for key, value in headers.items() if key.lower() not in skip}
+
+
+# --- httpx (Gemini) ---
+
+
+def _httpx_key(tape: Tape, service: str, request: httpx.Request):
+    method = _method(request.method, str(request.url))
+    return tape.key(service, method, request.content), method
+
+
+def _httpx_replay(tape: Tape, service: str, request: httpx.Request):
+    key, method = _httpx_key(tape, service, request)
+    entry = tape.lookup(key, method)
+    return entry, httpx.Response(
+        entry["status"],
+        headers=entry["headers"],
+        content=tape.decode_body(entry["response"]),
+        request=request,
+    )
+
+
+def _httpx_record(tape, service, request, response, body, start, first_byte):
+    key, method = _httpx_key(tape, service, request)
+    tape.record(
+        key,
+        service,
+        method,
+        request=tape.encode_body(request.content, request.headers.get("content-type")),
+        status=response.status_code,
+        headers=_strip_headers(response.headers),
+        response=tape.encode_body(body, response.headers.get("content-type")),
+        first_byte=round(first_byte - start, 6),
+        latency=round(time.perf_counter() - start, 6),
+    )
+    return httpx.Response(
+        response.status_code,
+        headers=_strip_headers(response.headers),
+        content=body,
+        request=request,
+    )
+
+
+class HttpxTransport(httpx.BaseTransport):
+    """
+    Transport httpx bọc transport thật: ghi lại (record) hoặc trả response đã
+    ghi (replay, không dùng transport thật).
+    """
+
+    def __init__(self, transport: httpx.BaseTransport, service: str = "gemini"):
+        self._transport = transport
+        self.service = service
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        tape = get_tape()
+        request.read()
+        if replaying():
+            entry, response = _httpx_replay(tape, self.service, request)
+            time.sleep(tape.wait(entry))
+            return response
+
+        start = time.perf_counter()
+        response = self._transport.handle_request(request)
+        # Đọc hết body (kể cả stream) để ghi; response trả về là bản đã đọc.
+        chunks, first_byte = [], None
+        try:
+            for chunk in response.iter_bytes():
+                first_byte = first_byte or time.perf_counter()
+                chunks.append(chunk)
+        finally:
+            response.close()
+        return _httpx_record(
+            tape,
+            self.service,
+            request,
+            response,
+            b"".join(chunks),
+            start,
+            first_byte or time.perf_counter(),
+        )
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class AsyncHttpxTransport(httpx.AsyncBaseTransport):
+    """
+    Phiên bản async của HttpxTransport.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, service: str = "gemini"):
+        self._transport = transport
+        self.service = service
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        tape = get_tape()
+        await request.aread()
+        if replaying():
+            entry, response = _httpx_replay(tape, self.service, request)
+            await asyncio.sleep(tape.wait(entry))
+            return response
+
+        start = time.perf_counter()
+        response = await self._transport.handle_async_request(request)
+        chunks, first_byte = [], None
+        try:
+            async for chunk in response.aiter_bytes():
+                first_byte = first_byte or time.perf_counter()
+                chunks.append(chunk)
+        finally:
+            await response.aclose()
+        return _httpx_record(
+            tape,
+            self.service,
+            request,
+            response,
+            b"".join(chunks),
+            start,
+            first_byte or time.perf_counter(),
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+# --- gRPC (Cloud Speech/TTS) ---
+
+
+def _message_json(message) -> dict:
+    return json.loads(type(message).to_json(message))
+
+
+def _message_type(message) -> str:
+    cls = type(message)
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+
+def _load_type(path: str):
+    module, _, name = path.partition(":")
+    value = importlib.import_module(module)
+    for part in name.split("."):
+        value = getattr(value, part)
+    return value
+
+
+class _ReplayCall:
+    def __init__(self, response):
+        self._response = response
+
+    def result(self, timeout=None):
+        return self._response
+
+    def exception(self, timeout=None):
+        return None
+
+    def traceback(self, timeout=None):
+        return None
+
+    def done(self):
+        return True
+
+    def cancelled(self):
+        return False
+
+    def running(self):
+        return False
+
+    def cancel(self):
+        return False
+
+    def add_done_callback(self, fn):
+        fn(self)
+
+    def code(self):
+        return grpc.StatusCode.OK
+
+    def details(self):
+        return ""
+
+    def initial_metadata(self):
+        return ()
+
+    def trailing_metadata(self):
+        return ()
+
+    def is_active(self):
+        return False
+
+    def time_remaining(self):
+        return None
+
+    def add_callback(self, callback):
+        return False
+
+
+class GrpcInterceptor(grpc.UnaryUnaryClientInterceptor):
+    def __init__(self, service: str):
+        self.service = service
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        tape = get_tape()
+        method = client_call_details.method
+        if isinstance(method, bytes):
+            method = method.decode("ascii")
+        request_json = _message_json(request)
+        key = tape.key(self.service, method, request_json)
+
+        if replaying():
+            entry = tape.lookup(key, method)
+            time.sleep(tape.wait(entry))
+            if "error" in entry:
+                raise _ReplayRpcError(entry["error"]["code"], entry["error"]["details"])
+            response_type = _load_type(entry["response_type"])
+            response = response_type.from_json(
+                json.dumps(tape.internalize(entry["response"])),
+                ignore_unknown_fields=True,
+            )
+            return _ReplayCall(response)
+
+        start = time.perf_counter()
+        outcome = continuation(client_call_details, request)
+        try:
+            response = outcome.result()
+        except grpc.RpcError as e:
+            tape.record(
+                key,
+                self.service,
+                method,
+                request=tape.externalize(request_json),
+                error={"code": e.code().name, "details": e.details()},
+                latency=round(time.perf_counter() - start, 6),
+            )
+            raise
+        tape.record(
+            key,
+            self.service,
+            method,
+            request=tape.externalize(request_json),
+            response_type=_message_type(response),
+            response=tape.externalize(_message_json(response)),
+            latency=round(time.perf_counter() - start, 6),
+        )
+        return outcome
+
+
+def intercept_channel(channel: grpc.Channel, service: str) -> grpc.Channel:
+    """
+    Gắn interceptor record/replay vào channel; trả lại channel gốc khi tắt.
+    """
+    if not mode():
+        return channel
+    return grpc.intercept_channel(channel, GrpcInterceptor(service))
+
+
+# --- requests (script gọi REST trực tiếp: Clipdrop, Freepik...) ---
+
+
+def _requests_body(request) -> bytes:
+    body = request.body or b""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    # Boundary multipart sinh ngẫu nhiên mỗi lần gọi, thay bằng giá trị cố định.
+    match = re.search(r"boundary=([^;\s]+)", request.headers.get("Content-Type", ""))
+    if match:
+        body = body.replace(match.group(1).encode("ascii"), b"BOUNDARY")
+    return body
+
+
+def requests_session(service: str):
+    """
+    requests.Session gắn adapter record/replay theo AI_TRAFFIC_MODE; khi tắt
+    là Session bình thường.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.structures import CaseInsensitiveDict
+
+    class Adapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            tape = get_tape()
+            method = _method(request.method, request.url)
+            body = _requests_body(request)
+            key = tape.key(service, method, body)
+            if replaying():
+                entry = tape.lookup(key, method)
+                time.sleep(tape.wait(entry))
+                response = requests.Response()
+                response.status_code = entry["status"]
+                response.headers = CaseInsensitiveDict(entry["headers"])
+                response._content = tape.decode_body(entry["response"])
+                response.url = request.url
+                response.request = request
+                return response
+
+            start = time.perf_counter()
+            response = super().send(request, **kwargs)
+            content_type = response.headers.get("Content-Type")
+            tape.record(
+                key,
+                service,
+                method,
+                request=tape.encode_body(body, request.headers.get("Content-Type")),
+                status=response.status_code,
+                headers=_strip_headers(response.headers),
+                response=tape.encode_body(response.content, content_type),
+                latency=round(time.perf_counter() - start, 6),
+            )
+            return response
+
+    session = requests.Session()
+    if mode():
+        adapter = Adapter()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+    return session
+
+
+def get_stats() -> dict:
+    """
+    Số request đã ghi/phát lại, số lần không tìm thấy bản ghi và số blob mới.
+    """
+    return get_tape().stats() if mode() else {}
@@ -0,0 +1,260 @@
+"""
+Chỉ gửi cho Gemini những đoạn audio có vấn đề, dựa trên độ tin cậy từng từ.
+
+Cloud STT (enable_word_time_offsets + enable_word_confidence) cho thời điểm và
+độ tin cậy của từng từ. Từ có confidence < AI_WORD_CONFIDENCE_THRESHOLD được
+cắt ra kèm AI_WORD_MARGIN_SECONDS mỗi bên (các đoạn chồng nhau được gộp), rồi
+gửi cho Gemini cùng phần văn bản mẫu tương ứng và những gì STT nghe được; phần
+còn lại chỉ gửi dạng text. Số token audio giảm theo thời lượng các đoạn bỏ đi
+(get_stats()).
+
+Chỉ dùng cho nhận xét theo từng từ: Gemini không nghe cả bản ghi nên không
+đánh giá được các trường của cả câu (ngữ điệu, điểm tổng của một câu dài).
+Transcript của cả bản ghi lấy từ STT (with_transcript()). Feature cần nhận xét
+cấp câu (như 24) gửi cả bản ghi.
+
+Cả bản ghi (đã tiền xử lý, xem common.audio) vẫn được gửi khi STT lỗi, không
+có từ đáng ngờ, hoặc các đoạn cắt dài hơn MAX_SLICED_RATIO thời lượng bản đó.
+AI_WORD_SLICES=0 tắt cắt đoạn.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from difflib import SequenceMatcher
+
+from common.audio import (
+    AUDIO_TOKENS_PER_SECOND,
+    ENCODINGS,
+    encode,
+    pause_note,
+    prepare_file,
+)
+from common.file_uploads import default_uploads
+from common.long_stt import load_samples, transcribe_long
+from common.singleflight import get_flight
+
+DEFAULT_CONFIDENCE_THRESHOLD = 0.8
+DEFAULT_MARGIN_SECONDS = 0.15
+# Cắt xong mà vẫn còn quá nửa bản ghi thì gửi cả bản ghi cho đủ ngữ cảnh.
+MAX_SLICED_RATIO = 0.5
+CACHE_SIZE = 16
+
+_lock = threading.Lock()
+_cache: OrderedDict = OrderedDict()
+_stats = {
+    "analyses": 0,
+    "sliced": 0,
+    "full_seconds": 0.0,
+    "sent_seconds": 0.0,
+}
+
+
+def _normalize(word: str) -> str:
+    return "".join(re.findall(r"[a-z0-9']+", word.lower()))
+
+
+def recognize_words(path: str, language_code: str = "en-US") -> dict:
+    """
+    transcribe_long() có cache theo file (đường dẫn, kích thước, mtime), để STT
+    chỉ chạy một lần dù cascade phân tích lại cùng bản ghi. Các lời gọi cùng
+    file đang chạy đồng thời (tầng rẻ và tầng dự phòng của cascade, nhiều
+    request cùng bản ghi) dùng chung một lần gọi STT.
+    """
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns, language_code)
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    result = get_flight("stt").do(
+        "\n".join(map(str, key)), transcribe_long, path, language_code
+    )
+    with _lock:
+        _cache[key] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def align(heard: list[str], expected: list[str]) -> tuple[list[int | None], list[int]]:
+    """
+    Căn các từ nghe được với câu mẫu: chỉ số từ mẫu tương ứng với mỗi từ nghe
+    được (None nếu là từ thừa) và các chỉ số từ mẫu không nghe thấy.
+    """
+    matcher = SequenceMatcher(
+        a=[_normalize(word) for word in heard],
+        b=[_normalize(word) for word in expected],
+        autojunk=False,
+    )
+    mapping: list[int | None] = [None] * len(heard)
+    skipped = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag in ("equal", "replace"):
+            # Từ nghe dư ra trong replace gộp vào từ mẫu cuối cùng của cặp.
+            count = min(i2 - i1, j2 - j1)
+            for offset in range(i2 - i1):
+                mapping[i1 + offset] = j1 + min(offset, count - 1)
+            skipped += range(j1 + count, j2)
+        elif tag == "insert":
+            skipped += range(j1, j2)
+    return mapping, skipped
+
+
+def problem_regions(
+    words: list[dict], threshold: float, margin: float, duration: float
+) -> list[dict]:
+    """
+    Các đoạn (start, end, chỉ số từ) quanh những từ có confidence < threshold,
+    đã cộng margin mỗi bên và gộp khi chồng nhau.
+    """
+    regions: list[dict] = []
+    for index, word in enumerate(words):
+        if word["confidence"] >= threshold:
+            continue
+        start = max(0.0, word["start"] - margin)
+        end = min(duration, word["end"] + margin)
+        if regions and start <= regions[-1]["end"]:
+            regions[-1]["end"] = max(regions[-1]["end"], end)
+            regions[-1]["words"].append(index)
+        else:
+            regions.append({"start": start, "end": end, "words": [index]})
+    return regions
+
+
+def _record(full_seconds: float, sent_seconds: float, sliced: bool) -> None:
+    with _lock:
+        _stats["analyses"] += 1
+        _stats["sliced"] += int(sliced)
+        _stats["full_seconds"] += full_seconds
+        _stats["sent_seconds"] += sent_seconds
+
+
+def plan_slices(path: str, expected_text: str) -> dict | None:
+    """
+    Kế hoạch gửi audio theo đoạn cho một bản ghi và văn bản mẫu: transcript,
+    segments (start, end, heard, expected, data, mime_type), skipped (từ mẫu
+    không nghe thấy), pause_note (ngắt nghỉ của cả bản ghi, để vẫn nhận xét
+    được độ trôi chảy), sent_seconds và full_seconds. None nghĩa là gửi cả
+    bản ghi.
+    """
+    if os.getenv("AI_WORD_SLICES", "1") == "0":
+        return None
+    try:
+        recognized = recognize_words(path)
+    except Exception as e:
+        print(f"Lỗi STT khi cắt đoạn theo từ: {e}")
+        return None
+
+    # Thời lượng audio sẽ gửi nếu không cắt đoạn (đã bỏ lặng đầu/cuối).
+    prepared = prepare_file(path)
+    full_seconds = prepared.duration or recognized["duration"]
+    words = recognized["words"]
+    regions = problem_regions(
+        words,
+        float(os.getenv("AI_WORD_CONFIDENCE_THRESHOLD", DEFAULT_CONFIDENCE_THRESHOLD)),
+        float(os.getenv("AI_WORD_MARGIN_SECONDS", DEFAULT_MARGIN_SECONDS)),
+        recognized["duration"],
+    )
+    sent_seconds = sum(region["end"] - region["start"] for region in regions)
+    if not regions or sent_seconds > MAX_SLICED_RATIO * full_seconds:
+        _record(full_seconds, full_seconds, sliced=False)
+        return None
+
+    expected = re.findall(r"[A-Za-z0-9'-]+", expected_text)
+    mapping, skipped = align([word["word"] for word in words], expected)
+    samples, sample_rate, encoding = load_samples(path)
+    segments = []
+    for region in regions:
+        targets = [mapping[index] for index in region["words"]]
+        targets = [index for index in targets if index is not None]
+        piece = samples[
+            int(region["start"] * sample_rate) : int(region["end"] * sample_rate)
+        ]
+        segments.append(
+            {
+                "start": round(region["start"], 2),
+                "end": round(region["end"], 2),
+                "heard": " ".join(words[index]["word"] for index in region["words"]),
+                "expected": (
+                    " ".join(expected[min(targets) : max(targets) + 1])
+                    if targets
+                    else ""
+                ),
+                "data": encode(piece, sample_rate, encoding),
+                "mime_type": ENCODINGS[encoding][0],
+            }
+        )
+    _record(full_seconds, sent_seconds, sliced=True)
+    return {
+        "transcript": recognized["transcript"],
+        "segments": segments,
+        "skipped": [expected[index] for index in skipped],
+        "pause_note": pause_note(prepared),
+        "sent_seconds": round(sent_seconds, 2),
+        "full_seconds": full_seconds,
+    }
+
+
+def slice_parts(plan: dict) -> list[dict]:
+    """
+    Các part cho contents của Gemini: ghi chú về cách cắt, rồi từng đoạn audio
+    kèm văn bản mẫu và những gì STT nghe được.
+    """
+    skipped = ", ".join(plan["skipped"]) or "không có"
+    parts = [
+        {
+            "text": (
+                f"Audio đính kèm không phải cả bản ghi mà chỉ gồm "
+                f"{len(plan['segments'])} đoạn ({plan['sent_seconds']:.1f} giây "
+                f"trên tổng {plan['full_seconds']:.1f} giây) chứa các từ mà hệ "
+                f"thống nhận dạng giọng nói nghe chưa rõ. Phần còn lại nghe rõ; "
+                f"toàn bộ những gì nghe được: \"{plan['transcript']}\". Từ trong "
+                f"văn bản mẫu không nghe thấy: {skipped}. Hãy chấm điểm và nhận "
+                f"xét dựa trên các đoạn này, coi các từ còn lại là đọc đúng."
+            )
+        }
+    ]
+    if plan["pause_note"]:
+        parts.append({"text": plan["pause_note"]})
+    uploads = default_uploads()
+    for number, segment in enumerate(plan["segments"], 1):
+        parts.append(
+            {
+                "text": (
+                    f"Đoạn {number} ({segment['start']:.2f}-{segment['end']:.2f} "
+                    f"giây): cần đọc \"{segment['expected']}\", nhận dạng được "
+                    f"\"{segment['heard']}\"."
+                )
+            }
+        )
+        parts.append(uploads.part(segment["data"], segment["mime_type"]))
+    return parts
+
+
+def with_transcript(
+    result: dict, plan: dict | None, field: str = "transcribed_text"
+) -> dict:
+    """
+    Khi gửi theo đoạn, Gemini chỉ nghe một phần bản ghi: thay trường transcript
+    của kết quả bằng transcript STT của cả bản ghi.
+    """
+    if plan is not None and "error" not in result:
+        result[field] = plan["transcript"]
+    return result
+
+
+def get_stats() -> dict:
+    """
+    Số lần phân tích, số lần gửi theo đoạn, số giây audio gửi đi so với cả
+    bản ghi và số token audio tiết kiệm được.
+    """
+    with _lock:
+        stats = dict(_stats)
+    saved = stats["full_seconds"] - stats["sent_seconds"]
+    stats["tokens_saved"] = int(saved * AUDIO_TOKENS_PER_SECOND)
+    stats["sent_ratio"] = (
+        stats["sent_seconds"] / stats["full_seconds"] if stats["full_seconds"] else 1.0
+    )
+    return stats
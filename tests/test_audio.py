@@ -0,0 +1,111 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from common import audio
+from common.audio import (
+    RESAMPLE_BLOCK_SECONDS,
+    RESAMPLE_MARGIN_SECONDS,
+    _resample_block,
+    parse_wav,
+    prepare,
+    resample,
+    to_pcm16,
+    trim_silence,
+    wav_header,
+)
+
+TARGET_RATE = 16000
+
+
+def _tone(seconds, rate, frequency=440.0, amplitude=0.3):
+    t = np.arange(int(seconds * rate)) / rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def _interior(difference):
+    # Hai đầu bản ghi: FFT một lần cũng méo (coi tín hiệu là tuần hoàn), không so.
+    edge = int(RESAMPLE_MARGIN_SECONDS * TARGET_RATE)
+    return np.abs(difference[edge:-edge]).max()
+
+
+@pytest.mark.parametrize("source_rate", [22050, 44100, 48000])
+def test_block_resample_matches_single_fft_for_band_limited_audio(source_rate):
+    samples = _tone(25, source_rate) + _tone(25, source_rate, 3000, 0.2)
+    assert len(samples) > RESAMPLE_BLOCK_SECONDS * source_rate
+
+    blocked = resample(samples, source_rate, TARGET_RATE)
+    single = _resample_block(samples, source_rate, TARGET_RATE)
+
+    assert len(blocked) == len(single) == 25 * TARGET_RATE
+    assert _interior(blocked - single) < 1e-5
+
+
+@pytest.mark.parametrize("source_rate", [22050, 44100, 48000])
+def test_block_resample_tolerance_for_white_noise(source_rate):
+    # Trường hợp xấu nhất: nhiều năng lượng sát tần số cắt, đuôi sinc tắt chậm
+    # nên phần đệm RESAMPLE_MARGIN_SECONDS chỉ giữ sai khác ở mức ~3e-3.
+    samples = (0.3 * np.random.default_rng(0).standard_normal(25 * source_rate)).astype(
+        np.float32
+    )
+
+    blocked = resample(samples, source_rate, TARGET_RATE)
+    single = _resample_block(samples, source_rate, TARGET_RATE)
+
+    assert _interior(blocked - single) < 5e-3
+
+
+def test_wav_roundtrip():
+    samples = _tone(0.5, TARGET_RATE)
+    pcm = to_pcm16(samples.copy())
+    data = wav_header(pcm.nbytes, TARGET_RATE) + pcm.tobytes()
+
+    parsed, rate = parse_wav(data)
+
+    assert rate == TARGET_RATE
+    assert np.abs(parsed.reshape(-1) - samples).max() < 1e-4
+
+
+def test_trim_silence_cuts_edges_and_shortens_long_pauses():
+    rate = TARGET_RATE
+    silence = np.zeros(rate, dtype=np.float32)
+    speech = _tone(1, rate)
+    samples = np.concatenate((silence, speech, silence, silence, speech, silence))
+
+    trimmed, stats = trim_silence(samples, rate, max_pause=0.5)
+
+    assert stats["leading_silence"] == 1.0
+    assert stats["trailing_silence"] == 1.0
+    assert stats["pause_count"] == 1
+    assert stats["longest_pause"] == 2.0
+    # Giữ TRIM_PADDING_SECONDS mỗi đầu, lần ngừng 2 s còn 0.5 s.
+    expected = 2 + 0.5 + 2 * audio.TRIM_PADDING_SECONDS
+    assert len(trimmed) / rate == pytest.approx(expected)
+    assert stats["removed_seconds"] == pytest.approx(6 - expected)
+
+
+def test_trim_silence_keeps_all_silent_audio():
+    samples = np.zeros(TARGET_RATE, dtype=np.float32)
+
+    trimmed, stats = trim_silence(samples, TARGET_RATE)
+
+    assert len(trimmed) == len(samples)
+    assert stats["speech_seconds"] == 0.0
+    assert stats["removed_seconds"] == 0.0
+
+
+def test_prepare_downmixes_resamples_and_trims():
+    rate = 44100
+    mono = np.concatenate((np.zeros(rate, dtype=np.float32), _tone(1, rate)))
+    stereo = to_pcm16(np.repeat(mono, 2))
+    data = wav_header(stereo.nbytes, rate, channels=2) + stereo.tobytes()
+
+    prepared = prepare(data, sample_rate=TARGET_RATE, encoding="wav", trim=True)
+
+    assert prepared.sample_rate == TARGET_RATE
+    assert prepared.duration == pytest.approx(1 + audio.TRIM_PADDING_SECONDS)
+    assert prepared.pauses["leading_silence"] == 1.0
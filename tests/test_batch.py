@@ -0,0 +1,87 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from common.batch import LocalBatchBackend, run_bulk
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashAfterSubmit(LocalBatchBackend):
+    """
+    Job được tạo trên backend nhưng tiến trình chết trước khi kịp lưu tên job.
+    """
+
+    def submit(self, model, requests_path, display_name):
+        super().submit(model, requests_path, display_name)
+        raise Crash()
+
+
+def _responder(model, request):
+    return json.dumps({"score": 7})
+
+
+def _write_input(path, count):
+    with open(path, "w", encoding="utf-8") as f:
+        for index in range(count):
+            f.write(json.dumps({"id": index, "text": f"bài {index}"}) + "\n")
+
+
+def _build_contents(submission):
+    return [{"role": "user", "parts": [{"text": submission["text"]}]}]
+
+
+def _run(tmp_path, backend):
+    return run_bulk(
+        "gemini-2.5-flash",
+        str(tmp_path / "input.jsonl"),
+        str(tmp_path / "output.jsonl"),
+        _build_contents,
+        backend=backend,
+        chunk_size=2,
+        poll_interval=0,
+    )
+
+
+def _output_ids(tmp_path):
+    with open(tmp_path / "output.jsonl", encoding="utf-8") as f:
+        return [json.loads(line)["id"] for line in f]
+
+
+def test_resume_after_crash_does_not_resubmit(tmp_path):
+    _write_input(tmp_path / "input.jsonl", 5)
+    work_dir = str(tmp_path / "jobs")
+
+    with pytest.raises(Crash):
+        _run(tmp_path, CrashAfterSubmit(_responder, work_dir))
+    assert len(os.listdir(work_dir)) == 1
+
+    summary = _run(tmp_path, LocalBatchBackend(_responder, work_dir))
+
+    # Chunk đã gửi trước khi chết được tìm lại, không gửi lần hai.
+    assert len(os.listdir(work_dir)) == 3
+    assert summary["succeeded"] == 5
+    assert sorted(_output_ids(tmp_path)) == [str(index) for index in range(5)]
+    assert not os.path.exists(tmp_path / "output.jsonl.state.json")
+
+
+def test_resume_after_partial_output_line(tmp_path):
+    _write_input(tmp_path / "input.jsonl", 4)
+    work_dir = str(tmp_path / "jobs")
+    _run(tmp_path, LocalBatchBackend(_responder, work_dir))
+
+    # Giả lập tiến trình chết khi đang append dòng cuối của output.
+    output = tmp_path / "output.jsonl"
+    lines = output.read_text(encoding="utf-8").splitlines()
+    output.write_text("\n".join(lines[:-1]) + "\n" + lines[-1][:10], encoding="utf-8")
+
+    summary = _run(tmp_path, LocalBatchBackend(_responder, work_dir))
+
+    assert summary["succeeded"] == 1
+    assert sorted(_output_ids(tmp_path)) == [str(index) for index in range(4)]
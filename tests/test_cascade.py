@@ -0,0 +1,121 @@
+import asyncio
+import os
+import sys
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from common.cascade import (
+    ESCALATION_MODEL,
+    MIN_RECENT_REQUESTS,
+    Cascade,
+    cheap_model,
+    score_confidence,
+)
+from common.circuit_breaker import fallback_chain
+
+
+def _speculating(threshold=0.5):
+    cascade = Cascade("test", threshold, speculate_above=0.5)
+    # Các request gần đây đều bị chuyển tầng.
+    for _ in range(MIN_RECENT_REQUESTS):
+        cascade._record(0.0, 0.0)
+    assert cascade.should_speculate()
+    return cascade
+
+
+def test_score_confidence_by_distance_to_cut_points():
+    assert score_confidence({"score": 3.5}, "score", (3.5,), 0.5)[1] == 0.0
+    assert score_confidence({"score": 3.75}, "score", (3.5,), 0.5)[1] == 0.5
+    assert score_confidence({"score": 5}, "score", (3.5,), 0.5)[1] == 1.0
+    assert score_confidence({"error": "x"}, "score", (3.5,), 0.5)[1] == 0.0
+
+
+def test_confident_cheap_result_is_kept():
+    cascade = Cascade("test", 0.6)
+    calls = []
+
+    result = cascade.run(lambda: ("rẻ", 0.9), lambda: calls.append(1) or "mạnh")
+
+    assert result == "rẻ"
+    assert calls == []
+    assert cascade.stats()["escalation_rate"] == 0.0
+
+
+def test_low_confidence_escalates_without_falling_back_to_cheap_model(monkeypatch):
+    monkeypatch.setenv("GEMINI_FALLBACK_MODELS", f"{ESCALATION_MODEL}:{cheap_model()}")
+    cascade = Cascade("test", 0.6)
+    chains = []
+
+    def expensive():
+        chains.append(fallback_chain(ESCALATION_MODEL))
+        return "mạnh"
+
+    assert cascade.run(lambda: ("rẻ", 0.2), expensive) == "mạnh"
+    assert chains == [[ESCALATION_MODEL]]
+    assert fallback_chain(ESCALATION_MODEL) == [ESCALATION_MODEL, cheap_model()]
+    assert cascade.stats()["escalations"] == 1
+
+
+def test_disabled_cascade_calls_expensive_only():
+    cascade = Cascade("test", 0.6, enabled=False)
+    calls = []
+
+    assert cascade.run(lambda: calls.append(1), lambda: "mạnh") == "mạnh"
+    assert calls == []
+
+
+def test_speculative_async_expensive_is_cancelled_when_cheap_is_confident():
+    cascade = _speculating()
+    started = threading.Event()
+    cancelled = threading.Event()
+
+    async def aexpensive():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return "mạnh"
+
+    def cheap():
+        started.wait(1)
+        return "rẻ", 0.9
+
+    assert cascade.run(cheap, lambda: "mạnh", aexpensive=aexpensive) == "rẻ"
+    assert cancelled.wait(1)
+    assert cascade.stats()["speculation_wasted"] == 1
+
+
+def test_speculative_result_is_used_when_cheap_is_not_confident():
+    cascade = _speculating()
+
+    assert cascade.run(lambda: ("rẻ", 0.1), lambda: "mạnh") == "mạnh"
+    stats = cascade.stats()
+    assert stats["speculations"] == 1
+    assert stats["speculation_wasted"] == 0
+
+
+def test_arun_speculation_cancels_expensive_task():
+    cascade = _speculating()
+    cancelled = []
+
+    async def expensive():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def cheap():
+        await asyncio.sleep(0.01)
+        return "rẻ", 0.9
+
+    async def main():
+        result = await cascade.arun(cheap, expensive)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == "rẻ"
+    assert cancelled == [1]
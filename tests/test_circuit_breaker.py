@@ -0,0 +1,135 @@
+import os
+import sys
+
+import pytest
+from google.genai import errors, types
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from common import circuit_breaker, gemini_call
+from common.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    call_with_fallback,
+    fallback_chain,
+    get_breaker,
+    no_fallback_to,
+)
+from common.response_cache import ResponseCache
+
+
+def _server_error():
+    return errors.APIError(503, {"error": {"code": 503, "status": "UNAVAILABLE"}})
+
+
+def test_opens_after_consecutive_failures_and_rejects():
+    breaker = CircuitBreaker("m", consecutive_failures=3, open_seconds=60)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record(0.1, failed=True)
+
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_opens_when_most_recent_calls_are_slow():
+    breaker = CircuitBreaker("m", min_calls=4, slow_seconds=1.0, slow_rate=0.5)
+    for latency in (0.1, 2.0, 0.1, 2.0):
+        breaker.record(latency, failed=False)
+
+    assert breaker.state == OPEN
+
+
+def test_half_open_probe_closes_or_reopens(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker("m", consecutive_failures=1, open_seconds=30)
+    breaker.record(0.1, failed=True)
+    assert breaker.state == OPEN
+
+    now[0] = 31.0
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Chỉ một lượt thử trong half-open.
+    assert not breaker.allow()
+    breaker.record(0.1, failed=True)
+    assert breaker.state == OPEN
+
+    now[0] = 62.0
+    assert breaker.allow()
+    breaker.record(0.1, failed=False)
+    assert breaker.state == CLOSED
+
+
+def test_released_probe_can_be_retried(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker("m", consecutive_failures=1, open_seconds=30)
+    breaker.record(0.1, failed=True)
+    now[0] = 31.0
+
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_no_fallback_unless_configured(monkeypatch):
+    monkeypatch.delenv("GEMINI_FALLBACK_MODELS", raising=False)
+    assert fallback_chain("gemini-2.5-flash") == ["gemini-2.5-flash"]
+
+    monkeypatch.setenv("GEMINI_FALLBACK_MODELS", "a:b,b:c,c:a")
+    assert fallback_chain("a") == ["a", "b", "c"]
+    with no_fallback_to("b"):
+        assert fallback_chain("a") == ["a", "c"]
+
+
+def test_call_with_fallback_moves_on_after_model_failure(monkeypatch):
+    monkeypatch.setenv("GEMINI_FALLBACK_MODELS", "test-primary:test-backup")
+    attempts = []
+
+    def func(target):
+        attempts.append(target)
+        if target == "test-primary":
+            raise _server_error()
+        return target
+
+    assert call_with_fallback("test-primary", func) == "test-backup"
+    assert attempts == ["test-primary", "test-backup"]
+    assert get_breaker("test-primary").stats()["failures"] == 1
+
+
+def test_request_errors_do_not_fall_back(monkeypatch):
+    monkeypatch.setenv("GEMINI_FALLBACK_MODELS", "test-bad-request:test-other")
+
+    def func(target):
+        raise errors.APIError(400, {"error": {"code": 400}})
+
+    with pytest.raises(errors.APIError):
+        call_with_fallback("test-bad-request", func)
+    assert get_breaker("test-bad-request").state == CLOSED
+
+
+def test_fallback_response_is_marked_and_not_cached(monkeypatch, tmp_path):
+    monkeypatch.setenv("GEMINI_FALLBACK_MODELS", "test-served:test-served-backup")
+    for _ in range(3):
+        get_breaker("test-served").record(0.1, failed=True)
+
+    def generate(target, contents, config):
+        return types.GenerateContentResponse(
+            candidates=[
+                types.Candidate(
+                    content=types.Content(role="model", parts=[types.Part(text="{}")])
+                )
+            ]
+        )
+
+    monkeypatch.setattr(gemini_call, "_generate", generate)
+    cache = ResponseCache(cache_dir=str(tmp_path))
+
+    response = gemini_call.generate_content("test-served", "xin chào", cache=cache)
+
+    assert response.model_version == "test-served-backup"
+    assert cache.stats()["memory_entries"] == 0
@@ -0,0 +1,84 @@
+import datetime
+import os
+import sys
+import threading
+import time
+
+from google.genai import types
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from common.context_cache import ContextCache, system_config
+
+
+class Caches:
+    """
+    Thay client.caches: create chậm để thấy các lời gọi có chạy song song không.
+    """
+
+    def __init__(self):
+        self.created = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def create(self, model, config):
+        with self._lock:
+            self.created.append(config.system_instruction)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.2)
+        with self._lock:
+            self.running -= 1
+        expire_time = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+            hours=1
+        )
+        return types.CachedContent(
+            name=f"cachedContents/{len(self.created)}", expire_time=expire_time
+        )
+
+
+class Client:
+    def __init__(self):
+        self.caches = Caches()
+
+
+def _resolve_all(cache, configs):
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda config=config: results.append(
+                cache.resolve("gemini-2.5-flash", config)
+            )
+        )
+        for config in configs
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_same_rubric_is_created_once():
+    client = Client()
+    cache = ContextCache(client=client)
+    config = system_config("test", "Rubric A")
+
+    results = _resolve_all(cache, [config] * 4)
+
+    assert client.caches.created == ["Rubric A"]
+    assert {result.cached_content for result in results} == {"cachedContents/1"}
+    assert all(result.system_instruction is None for result in results)
+
+
+def test_different_rubrics_are_created_in_parallel():
+    client = Client()
+    cache = ContextCache(client=client)
+    configs = [system_config("test", f"Rubric {i}") for i in range(3)]
+
+    _resolve_all(cache, configs)
+
+    assert sorted(client.caches.created) == ["Rubric 0", "Rubric 1", "Rubric 2"]
+    assert client.caches.max_running == 3
+    assert cache.stats()["test"]["creates"] == 3
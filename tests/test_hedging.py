@@ -0,0 +1,142 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from common.hedging import HedgePolicy
+
+
+def _policy(budget=1.0, latency=0.05):
+    policy = HedgePolicy(budget=budget, control_rate=0.0, min_samples=5)
+    for _ in range(5):
+        policy._record("m", latency)
+    return policy
+
+
+def _slow_then_fast():
+    # Lần gọi đầu (bản chính) chậm, lần sau (bản hedge) nhanh.
+    calls = []
+    lock = threading.Lock()
+
+    def func():
+        with lock:
+            calls.append(1)
+            attempt = len(calls)
+        time.sleep(1.0 if attempt == 1 else 0.01)
+        return attempt
+
+    return func, calls
+
+
+def test_no_hedge_until_enough_samples():
+    policy = HedgePolicy(control_rate=0.0, min_samples=5)
+
+    assert policy.delay("m") is None
+    assert policy.call("m", lambda: "ok") == "ok"
+    assert policy.stats()["hedged"] == 0
+
+
+def test_slow_primary_is_hedged_and_hedge_wins():
+    policy = _policy()
+    func, calls = _slow_then_fast()
+
+    start = time.perf_counter()
+    assert policy.call("m", func) == 2
+    assert time.perf_counter() - start < 0.5
+
+    stats = policy.stats()
+    assert len(calls) == 2
+    assert stats["hedged"] == 1
+    assert stats["hedge_wins"] == 1
+
+
+def test_fast_primary_is_not_hedged():
+    policy = _policy()
+    calls = []
+
+    assert policy.call("m", lambda: calls.append(1) or "ok") == "ok"
+    assert len(calls) == 1
+    assert policy.stats()["hedged"] == 0
+
+
+def test_budget_and_admit_limit_hedges():
+    policy = _policy(budget=0.0)
+    func, calls = _slow_then_fast()
+
+    assert policy.call("m", func) == 1
+    assert len(calls) == 1
+    assert policy.stats()["over_budget"] == 1
+
+    policy = _policy()
+    func, calls = _slow_then_fast()
+
+    assert policy.call("m", func, admit=lambda: False) == 1
+    assert len(calls) == 1
+    assert policy.stats()["no_quota"] == 1
+
+
+def test_primary_error_falls_back_to_hedge():
+    policy = _policy()
+    calls = []
+
+    def func():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.2)
+            raise RuntimeError("lỗi")
+        time.sleep(0.3)
+        return "ok"
+
+    assert policy.call("m", func) == "ok"
+
+
+def test_async_loser_is_cancelled():
+    policy = _policy()
+    started = []
+    cancelled = []
+
+    async def func():
+        attempt = len(started) + 1
+        started.append(attempt)
+        try:
+            await asyncio.sleep(1.0 if attempt == 1 else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(attempt)
+            raise
+        return attempt
+
+    async def main():
+        result = await policy.acall("m", func)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == 2
+    assert cancelled == [1]
+
+
+def test_async_caller_cancellation_cancels_both_requests():
+    policy = _policy()
+    cancelled = []
+
+    async def func():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def main():
+        task = asyncio.create_task(policy.acall("m", func))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert len(cancelled) == 2
@@ -0,0 +1,75 @@
+import json
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from common.json_stream import IncrementalJSONParser
+
+DATA = {
+    "overall_score": 7,
+    "feedback": 'Câu "hay", có {ngoặc} và [mảng]\\ và \\"',
+    "errors": [{"word": "a,b", "fix": "}"}, {"word": "x"}],
+    "criteria_breakdown": {
+        "grammar": {"score": 6, "notes": ["thì, số"]},
+        "vocabulary": {"score": 8},
+        "summary": "ổn",
+    },
+    "done": True,
+}
+
+
+def _feed_all(parser, text, size):
+    fields = []
+    for i in range(0, len(text), size):
+        fields += parser.feed(text[i : i + size])
+    return fields
+
+
+def test_top_level_fields_in_any_chunking():
+    text = "```json\n" + json.dumps(DATA, ensure_ascii=False, indent=2) + "\n```"
+    for size in (1, 3, 7, len(text)):
+        parser = IncrementalJSONParser()
+
+        fields = _feed_all(parser, text, size)
+
+        assert fields == list(DATA.items())
+        assert parser.done
+
+
+def test_fields_are_returned_as_soon_as_they_are_complete():
+    parser = IncrementalJSONParser()
+
+    assert parser.feed('Kết quả: {"overall_score": 7, "feedback": "tố') == [
+        ("overall_score", 7)
+    ]
+    assert parser.feed('t"') == []
+    assert parser.feed("}") == [("feedback", "tốt")]
+    assert parser.done
+    # Bỏ qua mọi thứ sau object đầu tiên.
+    assert parser.feed('{"khác": 1}') == []
+
+
+def test_max_depth_two_returns_nested_blocks():
+    text = json.dumps(DATA, ensure_ascii=False)
+    parser = IncrementalJSONParser(max_depth=2)
+
+    paths = [path for path, _ in _feed_all(parser, text, 5)]
+    fields = dict(_feed_all(IncrementalJSONParser(max_depth=2), text, 5))
+
+    assert fields["criteria_breakdown.grammar"] == DATA["criteria_breakdown"]["grammar"]
+    assert fields["criteria_breakdown.vocabulary"] == {"score": 8}
+    assert fields["criteria_breakdown.summary"] == "ổn"
+    # Khối con đến trước, sau đó vẫn có cả trường cấp cao nhất.
+    assert fields["criteria_breakdown"] == DATA["criteria_breakdown"]
+    assert paths.index("criteria_breakdown.summary") < paths.index("criteria_breakdown")
+    # Mảng không được tách, kể cả khi chứa object.
+    assert fields["errors"] == DATA["errors"]
+    assert fields["overall_score"] == 7
+
+
+def test_incomplete_stream_is_not_done():
+    parser = IncrementalJSONParser()
+
+    assert parser.feed('{"a": 1, "b": {"c": ') == [("a", 1)]
+    assert not parser.done
@@ -0,0 +1,108 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from common import long_stt
+from common.audio import to_pcm16, wav_header
+from common.long_stt import split_at_silence, stitch, transcribe_long
+
+RATE = 16000
+# Các "từ" 0.4 s cách nhau 0.2 s, mỗi 8 giây có một khoảng lặng 1.5 s.
+WORD_SECONDS = 0.4
+GAP_SECONDS = 0.2
+
+
+def _timeline(seconds):
+    words = []
+    t = 0.3
+    while t + WORD_SECONDS < seconds:
+        words.append((f"w{len(words)}", round(t, 3), round(t + WORD_SECONDS, 3)))
+        t += WORD_SECONDS + GAP_SECONDS
+        if int(t) % 8 == 7:
+            t += 1.5
+    return words
+
+
+def _samples(words, seconds):
+    samples = np.zeros(int(seconds * RATE), dtype=np.float32)
+    tone = 0.3 * np.sin(2 * np.pi * 440 * np.arange(int(WORD_SECONDS * RATE)) / RATE)
+    for _, start, _ in words:
+        samples[int(start * RATE) : int(start * RATE) + len(tone)] = tone
+    return samples
+
+
+def _word(word, start, end):
+    return {"word": word, "start": start, "end": end, "confidence": 0.9}
+
+
+def test_split_cuts_inside_silence_and_covers_audio():
+    words = _timeline(60)
+    samples = _samples(words, 60)
+
+    chunks = split_at_silence(samples, RATE, chunk_seconds=20, overlap_seconds=1)
+
+    assert chunks[0][2] == 0 and chunks[-1][3] == len(samples)
+    for (start, end, own_start, own_end), following in zip(chunks, chunks[1:] + [None]):
+        assert (end - start) / RATE <= 20
+        assert start <= own_start < own_end <= end
+        if following is not None:
+            assert following[2] == own_end
+            # Điểm cắt không rơi vào giữa một từ.
+            cut = own_end / RATE
+            assert not any(s < cut < e for _, s, e in words)
+
+
+def test_stitch_keeps_overlap_words_once():
+    chunks = [(0, 6 * RATE, 0, 5 * RATE), (4 * RATE, 10 * RATE, 5 * RATE, 10 * RATE)]
+    first = [
+        {
+            "transcript": "a b c",
+            "confidence": 0.8,
+            "words": [_word("a", 1.0, 1.5), _word("b", 4.2, 4.6), _word("c", 5.1, 5.6)],
+        }
+    ]
+    second = [
+        {
+            "transcript": "b c d",
+            "confidence": 0.6,
+            "words": [_word("b", 4.2, 4.6), _word("c", 5.1, 5.6), _word("d", 8.0, 8.4)],
+        }
+    ]
+
+    result = stitch([first, second], chunks, RATE)
+
+    assert result["transcript"] == "a b c d"
+    assert [word["word"] for word in result["words"]] == ["a", "b", "c", "d"]
+    assert result["confidence"] == (0.8 * 2 + 0.6 * 2) / 4
+
+
+def test_transcribe_long_returns_each_word_once(tmp_path, monkeypatch):
+    words = _timeline(70)
+    pcm = to_pcm16(_samples(words, 70))
+    path = tmp_path / "long.wav"
+    path.write_bytes(wav_header(pcm.nbytes, RATE) + pcm.tobytes())
+    monkeypatch.setenv("AI_AUDIO_SAMPLE_RATE", str(RATE))
+
+    def recognize_chunk(samples, sample_rate, encoding, offset, language_code):
+        # STT giả: trả về các từ nằm trọn trong đoạn, thời điểm đã cộng offset.
+        end = offset + len(samples) / sample_rate
+        heard = [_word(w, s, e) for w, s, e in words if offset <= s and e <= end]
+        return [
+            {
+                "transcript": " ".join(word["word"] for word in heard),
+                "confidence": 0.9,
+                "words": heard,
+            }
+        ]
+
+    monkeypatch.setattr(long_stt, "_recognize_chunk", recognize_chunk)
+
+    result = transcribe_long(str(path), chunk_seconds=30, overlap_seconds=1)
+
+    assert result["chunks"] >= 3
+    assert result["duration"] == 70
+    assert [word["word"] for word in result["words"]] == [w for w, _, _ in words]
+    assert result["transcript"] == " ".join(w for w, _, _ in words)
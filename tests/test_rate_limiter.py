@@ -0,0 +1,125 @@
+import asyncio
+import os
+import sys
+
+import pytest
+from google.genai import errors
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from common.rate_limiter import (
+    AdaptiveRateLimiter,
+    astream_with_limits,
+    call_with_limits,
+    get_limiter,
+    stream_with_limits,
+)
+
+
+def _throttled(retry_delay="0.01s"):
+    return errors.APIError(
+        429,
+        {
+            "error": {
+                "code": 429,
+                "status": "RESOURCE_EXHAUSTED",
+                "message": "quota",
+                "details": [{"retryDelay": retry_delay}],
+            }
+        },
+    )
+
+
+class Chunk:
+    def __init__(self, text, total_tokens=None):
+        self.text = text
+        self.usage_metadata = (
+            type("Usage", (), {"total_token_count": total_tokens})()
+            if total_tokens is not None
+            else None
+        )
+
+
+def test_throttle_lowers_limit_to_observed_rate_and_recovers():
+    limiter = AdaptiveRateLimiter(rpm=100, tpm=100_000)
+    for _ in range(10):
+        limiter.acquire(10)
+
+    delay = limiter.on_throttled(_throttled("2s"))
+
+    assert delay == 2.0
+    # Mỗi lần 429 giảm tối đa một nửa.
+    assert limiter.stats()["effective_rpm"] == 50
+    assert limiter.stats()["throttled"] == 1
+    limiter.on_success()
+    assert limiter.stats()["effective_rpm"] == 51
+
+
+def test_call_with_limits_retries_after_429():
+    attempts = []
+
+    def func():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise _throttled()
+        return Chunk("ok", total_tokens=5)
+
+    assert call_with_limits("test-call-retry", "xin chào", func).text == "ok"
+    assert len(attempts) == 3
+    assert get_limiter("test-call-retry").stats()["throttled"] == 2
+
+
+def test_call_with_limits_gives_up_after_max_retries():
+    def func():
+        raise _throttled()
+
+    with pytest.raises(errors.APIError):
+        call_with_limits("test-call-give-up", "x", func, max_retries=1)
+
+
+def test_stream_counts_quota_and_retries_when_opening(monkeypatch):
+    opened = []
+    usage = []
+    limiter = get_limiter("test-stream")
+    monkeypatch.setattr(
+        limiter, "record_usage", lambda estimated, actual: usage.append(actual)
+    )
+
+    def func():
+        opened.append(1)
+        if len(opened) == 1:
+            raise _throttled()
+        return iter([Chunk("a"), Chunk("b", total_tokens=500)])
+
+    chunks = list(stream_with_limits("test-stream", "x" * 400, func))
+
+    assert [chunk.text for chunk in chunks] == ["a", "b"]
+    assert len(opened) == 2
+    assert limiter.stats()["requests"] == 2
+    assert limiter.stats()["throttled"] == 1
+    # Số token thực tế lấy từ chunk cuối.
+    assert usage == [500]
+
+
+def test_astream_retries_when_first_chunk_is_throttled():
+    opened = []
+
+    async def func():
+        opened.append(1)
+        attempt = len(opened)
+
+        async def chunks():
+            if attempt == 1:
+                raise _throttled()
+            yield Chunk("a")
+            yield Chunk("b")
+
+        return chunks()
+
+    async def collect():
+        return [
+            chunk.text async for chunk in astream_with_limits("test-astream", "x", func)
+        ]
+
+    assert asyncio.run(collect()) == ["a", "b"]
+    assert len(opened) == 2
@@ -0,0 +1,74 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from common import response_cache
+from common.response_cache import ResponseCache, make_key
+
+
+def test_key_ignores_dict_order_and_hashes_media():
+    audio = b"\x00\x01" * 1000
+    key = make_key("m", [{"text": "a", "data": audio}], {"b": 1, "a": 2})
+
+    assert key == make_key("m", [{"data": audio, "text": "a"}], {"a": 2, "b": 1})
+    assert key != make_key("m", [{"text": "a", "data": audio + b"\x00"}])
+
+
+def test_disk_hit_after_memory_eviction(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path), max_memory_entries=1)
+    cache.set("a", "1")
+    cache.set("b", "2")
+
+    assert cache.get("a") == "1"
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_disk_is_scanned_only_when_limit_is_crossed(tmp_path, monkeypatch):
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr(
+        response_cache.os, "scandir", lambda path: scans.append(path) or scandir(path)
+    )
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    cache.set("k0", "x" * 100)
+    size = os.path.getsize(tmp_path / "k0.json")
+    cache.max_disk_bytes = 20 * size + size // 2
+
+    def put(i):
+        cache.set(f"k{i}", "x" * 100)
+        # mtime tăng dần để thứ tự xoá ổn định.
+        os.utime(tmp_path / f"k{i}.json", (1000 + i, 1000 + i))
+
+    for i in range(20):
+        put(i)
+    # Chỉ quét một lần lúc đầu; sau đó cộng dồn dung lượng.
+    assert len(scans) == 1
+    assert cache.stats()["disk_entries"] == 20
+
+    # File thứ 21 vượt giới hạn: quét và xoá xuống dưới DISK_EVICT_RATIO.
+    put(20)
+    assert len(scans) == 2
+    assert cache.stats()["disk_entries"] == 18
+    assert not (tmp_path / "k0.json").exists()
+
+    put(21)
+    put(22)
+    stats = cache.stats()
+    assert len(scans) == 2
+    assert stats["disk_entries"] == len(list(tmp_path.glob("*.json"))) == 20
+    assert stats["disk_bytes"] == sum(
+        path.stat().st_size for path in tmp_path.glob("*.json")
+    )
+
+
+def test_malformed_disk_entry_is_a_miss(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    (tmp_path / "bad.json").write_text('{"text": "thiếu stored_at"}', encoding="utf-8")
+    (tmp_path / "list.json").write_text("[]", encoding="utf-8")
+
+    assert cache.get("bad") is None
+    assert cache.get("list") is None
+    assert cache.stats()["misses"] == 2
+    cache.set("bad", "ok")
+    assert ResponseCache(cache_dir=str(tmp_path)).get("bad") == "ok"
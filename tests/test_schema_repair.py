@@ -0,0 +1,98 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from common import gemini_call
+from common.schemas import INTEGER, STRING, _arr, _obj, validate
+
+SCHEMA = _obj(
+    overall_score=INTEGER,
+    feedback=_obj(fluency=STRING, intonation=STRING),
+    errors=_arr(_obj(word=STRING, suggestion=STRING)),
+)
+CONTENTS = [{"role": "user", "parts": [{"text": "Chấm bài."}]}]
+VALID = {
+    "overall_score": 80,
+    "feedback": {"fluency": "tốt", "intonation": "tốt"},
+    "errors": [{"word": "apple", "suggestion": "nhấn âm đầu"}],
+}
+
+
+class Response:
+    def __init__(self, data):
+        self.text = data if isinstance(data, str) else json.dumps(data)
+        self.usage_metadata = None
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """
+    Thay generate_content bằng hàng đợi response; ghi lại schema của mỗi lần gọi.
+    """
+    replies = []
+    schemas = []
+
+    def generate_content(model, contents, config=None, cache=None):
+        schemas.append(sorted(_properties(config.response_schema)))
+        return Response(replies.pop(0))
+
+    monkeypatch.setattr(gemini_call, "generate_content", generate_content)
+    return replies, schemas
+
+
+def _properties(schema) -> dict:
+    if isinstance(schema, dict):
+        return schema["properties"]
+    return schema.properties
+
+
+def test_validate_reports_nested_paths():
+    data = {
+        "overall_score": "80",
+        "feedback": {"fluency": "tốt"},
+        "errors": [{"word": "apple"}],
+    }
+
+    assert validate(SCHEMA, data) == [
+        "overall_score",
+        "feedback.intonation",
+        "errors[0].suggestion",
+    ]
+    assert validate(SCHEMA, VALID) == []
+    assert validate(SCHEMA, [VALID]) == ["$"]
+
+
+def test_repair_requests_only_invalid_fields(gemini):
+    replies, schemas = gemini
+    replies += [
+        {"overall_score": 80, "feedback": {"fluency": "tốt"}, "errors": []},
+        {"feedback": {"fluency": "tốt", "intonation": "khá"}},
+    ]
+
+    data = gemini_call.generate_json("gemini-2.5-flash", CONTENTS, SCHEMA)
+
+    assert data["feedback"]["intonation"] == "khá"
+    assert data["overall_score"] == 80
+    assert schemas == [sorted(SCHEMA["properties"]), ["feedback"]]
+
+
+def test_root_level_error_requests_full_object(gemini):
+    replies, schemas = gemini
+    replies += [[VALID], VALID]
+
+    data = gemini_call.generate_json("gemini-2.5-flash", CONTENTS, SCHEMA)
+
+    assert data == VALID
+    assert schemas == [sorted(SCHEMA["properties"])] * 2
+
+
+def test_repair_that_still_fails_raises(gemini):
+    replies, _ = gemini
+    replies += [{"overall_score": 80}, {"feedback": "không phải object"}]
+
+    with pytest.raises(ValueError):
+        gemini_call.generate_json("gemini-2.5-flash", CONTENTS, SCHEMA)
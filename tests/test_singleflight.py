@@ -0,0 +1,84 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from common.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call_and_get_own_copy():
+    flight = SingleFlight("test")
+    calls = []
+
+    def func():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"words": ["a"]}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(flight.do("k", func)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert flight.stats()["coalesced"] == 3
+    # Mỗi người gọi sửa bản sao của mình.
+    results[0]["words"].append("b")
+    assert [result["words"] for result in results[1:]] == [["a"]] * 3
+
+
+def test_waiter_reruns_when_leader_is_cancelled():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def func():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "ok"
+
+    async def main():
+        leader = asyncio.create_task(flight.ado("k", func))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.ado("k", func))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await waiter, leader
+
+    result, leader = asyncio.run(main())
+
+    assert result == "ok"
+    assert leader.cancelled()
+    assert len(calls) == 2
+
+
+def test_shared_result_is_reused_then_expired_files_are_removed(tmp_path):
+    flight = SingleFlight("test", shared_dir=str(tmp_path), result_ttl=60)
+    other = SingleFlight("test", shared_dir=str(tmp_path), result_ttl=60)
+    calls = []
+
+    def func():
+        calls.append(1)
+        return {"text": "ok"}
+
+    assert flight.do("k", func) == {"text": "ok"}
+    # Một "tiến trình" khác đọc kết quả vừa ghi thay vì gọi lại.
+    assert other.do("k", func) == {"text": "ok"}
+    assert len(calls) == 1
+    assert other.stats()["cross_process_coalesced"] == 1
+
+    folder = tmp_path / "test"
+    old = time.time() - 120
+    for path in folder.iterdir():
+        os.utime(path, (old, old))
+    # Tiến trình mới khởi động quét ngay lần gọi đầu, xoá các file của "k".
+    SingleFlight("test", shared_dir=str(tmp_path), result_ttl=60).do("other", func)
+
+    assert sorted(path.suffix for path in folder.iterdir()) == [".json", ".lock"]
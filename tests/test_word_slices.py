@@ -0,0 +1,83 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from common import word_slices
+from common.word_slices import align, problem_regions, recognize_words
+
+
+def _word(word, start, end, confidence):
+    return {"word": word, "start": start, "end": end, "confidence": confidence}
+
+
+def test_concurrent_callers_share_one_stt_call(tmp_path, monkeypatch):
+    path = tmp_path / "sentence.wav"
+    path.write_bytes(b"RIFF")
+    calls = []
+
+    def transcribe_long(path, language_code):
+        calls.append(path)
+        time.sleep(0.2)
+        return {"transcript": "hello", "confidence": 0.9, "words": [], "duration": 1}
+
+    monkeypatch.setattr(word_slices, "transcribe_long", transcribe_long)
+    monkeypatch.setattr(word_slices, "_cache", word_slices.OrderedDict())
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(recognize_words(str(path))))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Lần gọi sau khi đã xong lấy từ cache.
+    results.append(recognize_words(str(path)))
+
+    assert len(calls) == 1
+    assert [result["transcript"] for result in results] == ["hello"] * 5
+
+
+def test_align_marks_extra_and_skipped_words():
+    heard = ["I", "um", "like", "apples"]
+    expected = ["I", "really", "like", "green", "apples"]
+
+    mapping, skipped = align(heard, expected)
+
+    assert mapping == [0, 1, 2, 4]
+    assert skipped == [3]
+
+
+def test_align_ignores_case_and_punctuation():
+    mapping, skipped = align(["Hello,", "world."], ["hello", "world"])
+
+    assert mapping == [0, 1]
+    assert skipped == []
+
+
+def test_problem_regions_adds_margin_and_merges_overlaps():
+    words = [
+        _word("the", 0.0, 0.2, 0.95),
+        _word("quick", 0.3, 0.6, 0.4),
+        _word("brown", 0.65, 0.9, 0.5),
+        _word("fox", 1.5, 1.8, 0.99),
+        _word("jumps", 2.5, 2.9, 0.3),
+    ]
+
+    regions = problem_regions(words, threshold=0.8, margin=0.15, duration=3.0)
+
+    assert [region["words"] for region in regions] == [[1, 2], [4]]
+    assert regions[0]["start"] == 0.15
+    assert regions[0]["end"] == 1.05
+    # Không vượt quá thời lượng bản ghi.
+    assert regions[1]["end"] == 3.0
+
+
+def test_problem_regions_empty_when_all_words_are_clear():
+    words = [_word("hi", 0.0, 0.3, 0.9)]
+
+    assert problem_regions(words, threshold=0.8, margin=0.15, duration=1.0) == []